@@ -1,9 +1,17 @@
 """
 Automated Backup System - Complete Dashboard with Backup Functionality
+
+The backup modules, and with them the Azure SDK, are imported in a
+background thread after startup, which then keeps checking that storage
+is reachable. /health and /ready answer from memory, never from storage.
 """
-from flask import Flask, jsonify, render_template_string, request
+import time
+_import_started = time.perf_counter()
+
+from flask import Flask, jsonify, render_template_string, request, g
 from flask_cors import CORS
 import os
+import threading
 from datetime import datetime
 import traceback
 
@@ -11,14 +19,122 @@ import traceback
 app = Flask(__name__)
 CORS(app)
 
+# Seconds between background storage checks, and the age after which a passed check no longer counts
+READY_CHECK_INTERVAL = float(os.getenv('READY_CHECK_INTERVAL_SECONDS', '15'))
+READY_MAX_AGE = float(os.getenv('READY_MAX_AGE_SECONDS', '60'))
+
+
+# Backup system, loaded on first use (None until the import was attempted)
+BackupSystem = None
+BatchBackup = None
+BATCH_CONCURRENCY = None
+BATCH_ALLOWED_ROOTS = None
+BACKUP_AVAILABLE = None
+_backup = None
+_backup_lock = threading.Lock()
+
+# Result of the latest background storage check
+_readiness = {'ready': False, 'checked_at': None, 'latency_ms': None, 'error': None}
+
+# Startup timings of this process, served by /api/startup
+startup_profile = {
+    'started_at': datetime.now().isoformat(),
+    'app_import_seconds': None,
+    'backup_import_seconds': None,
+    'client_setup_seconds': None,
+    'first_ready_check_seconds': None,
+    'ready_after_seconds': None,
+    'first_requests': {}
+}
+
+
+def _since_start():
+    return round(time.perf_counter() - _import_started, 4)
+
+
+def load_backup_system():
+    """Import the backup modules once; returns whether they are available"""
+    global BackupSystem, BatchBackup, BATCH_CONCURRENCY, BATCH_ALLOWED_ROOTS, BACKUP_AVAILABLE
+    with _backup_lock:
+        if BACKUP_AVAILABLE is None:
+            started = time.perf_counter()
+            try:
+                from backup_system import BackupSystem
+                from batch_backup import BatchBackup, BATCH_CONCURRENCY, BATCH_ALLOWED_ROOTS
+                BACKUP_AVAILABLE = True
+            except Exception as e:
+                print(f"Warning: Backup system not available: {e}")
+                BACKUP_AVAILABLE = False
+            startup_profile['backup_import_seconds'] = round(time.perf_counter() - started, 4)
+    return BACKUP_AVAILABLE
+
+
+def get_backup_system():
+    """
+    The process's shared BackupSystem, created on first use without a connection check
+    
+    Returns:
+        BackupSystem: or None when the backup modules can't be imported
+    """
+    global _backup
+    if not load_backup_system():
+        return None
+    with _backup_lock:
+        if _backup is None:
+            started = time.perf_counter()
+            _backup = BackupSystem(validate=False)
+            startup_profile['client_setup_seconds'] = round(time.perf_counter() - started, 4)
+    return _backup
+
+
+def _backup_state():
+    if BACKUP_AVAILABLE is None:
+        return 'starting'
+    return 'operational' if BACKUP_AVAILABLE else 'unavailable'
+
+
+def check_readiness():
+    """Check that storage is reachable and cache the result for /ready"""
+    started = time.perf_counter()
+    try:
+        backup = get_backup_system()
+        if backup is None:
+            raise RuntimeError('Backup system not available')
+        backup.container_client.get_container_properties()
+        ready, error = True, None
+    except Exception as e:
+        ready, error = False, str(e)
+    latency = time.perf_counter() - started
+    _readiness.update(ready=ready, checked_at=time.time(), latency_ms=round(latency * 1000, 1), error=error)
+    
+    if startup_profile['first_ready_check_seconds'] is None:
+        startup_profile['first_ready_check_seconds'] = round(latency, 4)
+    if ready and startup_profile['ready_after_seconds'] is None:
+        startup_profile['ready_after_seconds'] = _since_start()
+
+
+def _readiness_loop():
+    while True:
+        check_readiness()
+        time.sleep(READY_CHECK_INTERVAL)
+
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
 
-# Import backup system
-try:
-    from backup_system import BackupSystem
-    BACKUP_AVAILABLE = True
-except Exception as e:
-    print(f"Warning: Backup system not available: {e}")
-    BACKUP_AVAILABLE = False
+
+@app.after_request
+def _record_first_request(response):
+    # Only the first request to each endpoint pays for lazy loading, so only it is kept
+    started = g.get('request_started')
+    if started is not None and request.endpoint:
+        startup_profile['first_requests'].setdefault(request.endpoint, {
+            'seconds': round(time.perf_counter() - started, 4),
+            'after_start_seconds': _since_start(),
+            'status_code': response.status_code
+        })
+    return response
 
 
 # Enhanced HTML template with backup controls
@@ -156,7 +272,7 @@ HTML_TEMPLATE = """
 @app.route('/')
 def home():
     """Main dashboard page"""
-    backup_status = "✅ Operational" if BACKUP_AVAILABLE else "⚠️ Not Available"
+    backup_status = "✅ Operational" if BACKUP_AVAILABLE else "⏳ Starting" if BACKUP_AVAILABLE is None else "⚠️ Not Available"
     
     return render_template_string(
         HTML_TEMPLATE,
@@ -176,11 +292,33 @@ def health():
         'service': 'automated-backup-system',
         'timestamp': datetime.now().isoformat(),
         'azure_storage': 'connected' if os.getenv('AZURE_STORAGE_CONNECTION_STRING') else 'not configured',
-        'backup_system': 'operational' if BACKUP_AVAILABLE else 'unavailable'
+        'backup_system': _backup_state()
     }
     return jsonify(health_data)
 
 
+@app.route('/ready')
+def ready():
+    """Readiness probe, answered from the latest background storage check"""
+    checked_at = _readiness['checked_at']
+    age = time.time() - checked_at if checked_at else None
+    is_ready = _readiness['ready'] and age <= READY_MAX_AGE
+    return jsonify({
+        'status': 'ready' if is_ready else 'not ready',
+        'backup_system': _backup_state(),
+        'checked_at': datetime.fromtimestamp(checked_at).isoformat() if checked_at else None,
+        'check_age_seconds': round(age, 1) if age is not None else None,
+        'latency_ms': _readiness['latency_ms'],
+        'error': _readiness['error']
+    }), 200 if is_ready else 503
+
+
+@app.route('/api/startup')
+def startup():
+    """Import, client setup, readiness and first-request timings of this process"""
+    return jsonify(dict(startup_profile, uptime_seconds=_since_start(), pid=os.getpid()))
+
+
 @app.route('/api/status')
 def status():
     """API status endpoint"""
@@ -196,7 +334,7 @@ def status():
             'CI/CD Pipeline',
             'Real-time Monitoring'
         ],
-        'backup_system_available': BACKUP_AVAILABLE
+        'backup_system_available': bool(BACKUP_AVAILABLE)
     })
 
 
@@ -204,11 +342,11 @@ def status():
 @app.route('/api/backup/list')
 def list_backups():
     """List all available backups"""
-    if not BACKUP_AVAILABLE:
+    if not load_backup_system():
         return jsonify({'status': 'error', 'message': 'Backup system not available'}), 503
     
     try:
-        backup = BackupSystem()
+        backup = get_backup_system()
         backups = backup.list_backups()
         return jsonify({
             'status': 'success',
@@ -226,11 +364,11 @@ def list_backups():
 @app.route('/api/backup/stats')
 def backup_stats():
     """Get backup system statistics"""
-    if not BACKUP_AVAILABLE:
+    if not load_backup_system():
         return jsonify({'status': 'error', 'message': 'Backup system not available'}), 503
     
     try:
-        backup = BackupSystem()
+        backup = get_backup_system()
         stats = backup.get_storage_stats()
         return jsonify(stats)
     except Exception as e:
@@ -240,10 +378,31 @@ def backup_stats():
         }), 500
 
 
+@app.route('/api/backup/index/rebuild', methods=['POST'])
+def rebuild_backup_index():
+    """Rebuild the container index from a full listing"""
+    if not load_backup_system():
+        return jsonify({'status': 'error', 'message': 'Backup system not available'}), 503
+    
+    try:
+        entries = get_backup_system().index.rebuild()
+        return jsonify({
+            'status': 'success',
+            'message': f"Rebuilt the backup index with {len(entries)} entries",
+            'count': len(entries)
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'traceback': traceback.format_exc()
+        }), 500
+
+
 @app.route('/api/backup/test', methods=['POST'])
 def test_backup():
     """Create a test backup"""
-    if not BACKUP_AVAILABLE:
+    if not load_backup_system():
         return jsonify({'status': 'error', 'message': 'Backup system not available'}), 503
     
     try:
@@ -255,7 +414,7 @@ def test_backup():
             test_file = f.name
         
         # Backup the test file
-        backup = BackupSystem()
+        backup = get_backup_system()
         result = backup.backup_file(test_file, f"test_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
         
         # Clean up
@@ -274,6 +433,56 @@ def test_backup():
         }), 500
 
 
+@app.route('/api/backup/batch', methods=['POST'])
+def batch_backup():
+    """Back up a list of files and directories as one batch
+
+    Body: {"items": [path or {"path", "name", "create_zip"}, ...],
+           "batch_name": optional, "max_concurrency": optional}
+    
+    Paths must be inside BACKUP_BATCH_ALLOWED_ROOTS; without it the route is disabled.
+    """
+    if not load_backup_system():
+        return jsonify({'status': 'error', 'message': 'Backup system not available'}), 503
+    if not BATCH_ALLOWED_ROOTS:
+        return jsonify({'status': 'error', 'message': 'Batch backups are disabled, set BACKUP_BATCH_ALLOWED_ROOTS'}), 403
+    
+    body = request.get_json(silent=True) or {}
+    items = body.get('items')
+    if not items or not isinstance(items, list):
+        return jsonify({'status': 'error', 'message': 'items must be a non-empty list of paths'}), 400
+    
+    # Callers may lower the batch's concurrency, but not raise it past the server's limit
+    max_concurrency = body.get('max_concurrency')
+    if max_concurrency is not None:
+        if isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int) or max_concurrency < 1:
+            return jsonify({'status': 'error', 'message': 'max_concurrency must be a positive integer'}), 400
+        max_concurrency = min(max_concurrency, BATCH_CONCURRENCY)
+    
+    try:
+        batch = BatchBackup(get_backup_system(), body.get('batch_name'), max_concurrency, BATCH_ALLOWED_ROOTS)
+        result = batch.run(items)
+        
+        return jsonify({
+            'status': result['status'],
+            'message': f"Backed up {result['items_succeeded']} of {len(result['items'])} items",
+            'batch': result
+        }), 500 if result['status'] == 'failed' else 200
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'traceback': traceback.format_exc()
+        }), 500
+
+
+# Load the backup system and start checking storage without holding up the import
+threading.Thread(target=_readiness_loop, name='readiness-probe', daemon=True).start()
+startup_profile['app_import_seconds'] = _since_start()
+
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8000))
     app.run(host='0.0.0.0', port=port, debug=False)
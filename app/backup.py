@@ -1,11 +1,24 @@
 """Core Backup Module"""
 import os
+import sys
 import zipfile
 import datetime
 import json
 import logging
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+
+# profiling.py, file_index.py and version_index.py sit at the repository root, shared with the cloud backup modules
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
 from config import BACKUP_CONFIG, LOG_CONFIG
+from change_tracker import ChangeJournal
+from file_index import FileIndex, FileIndexBuilder
+from version_index import VersionIndex
+from profiling import StageTimer, profiled
 
 # Setup logging
 logging.basicConfig(
@@ -14,24 +27,49 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+def _save_backup_profile(backup_system, result, profiler, *args, **kwargs):
+    """Store a profiled run's output next to the backup it created"""
+    success, backup_name, metadata = result
+    if success:
+        paths = profiler.save(backup_system.backup_dir / backup_name)
+        logging.info(f"Saved backup profile: {', '.join(map(str, paths))}")
+
 class BackupSystem:
     def __init__(self):
         self.config = BACKUP_CONFIG
         self.backup_dir = Path(self.config["backup_location"])
         self.backup_dir.mkdir(parents=True, exist_ok=True)
+        # Parsed .meta files keyed by path, invalidated by mtime and size
+        self._metadata_cache = {}
+        
+    @profiled(_save_backup_profile)
+    def create_backup(self, progress_callback=None, sharded=None, incremental=False):
+        """Create a backup of all configured source directories
+        
+        progress_callback, if given, is called with files, bytes and
+        current_file keyword arguments after each file is added.
+        sharded defaults to BACKUP_CONFIG["sharded"]; see create_sharded_backup.
+        incremental=True only backs up changes; see create_incremental_backup.
+        """
+        if incremental:
+            return self.create_incremental_backup(progress_callback)
+        if sharded is None:
+            sharded = self.config.get("sharded", False)
+        if sharded:
+            return self.create_sharded_backup(progress_callback)
         
-    def create_backup(self):
-        """Create a backup of all configured source directories"""
         try:
+            started_at = time.time()
             timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            backup_name = f"backup_{timestamp}.zip"
-            backup_path = self.backup_dir / backup_name
+            backup_name, backup_path = self._reserve_backup_name(timestamp, ".zip")
             
             logging.info(f"Starting backup: {backup_name}")
             print(f"📦 Creating backup: {backup_name}")
             
             total_files = 0
             total_size = 0
+            timer = StageTimer()
+            file_index = FileIndexBuilder()
             
             with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
                 for source_dir in self.config["source_dirs"]:
@@ -40,28 +78,35 @@ class BackupSystem:
                         logging.warning(f"Source directory not found: {source_dir}")
                         continue
                     
-                    for root, dirs, files in os.walk(source_path):
+                    for root, dirs, files in timer.iterate("scan", os.walk(source_path)):
                         for file in files:
                             file_path = Path(root) / file
                             arcname = file_path.relative_to(source_path.parent)
-                            zipf.write(file_path, arcname)
+                            with timer.stage("compress"):
+                                zipf.write(file_path, arcname)
+                            stat = file_path.stat()
+                            file_index.add(arcname.as_posix(), stat.st_size, stat.st_mtime)
                             total_files += 1
-                            total_size += file_path.stat().st_size
+                            total_size += stat.st_size
+                            if progress_callback:
+                                progress_callback(files=total_files, bytes=total_size, current_file=str(arcname))
             
             # Create metadata
             metadata = {
                 "backup_name": backup_name,
                 "timestamp": timestamp,
+                "started_at": started_at,
                 "total_files": total_files,
                 "total_size_bytes": total_size,
                 "total_size_mb": round(total_size / (1024 * 1024), 2),
                 "source_dirs": self.config["source_dirs"],
             }
+            with timer.stage("file_index"):
+                self._save_file_index(backup_name, file_index)
+            metadata["timings"] = timer.breakdown()
             
             # Save metadata
-            metadata_path = self.backup_dir / f"{backup_name}.meta"
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            self._save_metadata(backup_name, metadata)
             
             logging.info(f"Backup completed: {backup_name}")
             print(f"✅ Backup completed: {total_files} files, {metadata['total_size_mb']} MB")
@@ -73,24 +118,397 @@ class BackupSystem:
             print(f"❌ Backup failed: {str(e)}")
             return False, None, None
     
+    @profiled(_save_backup_profile)
+    def create_sharded_backup(self, progress_callback=None):
+        """Create a backup with one zip shard per source directory, in parallel
+        
+        With BACKUP_CONFIG["shard_subtrees"] each top-level subdirectory of a
+        source becomes its own shard as well. Shards are written to
+        backup_<timestamp>.shards/ and the .meta file lists all of them.
+        """
+        try:
+            started_at = time.time()
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            backup_name, shard_dir = self._reserve_backup_name(timestamp, ".shards")
+            
+            timer = StageTimer()
+            with timer.stage("plan"):
+                shards = self._plan_shards()
+            workers = self.config.get("shard_workers") or min(len(shards), os.cpu_count() or 1) or 1
+            
+            logging.info(f"Starting sharded backup: {backup_name} ({len(shards)} shards, {workers} workers)")
+            print(f"📦 Creating sharded backup: {backup_name} ({len(shards)} shards)")
+            
+            progress = {"files": 0, "bytes": 0}
+            progress_lock = threading.Lock()
+            file_index = FileIndexBuilder()
+            
+            def shard_progress(stat, arcname):
+                with progress_lock:
+                    file_index.add(arcname.as_posix(), stat.st_size, stat.st_mtime)
+                    progress["files"] += 1
+                    progress["bytes"] += stat.st_size
+                    if progress_callback:
+                        progress_callback(files=progress["files"], bytes=progress["bytes"], current_file=str(arcname))
+            
+            def write_shard(index_shard):
+                index, shard = index_shard
+                shard["archive"] = f"shard-{index:03d}.zip"
+                shard["files"], shard["size_bytes"] = self._write_shard(shard_dir / shard["archive"], shard, shard_progress, timer)
+                return shard
+            
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                shards = list(pool.map(write_shard, enumerate(shards)))
+            
+            total_files = sum(shard["files"] for shard in shards)
+            total_size = sum(shard["size_bytes"] for shard in shards)
+            
+            metadata = {
+                "backup_name": backup_name,
+                "timestamp": timestamp,
+                "started_at": started_at,
+                "backup_type": "sharded",
+                "total_files": total_files,
+                "total_size_bytes": total_size,
+                "total_size_mb": round(total_size / (1024 * 1024), 2),
+                "source_dirs": self.config["source_dirs"],
+                "shards": shards,
+            }
+            with timer.stage("file_index"):
+                self._save_file_index(backup_name, file_index)
+            metadata["timings"] = timer.breakdown()
+            
+            self._save_metadata(backup_name, metadata)
+            
+            logging.info(f"Sharded backup completed: {backup_name}")
+            print(f"✅ Backup completed: {total_files} files in {len(shards)} shards, {metadata['total_size_mb']} MB")
+            
+            return True, backup_name, metadata
+            
+        except Exception as e:
+            logging.error(f"Sharded backup failed: {str(e)}")
+            print(f"❌ Backup failed: {str(e)}")
+            return False, None, None
+    
+    @profiled(_save_backup_profile)
+    def create_incremental_backup(self, progress_callback=None):
+        """Back up only the files changed since the latest backup
+        
+        Changed paths come from the change tracker journal when its watcher
+        has been running continuously, otherwise from a full scan compared
+        against the file index of the latest backup. Either way the backup
+        saves an updated index for the next one. Falls back to a full backup
+        when there is no previous backup, or when a scan is needed and the
+        latest backup has no file index to compare with.
+        """
+        backups = self.list_backups()
+        if not backups:
+            logging.info("No previous backup, creating a full backup")
+            return self.create_backup(progress_callback, incremental=False)
+        base = backups[0]
+        previous_index = self._load_file_index(base)
+        
+        journal = ChangeJournal(self.config["change_tracker_dir"])
+        dirty, token = journal.begin()
+        if dirty is None and previous_index is None:
+            # An older index would miss files created and deleted since it was saved
+            logging.info(f"No file index for {base['backup_name']}, creating a full backup")
+            result = self.create_backup(progress_callback, incremental=False)
+            if result[0]:
+                journal.commit(token)
+            else:
+                journal.rollback(token)
+            return result
+        
+        try:
+            started_at = time.time()
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            backup_name, backup_path = self._reserve_backup_name(timestamp, ".zip")
+            
+            timer = StageTimer()
+            file_index = None
+            with timer.stage("detect_changes"):
+                if dirty is None:
+                    change_source = "scan"
+                    changed, deleted, file_index = self._scan_changes(previous_index)
+                else:
+                    change_source = "inotify"
+                    changed, deleted = self._resolve_dirty_paths(dirty)
+            
+            logging.info(f"Starting incremental backup: {backup_name} ({change_source}, base {base['backup_name']})")
+            print(f"📦 Creating incremental backup: {backup_name} ({len(changed)} changed, {len(deleted)} deleted)")
+            
+            total_files = 0
+            total_size = 0
+            
+            with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                for file_path, arcname in changed:
+                    try:
+                        with timer.stage("compress"):
+                            zipf.write(file_path, arcname)
+                        file_size = file_path.stat().st_size
+                    except FileNotFoundError:
+                        # Removed after it was detected as changed
+                        deleted.append(str(arcname))
+                        continue
+                    total_files += 1
+                    total_size += file_size
+                    if progress_callback:
+                        progress_callback(files=total_files, bytes=total_size, current_file=str(arcname))
+            
+            metadata = {
+                "backup_name": backup_name,
+                "timestamp": timestamp,
+                "started_at": started_at,
+                "backup_type": "incremental",
+                "base_backup": base["backup_name"],
+                "change_source": change_source,
+                "total_files": total_files,
+                "total_size_bytes": total_size,
+                "total_size_mb": round(total_size / (1024 * 1024), 2),
+                "deleted": sorted(deleted),
+                "source_dirs": self.config["source_dirs"],
+            }
+            if file_index is None and previous_index is not None:
+                with timer.stage("file_index"):
+                    file_index = self._apply_changes(previous_index, changed, deleted)
+            if file_index is not None:
+                with timer.stage("file_index"):
+                    self._save_file_index(backup_name, file_index)
+            metadata["timings"] = timer.breakdown()
+            
+            self._save_metadata(backup_name, metadata)
+            
+            journal.commit(token)
+            
+            logging.info(f"Incremental backup completed: {backup_name}")
+            print(f"✅ Backup completed: {total_files} files, {metadata['total_size_mb']} MB")
+            
+            return True, backup_name, metadata
+            
+        except Exception as e:
+            journal.rollback(token)
+            logging.error(f"Incremental backup failed: {str(e)}")
+            print(f"❌ Backup failed: {str(e)}")
+            return False, None, None
+    
+    def _reserve_backup_name(self, timestamp, suffix):
+        """Create a new backup's zip file or shard directory under an unused name
+        
+        Names have one-second resolution, so a backup started in the same
+        second as another one gets a -2, -3, ... suffix.
+        """
+        n = 1
+        while True:
+            backup_name = f"backup_{timestamp}{'' if n == 1 else f'-{n}'}{suffix}"
+            backup_path = self.backup_dir / backup_name
+            try:
+                if suffix == ".shards":
+                    backup_path.mkdir()
+                else:
+                    backup_path.touch(exist_ok=False)
+                return backup_name, backup_path
+            except FileExistsError:
+                n += 1
+    
+    def _save_metadata(self, backup_name, metadata):
+        """Write the .meta file and add the backup to the version index"""
+        metadata_path = self.backup_dir / f"{backup_name}.meta"
+        with open(metadata_path, 'w') as f:
+            json.dump(metadata, f, indent=2)
+        
+        try:
+            index = VersionIndex(self.config["version_index_path"])
+            try:
+                # Only this backup; catching up on missed ones is sync_local's job (version_index.py sync)
+                index.add_local_backup(self.backup_dir, metadata)
+            finally:
+                index.close()
+        except Exception as e:
+            logging.warning(f"Failed to update version index: {str(e)}")
+    
+    def _backup_start_time(self, metadata):
+        """When a backup started, for mtime comparison"""
+        if "started_at" in metadata:
+            return metadata["started_at"]
+        started = datetime.datetime.strptime(metadata["timestamp"], "%Y-%m-%d_%H-%M-%S")
+        return started.timestamp()
+    
+    def _scan_changes(self, previous_index):
+        """Walk the sources for files changed or deleted since previous_index was saved
+        
+        Files are compared with the index by size and mtime. Returns
+        (changed, deleted, file index of the sources).
+        """
+        changed = []
+        parents = {}
+        file_index = FileIndexBuilder()
+        for source_dir in self.config["source_dirs"]:
+            source_path = Path(source_dir)
+            if not source_path.exists():
+                logging.warning(f"Source directory not found: {source_dir}")
+                continue
+            parents[source_path.name] = source_path.parent
+            
+            for root, dirs, files in os.walk(source_path):
+                for file in files:
+                    file_path = Path(root) / file
+                    try:
+                        stat = file_path.stat()
+                    except FileNotFoundError:
+                        continue
+                    arcname = file_path.relative_to(source_path.parent)
+                    file_index.add(arcname.as_posix(), stat.st_size, stat.st_mtime)
+        
+        file_index = file_index.build()
+        diff = previous_index.diff(file_index)
+        for arcname in sorted(itertools.chain(diff.added_paths(), diff.changed_paths())):
+            changed.append((parents[arcname.split("/", 1)[0]] / arcname, Path(arcname)))
+        return changed, sorted(diff.deleted_paths()), file_index
+    
+    def _load_file_index(self, metadata):
+        """File index saved by a backup, or None if it has none"""
+        index_path = self.backup_dir / f"{metadata['backup_name']}.index"
+        if not index_path.exists():
+            return None
+        try:
+            return FileIndex.load(index_path)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load file index {index_path}: {str(e)}")
+            return None
+    
+    def _apply_changes(self, previous_index, changed, deleted):
+        """File index of the sources after journaled changes, without walking them
+        
+        Entries of changed and deleted paths (and of everything under a
+        deleted directory) are dropped from previous_index, then the changed
+        files are added with their current size and mtime.
+        """
+        changed_names = {arcname.as_posix() for _, arcname in changed}
+        deleted_names = set(deleted)
+        deleted_dirs = tuple(f"{name}/" for name in deleted)
+        file_index = FileIndexBuilder(previous_index.hash_kind)
+        for entry in previous_index:
+            path = entry["path"]
+            if path in changed_names or path in deleted_names or path.startswith(deleted_dirs):
+                continue
+            file_index.add(path, entry["size"], entry["mtime"], entry["hash_prefix"])
+        for file_path, arcname in changed:
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                continue
+            file_index.add(arcname.as_posix(), stat.st_size, stat.st_mtime)
+        return file_index.build()
+    
+    def _save_file_index(self, backup_name, file_index):
+        """Save the sources' file index next to the backup for the next incremental scan (best effort)"""
+        try:
+            if isinstance(file_index, FileIndexBuilder):
+                file_index = file_index.build()
+            file_index.save(self.backup_dir / f"{backup_name}.index")
+        except Exception as e:
+            logging.warning(f"Failed to save file index: {str(e)}")
+    
+    def _resolve_dirty_paths(self, dirty):
+        """Turn journaled paths into changed files and deleted archive names"""
+        sources = [Path(os.path.abspath(source_dir)) for source_dir in self.config["source_dirs"]]
+        changed = {}
+        deleted = []
+        
+        for path in map(Path, dirty):
+            source = next((s for s in sources if path == s or s in path.parents), None)
+            if source is None:
+                continue
+            
+            if path.is_file():
+                changed[path] = path.relative_to(source.parent)
+            elif path.is_dir():
+                for root, dirs, files in os.walk(path):
+                    for file in files:
+                        file_path = Path(root) / file
+                        changed[file_path] = file_path.relative_to(source.parent)
+            else:
+                deleted.append(path.relative_to(source.parent).as_posix())
+        
+        return sorted(changed.items()), deleted
+    
+    def _plan_shards(self):
+        """Split the source directories into independent shards"""
+        shards = []
+        for source_dir in self.config["source_dirs"]:
+            source_path = Path(source_dir)
+            if not source_path.exists():
+                logging.warning(f"Source directory not found: {source_dir}")
+                continue
+            
+            if not self.config.get("shard_subtrees"):
+                shards.append({"source": source_dir, "path": str(source_path), "recursive": True})
+                continue
+            
+            # Loose files of the source root, then one shard per subdirectory
+            shards.append({"source": source_dir, "path": str(source_path), "recursive": False})
+            for entry in sorted(os.scandir(source_path), key=lambda e: e.name):
+                if entry.is_dir(follow_symlinks=False):
+                    shards.append({"source": source_dir, "path": entry.path, "recursive": True})
+        return shards
+    
+    def _write_shard(self, shard_path, shard, progress, timer):
+        """Write one shard archive, returning its file count and size"""
+        base_path = Path(shard["source"]).parent
+        total_files = 0
+        total_size = 0
+        
+        with zipfile.ZipFile(shard_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for root, dirs, files in timer.iterate("scan", os.walk(shard["path"])):
+                if not shard["recursive"]:
+                    dirs.clear()
+                for file in files:
+                    file_path = Path(root) / file
+                    arcname = file_path.relative_to(base_path)
+                    with timer.stage("compress"):
+                        zipf.write(file_path, arcname)
+                    stat = file_path.stat()
+                    total_files += 1
+                    total_size += stat.st_size
+                    progress(stat, arcname)
+        
+        return total_files, total_size
+    
     def list_backups(self):
         """List all available backups"""
         try:
             backups = []
-            for backup_file in self.backup_dir.glob("backup_*.zip"):
-                metadata_file = backup_file.with_suffix('.zip.meta')
-                if metadata_file.exists():
-                    with open(metadata_file, 'r') as f:
-                        metadata = json.load(f)
-                    backups.append(metadata)
-            return sorted(backups, key=lambda x: x["timestamp"], reverse=True)
+            cache = {}
+            for metadata_file in self.backup_dir.glob("backup_*.meta"):
+                # backup_<timestamp>.zip or a backup_<timestamp>.shards directory
+                if metadata_file.with_suffix('').exists():
+                    cache[metadata_file] = self._load_metadata(metadata_file)
+                    backups.append(cache[metadata_file][1])
+            self._metadata_cache = cache
+            # Backups started in the same second share a timestamp
+            return sorted(backups, key=lambda x: (x["timestamp"], x.get("started_at", 0)), reverse=True)
         except Exception as e:
             logging.error(f"Failed to list backups: {str(e)}")
             return []
     
-    def get_backup_stats(self):
-        """Get statistics about backups"""
-        backups = self.list_backups()
+    def _load_metadata(self, metadata_file):
+        """Load a .meta file, reusing the cached copy if it has not changed"""
+        stat = metadata_file.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._metadata_cache.get(metadata_file)
+        if cached and cached[0] == key:
+            return cached
+        with open(metadata_file, 'r') as f:
+            return key, json.load(f)
+    
+    def get_backup_stats(self, backups=None):
+        """Get statistics about backups
+        
+        Pass an already loaded backups list to avoid listing them again.
+        """
+        if backups is None:
+            backups = self.list_backups()
         total_size = sum(b.get("total_size_mb", 0) for b in backups)
         return {
             "total_backups": len(backups),
@@ -0,0 +1,287 @@
+"""inotify-based Change Tracker
+
+Watches the backup source directories and records changed paths in a
+persistent journal, so incremental backups can skip walking the whole tree.
+Run it as a daemon with `python app/change_tracker.py`.
+"""
+import os
+import sys
+import json
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: inotify is unavailable anyway
+    fcntl = None
+
+# inotify event masks (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+# A journal whose watcher hasn't written a heartbeat for this long is not trusted
+HEARTBEAT_SECONDS = 5
+STALE_HEARTBEAT_SECONDS = 6 * HEARTBEAT_SECONDS
+
+
+class ChangeJournal:
+    """Persistent dirty-path set shared by the watcher daemon and backups
+
+    dirty.log holds one absolute path per line. state.json records whether a
+    full scan is required (after an overflow or a watcher restart) and the
+    watcher's heartbeat.
+    """
+
+    def __init__(self, state_dir):
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.log_path = self.state_dir / "dirty.log"
+        self.state_path = self.state_dir / "state.json"
+        self._lock_path = self.state_dir / ".lock"
+
+    def append(self, paths):
+        """Record changed paths (called by the watcher)"""
+        if not paths:
+            return
+        with self._locked():
+            with open(self.log_path, 'a', encoding='utf-8', errors='surrogateescape') as f:
+                f.writelines(f"{path}\n" for path in paths)
+
+    def read_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"needs_full_scan": True}
+
+    def update_state(self, **changes):
+        with self._locked():
+            self._write_state(dict(self.read_state(), **changes))
+
+    def begin(self):
+        """
+        Take the current dirty set for a backup
+
+        Returns:
+            tuple: (set of paths, or None if a full scan is required, token)
+        """
+        with self._locked():
+            state = self.read_state()
+            token = {"taken_at": time.time(), "pending": None, "full_scan": False}
+
+            heartbeat_age = time.time() - state.get("heartbeat", 0)
+            if state.get("needs_full_scan", True) or heartbeat_age > STALE_HEARTBEAT_SECONDS:
+                token["full_scan"] = True
+                token["watcher_started_at"] = state.get("started_at")
+                # Anything journaled so far is covered by the full scan
+                if self.log_path.exists():
+                    self.log_path.unlink()
+                return None, token
+
+            pending = self.state_dir / f"dirty.{int(token['taken_at'] * 1000)}.pending"
+            if self.log_path.exists():
+                os.replace(self.log_path, pending)
+            else:
+                pending.touch()
+            token["pending"] = str(pending)
+
+        with open(pending, 'r', encoding='utf-8', errors='surrogateescape') as f:
+            paths = {line.rstrip("\n") for line in f if line.strip()}
+        return paths, token
+
+    def commit(self, token):
+        """The backup using token succeeded; forget its paths"""
+        if token["pending"]:
+            Path(token["pending"]).unlink(missing_ok=True)
+        if token["full_scan"]:
+            with self._locked():
+                state = self.read_state()
+                # Only trust the journal if the watcher was running before the scan began
+                started_at = state.get("started_at")
+                if started_at and started_at <= token["taken_at"] and started_at == token.get("watcher_started_at"):
+                    state["needs_full_scan"] = False
+                    self._write_state(state)
+
+    def rollback(self, token):
+        """The backup using token failed; put its paths back into the journal"""
+        if not token["pending"] or not os.path.exists(token["pending"]):
+            return
+        with self._locked():
+            with open(token["pending"], 'r', encoding='utf-8', errors='surrogateescape') as src, \
+                    open(self.log_path, 'a', encoding='utf-8', errors='surrogateescape') as dst:
+                dst.write(src.read())
+            os.unlink(token["pending"])
+
+    def _write_state(self, state):
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _locked(self):
+        return _FileLock(self._lock_path)
+
+
+class InotifyWatcher:
+    """Recursively watches directories and feeds changed paths into a ChangeJournal"""
+
+    def __init__(self, source_dirs, journal, flush_interval=1.0):
+        self.source_dirs = [os.path.abspath(d) for d in source_dirs]
+        self.journal = journal
+        self.flush_interval = flush_interval
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = None
+        self._watches = {}
+        self._dirty = set()
+        self._stopped = threading.Event()
+
+    def run(self):
+        """Watch until stop() is called"""
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        started_at = time.time()
+        # Changes made while no watcher was running are unknown until a full scan
+        self.journal.update_state(needs_full_scan=True, started_at=started_at, heartbeat=started_at, pid=os.getpid())
+
+        for source_dir in self.source_dirs:
+            self._watch_tree(source_dir, mark_dirty=False)
+        logging.info(f"Watching {len(self._watches)} directories for changes")
+
+        last_flush = time.time()
+        try:
+            while not self._stopped.is_set():
+                readable, _, _ = select.select([self._fd], [], [], self.flush_interval)
+                if readable:
+                    self._read_events()
+                if time.time() - last_flush >= self.flush_interval:
+                    self._flush()
+                    last_flush = time.time()
+        finally:
+            self._flush()
+            os.close(self._fd)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _flush(self):
+        dirty, self._dirty = self._dirty, set()
+        self.journal.append(sorted(dirty))
+        state = self.journal.read_state()
+        if time.time() - state.get("heartbeat", 0) >= HEARTBEAT_SECONDS:
+            self.journal.update_state(heartbeat=time.time())
+
+    def _watch_tree(self, root, mark_dirty):
+        """Add watches for root and its subdirectories"""
+        for dirpath, dirs, files in os.walk(root):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    logging.error("inotify watch limit reached, raise fs.inotify.max_user_watches")
+                    self.journal.update_state(needs_full_scan=True)
+                continue
+            self._watches[wd] = dirpath
+            if mark_dirty:
+                self._dirty.update(os.path.join(dirpath, f) for f in files)
+
+    def _read_events(self):
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("inotify queue overflow, next backup will do a full scan")
+                self.journal.update_state(needs_full_scan=True)
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # New subtree: watch it and back up everything already inside
+                self._watch_tree(path, mark_dirty=True)
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self._dirty.add(directory)
+            elif mask & IN_ISDIR and not mask & (IN_DELETE | IN_MOVED_FROM):
+                continue
+            else:
+                self._dirty.add(path)
+
+
+class _FileLock:
+    """Exclusive lock shared between the watcher and backup processes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+if __name__ == "__main__":
+    from config import BACKUP_CONFIG, LOG_CONFIG
+
+    logging.basicConfig(
+        filename=LOG_CONFIG["log_file"],
+        level=LOG_CONFIG["log_level"],
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    if not sys.platform.startswith("linux"):
+        print("❌ The change tracker requires Linux inotify")
+        sys.exit(1)
+
+    print("👀 Watching source directories for changes (Ctrl+C to stop)")
+    watcher = InotifyWatcher(BACKUP_CONFIG["source_dirs"], ChangeJournal(BACKUP_CONFIG["change_tracker_dir"]))
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
@@ -0,0 +1,705 @@
+"""
+Azure Blob Storage stand-in for offline testing
+Implements the subset of the azure.storage.blob client API used by the backup
+system on top of a local directory, including access tiers, rehydration
+latency and blob leases. Several processes may share one simulator directory.
+"""
+import os
+import json
+import time
+import asyncio
+import uuid
+import shutil
+import hashlib
+import itertools
+import threading
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+try:
+    from azure.core.exceptions import (
+        ResourceNotFoundError, ResourceExistsError, ResourceModifiedError, HttpResponseError
+    )
+except ImportError:
+    class HttpResponseError(Exception):
+        pass
+
+    class ResourceNotFoundError(HttpResponseError):
+        pass
+
+    class ResourceExistsError(HttpResponseError):
+        pass
+
+    class ResourceModifiedError(HttpResponseError):
+        pass
+
+
+TIERS = ("Hot", "Cool", "Cold", "Archive")
+
+# Simulated seconds until an archived blob is readable again, per priority
+DEFAULT_REHYDRATE_SECONDS = {"Standard": 10.0, "High": 2.0}
+
+# Simulated time to first byte per tier
+DEFAULT_TIER_LATENCY = {"Hot": 0.0, "Cool": 0.0, "Cold": 0.0}
+
+# Azure accepts lease durations of 15 to 60 seconds, or -1 for an infinite lease
+LEASE_DURATION_RANGE = (15, 60)
+
+_props_lock = threading.Lock()
+
+
+class BlobProperties:
+    """Blob properties, mirroring azure.storage.blob.BlobProperties attributes"""
+
+    def __init__(self, name, record):
+        self.name = name
+        self.container = record.get("container")
+        self.size = record["size"]
+        self.etag = record["etag"]
+        self.creation_time = _parse_time(record["creation_time"])
+        self.last_modified = _parse_time(record["last_modified"])
+        self.last_accessed_on = _parse_time(record.get("last_accessed_on"))
+        self.blob_tier = record.get("blob_tier", "Hot")
+        self.blob_tier_change_time = _parse_time(record.get("blob_tier_change_time"))
+        self.archive_status = record.get("archive_status")
+        self.rehydrate_priority = record.get("rehydrate_priority")
+        self.metadata = record.get("metadata", {})
+        self.lease = LeaseProperties(record.get("lease"))
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+class LeaseProperties:
+    """Lease state of a blob, mirroring azure.storage.blob.LeaseProperties"""
+
+    def __init__(self, lease):
+        if lease is None:
+            self.status, self.state, self.duration = "unlocked", "available", None
+        elif _lease_active(lease):
+            self.status, self.state = "locked", "leased"
+            self.duration = "infinite" if lease["expires_at"] is None else "fixed"
+        else:
+            self.status, self.state, self.duration = "unlocked", "expired", None
+
+
+class BatchSubResponse:
+    """Result of one sub-request in a blob batch"""
+
+    def __init__(self, status_code, reason):
+        self.status_code = status_code
+        self.reason = reason
+
+
+class SimulatedDownloader:
+    """Mimics StorageStreamDownloader for a byte range of a blob"""
+
+    def __init__(self, data_file, properties, offset, length, chunk_size=4 * 1024 * 1024):
+        self.properties = properties
+        self.name = properties.name
+        self._file = data_file
+        self._offset = offset or 0
+        end = properties.size if length is None else min(self._offset + length, properties.size)
+        self.size = max(end - self._offset, 0)
+        self._chunk_size = chunk_size
+
+    def chunks(self):
+        with self._file as f:
+            f.seek(self._offset)
+            remaining = self.size
+            while remaining > 0:
+                block = f.read(min(self._chunk_size, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+
+    def readall(self):
+        return b"".join(self.chunks())
+
+    def readinto(self, stream):
+        written = 0
+        for block in self.chunks():
+            stream.write(block)
+            written += len(block)
+        return written
+
+    def content_as_bytes(self):
+        return self.readall()
+
+
+class SimulatedBlobClient:
+    """Mimics azure.storage.blob.BlobClient"""
+
+    def __init__(self, container_client, blob_name):
+        self.container_client = container_client
+        self.container_name = container_client.container_name
+        self.blob_name = blob_name
+        self.account_name = container_client.account_name
+        self.url = f"{container_client.url}/{blob_name}"
+        self._data_path = container_client._data_path(blob_name)
+        self._blocks_path = container_client._blocks_path(blob_name)
+
+    def exists(self):
+        return self.container_client._read_record(self.blob_name) is not None
+
+    def upload_blob(self, data, overwrite=False, metadata=None, etag=None, match_condition=None, lease=None, **kwargs):
+        """Write the blob; data may be bytes, str, a file object or an iterable of bytes"""
+        os.makedirs(os.path.dirname(self._data_path), exist_ok=True)
+        tmp_path = f"{self._data_path}.{uuid.uuid4().hex}.uploading"
+        size = 0
+        with open(tmp_path, 'wb') as f:
+            for block in _iter_data(data):
+                f.write(block)
+                size += len(block)
+
+        return self._replace_data(tmp_path, size, overwrite, metadata, etag, match_condition, lease)
+
+    def stage_block(self, block_id, data, length=None, **kwargs):
+        """Store an uncommitted block until commit_block_list"""
+        os.makedirs(self._blocks_path, exist_ok=True)
+        block_path = os.path.join(self._blocks_path, _block_file(block_id))
+        tmp_path = f"{block_path}.{uuid.uuid4().hex}.uploading"
+        with open(tmp_path, 'wb') as f:
+            for block in _iter_data(data):
+                f.write(block)
+        os.replace(tmp_path, block_path)
+
+    def commit_block_list(self, block_list, metadata=None, etag=None, match_condition=None, lease=None, **kwargs):
+        """Write the blob from staged blocks in block_list order"""
+        os.makedirs(os.path.dirname(self._data_path), exist_ok=True)
+        tmp_path = f"{self._data_path}.{uuid.uuid4().hex}.uploading"
+        size = 0
+        with open(tmp_path, 'wb') as f:
+            for block in block_list:
+                block_path = os.path.join(self._blocks_path, _block_file(getattr(block, "id", block)))
+                try:
+                    with open(block_path, 'rb') as src:
+                        size += _copy_stream(src, f)
+                except FileNotFoundError:
+                    os.unlink(tmp_path)
+                    raise HttpResponseError(f"The specified block list is invalid: {self.blob_name}") from None
+        result = self._replace_data(tmp_path, size, True, metadata, etag, match_condition, lease)
+        # Like Azure, a commit discards the blob's remaining uncommitted blocks
+        shutil.rmtree(self._blocks_path, ignore_errors=True)
+        return result
+
+    def download_blob(self, offset=None, length=None, etag=None, match_condition=None, **kwargs):
+        opened = []
+
+        def touch(record):
+            if record is None:
+                raise ResourceNotFoundError(f"The specified blob does not exist: {self.blob_name}")
+            _check_condition(record, etag, match_condition, self.blob_name)
+            if record.get("blob_tier") == "Archive":
+                raise HttpResponseError(f"This operation is not permitted on an archived blob: {self.blob_name}")
+            # Open under the lock so the data matches the record even if the blob is overwritten
+            opened.append((open(self._data_path, 'rb'), self._properties(record)))
+            record["last_accessed_on"] = _now()
+            return record
+        self.container_client._update_record(self.blob_name, touch)
+        data_file, properties = opened[0]
+
+        latency = self.container_client.service.tier_latency.get(properties.blob_tier, 0.0)
+        if latency:
+            time.sleep(latency)
+        return SimulatedDownloader(data_file, properties, offset, length)
+
+    def get_blob_properties(self, **kwargs):
+        return self._properties(self._require_record())
+
+    def set_blob_metadata(self, metadata=None, lease=None, **kwargs):
+        def update(record):
+            if record is None:
+                raise ResourceNotFoundError(f"The specified blob does not exist: {self.blob_name}")
+            _check_lease(record, lease, self.blob_name)
+            record["metadata"] = metadata or {}
+            return record
+        record = self.container_client._update_record(self.blob_name, update)
+        return {"etag": record["etag"]}
+
+    def delete_blob(self, lease=None, **kwargs):
+        def update(record):
+            if record is None:
+                raise ResourceNotFoundError(f"The specified blob does not exist: {self.blob_name}")
+            _check_lease(record, lease, self.blob_name)
+            if os.path.exists(self._data_path):
+                os.unlink(self._data_path)
+            return None
+        self.container_client._update_record(self.blob_name, update)
+
+    def set_standard_blob_tier(self, standard_blob_tier, rehydrate_priority=None, **kwargs):
+        """Change the access tier; leaving Archive starts a simulated rehydration"""
+        tier = _tier_name(standard_blob_tier)
+        priority = _tier_name(rehydrate_priority) if rehydrate_priority else "Standard"
+        rehydrate_seconds = self.container_client.service.rehydrate_seconds
+
+        def update(record):
+            if record is None:
+                raise ResourceNotFoundError(f"The specified blob does not exist: {self.blob_name}")
+            record = self.container_client._settle(record)
+            if record.get("archive_status"):
+                if tier == record["rehydrate_target"]:
+                    return record
+                raise HttpResponseError(f"Blob is being rehydrated: {self.blob_name}")
+            if record.get("blob_tier") == "Archive" and tier != "Archive":
+                record["archive_status"] = f"rehydrate-pending-to-{tier.lower()}"
+                record["rehydrate_target"] = tier
+                record["rehydrate_priority"] = priority
+                record["rehydrate_ready_at"] = time.time() + rehydrate_seconds.get(priority, 0.0)
+            else:
+                record["blob_tier"] = tier
+                record["blob_tier_change_time"] = _now()
+            return record
+
+        self.container_client._update_record(self.blob_name, update)
+
+    def acquire_lease(self, lease_duration=-1, lease_id=None, **kwargs):
+        """Take a lease on the blob; fails while another lease is active"""
+        lease = SimulatedBlobLeaseClient(self, lease_id)
+        lease.acquire(lease_duration=lease_duration)
+        return lease
+
+    def _replace_data(self, tmp_path, size, overwrite, metadata, etag, match_condition, lease=None):
+        """Move uploaded data into place and write a fresh record"""
+        def update(record):
+            if record is not None and not overwrite and etag is None:
+                raise ResourceExistsError(f"The specified blob already exists: {self.blob_name}")
+            _check_condition(record, etag, match_condition, self.blob_name)
+            _check_lease(record, lease, self.blob_name)
+            os.replace(tmp_path, self._data_path)
+            now = _now()
+            created = record["creation_time"] if record else now
+            new_record = {
+                "size": size,
+                "etag": f'"0x{uuid.uuid4().hex[:16].upper()}"',
+                "creation_time": created,
+                "last_modified": now,
+                "blob_tier": "Hot",
+                "metadata": metadata or {},
+            }
+            # Overwriting a blob keeps its lease
+            if record and record.get("lease"):
+                new_record["lease"] = record["lease"]
+            return new_record
+
+        try:
+            record = self.container_client._update_record(self.blob_name, update)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return {"etag": record["etag"], "last_modified": _parse_time(record["last_modified"])}
+
+    def _require_record(self):
+        record = self.container_client._read_record(self.blob_name)
+        if record is None:
+            raise ResourceNotFoundError(f"The specified blob does not exist: {self.blob_name}")
+        return record
+
+    def _properties(self, record):
+        record = dict(record, container=self.container_name)
+        return BlobProperties(self.blob_name, record)
+
+
+class SimulatedBlobLeaseClient:
+    """Mimics azure.storage.blob.BlobLeaseClient
+
+    The lease is stored in the blob's record with its expiry time, so leases
+    held by a process that dies simply run out.
+    """
+
+    def __init__(self, client, lease_id=None):
+        self._client = client
+        self.id = lease_id or str(uuid.uuid4())
+        self.etag = None
+        self.last_modified = None
+
+    def acquire(self, lease_duration=-1, **kwargs):
+        if lease_duration != -1 and not LEASE_DURATION_RANGE[0] <= lease_duration <= LEASE_DURATION_RANGE[1]:
+            raise HttpResponseError(f"Lease duration must be -1 or between {LEASE_DURATION_RANGE[0]} and {LEASE_DURATION_RANGE[1]} seconds")
+
+        def update(record):
+            record = self._require(record)
+            lease = record.get("lease")
+            if lease and _lease_active(lease) and lease["id"] != self.id:
+                raise ResourceExistsError(f"There is already a lease present: {self._client.blob_name}")
+            record["lease"] = {
+                "id": self.id,
+                "duration": lease_duration,
+                "expires_at": None if lease_duration == -1 else time.time() + lease_duration,
+            }
+            return record
+        self._update(update)
+
+    def renew(self, **kwargs):
+        """Restart the lease's clock; like Azure, an expired lease can be renewed until someone else takes it"""
+        def update(record):
+            lease = self._own_lease(self._require(record))
+            if lease["expires_at"] is not None:
+                lease["expires_at"] = time.time() + lease["duration"]
+            return record
+        self._update(update)
+
+    def release(self, **kwargs):
+        def update(record):
+            self._own_lease(self._require(record))
+            record.pop("lease")
+            return record
+        self._update(update)
+
+    def break_lease(self, lease_break_period=None, **kwargs):
+        """End whatever lease the blob has immediately"""
+        def update(record):
+            self._require(record).pop("lease", None)
+            return record
+        self._update(update)
+        return 0
+
+    def _update(self, update):
+        record = self._client.container_client._update_record(self._client.blob_name, update)
+        self.etag = record["etag"]
+        self.last_modified = _parse_time(record["last_modified"])
+
+    def _require(self, record):
+        if record is None:
+            raise ResourceNotFoundError(f"The specified blob does not exist: {self._client.blob_name}")
+        return record
+
+    def _own_lease(self, record):
+        lease = record.get("lease")
+        if not lease or lease["id"] != self.id:
+            raise HttpResponseError(f"The lease ID specified did not match the lease ID for the blob: {self._client.blob_name}")
+        return lease
+
+
+class SimulatedContainerClient:
+    """Mimics azure.storage.blob.ContainerClient"""
+
+    def __init__(self, service, container_name):
+        self.service = service
+        self.container_name = container_name
+        self.account_name = service.account_name
+        self.url = f"{service.url}/{container_name}"
+        self._root = os.path.join(service.root, container_name)
+        self._props_root = os.path.join(service.root, f"{container_name}.props")
+
+    def exists(self):
+        return os.path.isdir(self._root)
+
+    def create_container(self, **kwargs):
+        if self.exists():
+            raise ResourceExistsError(f"The specified container already exists: {self.container_name}")
+        os.makedirs(self._root)
+        os.makedirs(self._props_root, exist_ok=True)
+        return self
+
+    def get_container_properties(self, **kwargs):
+        if not self.exists():
+            raise ResourceNotFoundError(f"The specified container does not exist: {self.container_name}")
+        return {"name": self.container_name, "last_modified": _parse_time(_now())}
+
+    def get_blob_client(self, blob):
+        return SimulatedBlobClient(self, getattr(blob, "name", blob))
+
+    def upload_blob(self, name, data, overwrite=False, **kwargs):
+        blob_client = self.get_blob_client(name)
+        blob_client.upload_blob(data, overwrite=overwrite, **kwargs)
+        return blob_client
+
+    def delete_blob(self, blob, **kwargs):
+        self.get_blob_client(blob).delete_blob(**kwargs)
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        """Yield BlobProperties for every blob, sorted by name"""
+        names = []
+        for root, dirs, files in os.walk(self._props_root):
+            for file in files:
+                if file.endswith(".json"):
+                    path = os.path.join(root, file)
+                    names.append(os.path.relpath(path, self._props_root)[:-len(".json")].replace(os.sep, "/"))
+        for name in sorted(names):
+            if name_starts_with and not name.startswith(name_starts_with):
+                continue
+            record = self._read_record(name)
+            if record is not None:
+                yield BlobProperties(name, dict(record, container=self.container_name))
+
+    def set_standard_blob_tier_blobs(self, standard_blob_tier, *blobs, rehydrate_priority=None, **kwargs):
+        """Batch tier change, like the Blob Batch API (at most 256 blobs per call)"""
+        if len(blobs) > 256:
+            raise HttpResponseError("A batch can contain at most 256 sub-requests")
+        results = []
+        for blob in blobs:
+            try:
+                self.get_blob_client(blob).set_standard_blob_tier(standard_blob_tier, rehydrate_priority=rehydrate_priority)
+                results.append(BatchSubResponse(200, "OK"))
+            except HttpResponseError as e:
+                results.append(BatchSubResponse(409, str(e)))
+        return iter(results)
+
+    def _data_path(self, blob_name):
+        return os.path.join(self._root, *blob_name.split("/"))
+
+    def _blocks_path(self, blob_name):
+        digest = hashlib.sha1(blob_name.encode("utf-8")).hexdigest()
+        return os.path.join(self.service.root, f"{self.container_name}.blocks", digest)
+
+    def _props_path(self, blob_name):
+        return os.path.join(self._props_root, *blob_name.split("/")) + ".json"
+
+    def _read_record(self, blob_name):
+        try:
+            with open(self._props_path(blob_name), 'r') as f:
+                record = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return self._settle(record)
+
+    def _settle(self, record):
+        """Complete a rehydration whose simulated latency has elapsed"""
+        if record.get("archive_status") and time.time() >= record.get("rehydrate_ready_at", 0):
+            record["blob_tier"] = record.pop("rehydrate_target")
+            record["blob_tier_change_time"] = _now()
+            record.pop("archive_status")
+            record.pop("rehydrate_ready_at", None)
+        return record
+
+    def _update_record(self, blob_name, update):
+        """Read-modify-write a blob record under a cross-process lock
+
+        update receives the current record (or None) and returns the new one
+        (or None to delete it).
+        """
+        props_path = self._props_path(blob_name)
+        with _props_lock, _FileLock(os.path.join(self.service.root, f".{self.container_name}.lock")):
+            record = self._read_record(blob_name)
+            record = update(record)
+            if record is None:
+                if os.path.exists(props_path):
+                    os.unlink(props_path)
+                return None
+            os.makedirs(os.path.dirname(props_path), exist_ok=True)
+            tmp_path = f"{props_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(record, f)
+            os.replace(tmp_path, props_path)
+            return record
+
+
+class SimulatedBlobServiceClient:
+    """Mimics azure.storage.blob.BlobServiceClient on top of a local directory"""
+
+    def __init__(self, root, account_name="simulator", rehydrate_seconds=None, tier_latency=None):
+        self.root = os.path.abspath(root)
+        self.account_name = account_name
+        self.url = f"file://{self.root}"
+        self.rehydrate_seconds = dict(DEFAULT_REHYDRATE_SECONDS, **(rehydrate_seconds or {}))
+        self.tier_latency = dict(DEFAULT_TIER_LATENCY, **(tier_latency or {}))
+        os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def from_connection_string(cls, conn_str, **kwargs):
+        """
+        Parse a simulator connection string, e.g.
+        UseSimulator=true;Root=/tmp/blobs;RehydrateSeconds=10;HighPriorityRehydrateSeconds=2;CoolLatency=0.05
+        """
+        settings = dict(part.split("=", 1) for part in conn_str.split(";") if "=" in part)
+        rehydrate_seconds = {}
+        if "RehydrateSeconds" in settings:
+            rehydrate_seconds["Standard"] = float(settings["RehydrateSeconds"])
+        if "HighPriorityRehydrateSeconds" in settings:
+            rehydrate_seconds["High"] = float(settings["HighPriorityRehydrateSeconds"])
+        tier_latency = {tier: float(settings[f"{tier}Latency"]) for tier in TIERS if f"{tier}Latency" in settings}
+        return cls(
+            settings.get("Root", os.path.join(os.getcwd(), ".blob-simulator")),
+            account_name=settings.get("AccountName", "simulator"),
+            rehydrate_seconds=rehydrate_seconds,
+            tier_latency=tier_latency,
+            **kwargs
+        )
+
+    def get_container_client(self, container):
+        container_client = SimulatedContainerClient(self, container)
+        if not container_client.exists():
+            os.makedirs(container_client._root, exist_ok=True)
+            os.makedirs(container_client._props_root, exist_ok=True)
+        return container_client
+
+
+class AsyncSimulatedDownloader:
+    """Mimics the aio StorageStreamDownloader"""
+
+    def __init__(self, downloader):
+        self._downloader = downloader
+        self.properties = downloader.properties
+        self.name = downloader.name
+        self.size = downloader.size
+
+    async def chunks(self):
+        iterator = self._downloader.chunks()
+        while True:
+            block = await asyncio.to_thread(next, iterator, None)
+            if block is None:
+                return
+            yield block
+
+    async def readall(self):
+        return await asyncio.to_thread(self._downloader.readall)
+
+    async def readinto(self, stream):
+        return await asyncio.to_thread(self._downloader.readinto, stream)
+
+    async def content_as_bytes(self):
+        return await self.readall()
+
+
+class _AsyncWrapper:
+    """Runs the wrapped client's methods in a worker thread and awaits them"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(attr, *args, **kwargs)
+        return call
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AsyncSimulatedBlobClient(_AsyncWrapper):
+    """Mimics azure.storage.blob.aio.BlobClient"""
+
+    async def download_blob(self, *args, **kwargs):
+        downloader = await asyncio.to_thread(self._client.download_blob, *args, **kwargs)
+        return AsyncSimulatedDownloader(downloader)
+
+
+class AsyncSimulatedContainerClient(_AsyncWrapper):
+    """Mimics azure.storage.blob.aio.ContainerClient"""
+
+    def get_blob_client(self, blob):
+        return AsyncSimulatedBlobClient(self._client.get_blob_client(blob))
+
+    async def list_blobs(self, name_starts_with=None, **kwargs):
+        # Fetched in pages, like the service's list operation
+        iterator = self._client.list_blobs(name_starts_with=name_starts_with, **kwargs)
+        while True:
+            page = await asyncio.to_thread(lambda: list(itertools.islice(iterator, 1000)))
+            if not page:
+                return
+            for blob in page:
+                yield blob
+
+
+class AsyncSimulatedBlobServiceClient(_AsyncWrapper):
+    """Mimics azure.storage.blob.aio.BlobServiceClient on top of a local directory"""
+
+    @classmethod
+    def from_connection_string(cls, conn_str, **kwargs):
+        return cls(SimulatedBlobServiceClient.from_connection_string(conn_str, **kwargs))
+
+    def get_container_client(self, container):
+        return AsyncSimulatedContainerClient(self._client.get_container_client(container))
+
+
+class _FileLock:
+    """Exclusive lock file shared by all processes using the simulator"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+def _check_condition(record, etag, match_condition, blob_name):
+    """Apply ETag preconditions the way azure.core.MatchConditions does"""
+    if etag is None or match_condition is None:
+        return
+    condition = getattr(match_condition, "name", str(match_condition))
+    current = record["etag"] if record else None
+    if condition == "IfNotModified" and current != etag:
+        raise ResourceModifiedError(f"The condition specified using HTTP conditional header(s) is not met: {blob_name}")
+    if condition == "IfModified" and current == etag:
+        raise ResourceModifiedError(f"The condition specified using HTTP conditional header(s) is not met: {blob_name}")
+
+
+def _lease_active(lease):
+    return lease["expires_at"] is None or time.time() < lease["expires_at"]
+
+
+def _check_lease(record, lease, blob_name):
+    """Writes to a blob with an active lease must present its lease ID"""
+    current = record.get("lease") if record else None
+    lease_id = getattr(lease, "id", lease)
+    if current and _lease_active(current):
+        if lease_id is None:
+            raise HttpResponseError(f"There is currently a lease on the blob and no lease ID was specified: {blob_name}")
+        if lease_id != current["id"]:
+            raise HttpResponseError(f"The lease ID specified did not match the lease ID for the blob: {blob_name}")
+    elif lease_id is not None:
+        raise HttpResponseError(f"There is currently no lease on the blob: {blob_name}")
+
+
+def _iter_data(data):
+    if isinstance(data, str):
+        yield data.encode("utf-8")
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        yield bytes(data)
+    elif hasattr(data, "read"):
+        for block in iter(lambda: data.read(4 * 1024 * 1024), b""):
+            yield block.encode("utf-8") if isinstance(block, str) else block
+    else:
+        for block in data:
+            yield block.encode("utf-8") if isinstance(block, str) else block
+
+
+def _copy_stream(src, dst):
+    size = 0
+    for block in iter(lambda: src.read(4 * 1024 * 1024), b""):
+        dst.write(block)
+        size += len(block)
+    return size
+
+
+def _block_file(block_id):
+    value = block_id.decode("utf-8") if isinstance(block_id, bytes) else str(block_id)
+    return value.encode("utf-8").hex()
+
+
+def _tier_name(tier):
+    value = getattr(tier, "value", tier)
+    return str(value).capitalize()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else None
@@ -35,6 +35,21 @@ BACKUP_CONFIG = {
     "backup_location": str(BACKUP_DIR),
     "retention_days": int(os.getenv("RETENTION_DAYS", "30")),
     "compression": "zip",
+    "sharded": os.getenv("SHARDED_BACKUP", "False").lower() in ("true", "1", "yes"),
+    "shard_subtrees": os.getenv("SHARD_SUBTREES", "False").lower() in ("true", "1", "yes"),
+    "shard_workers": int(os.getenv("SHARD_WORKERS", "0")),  # 0 = one per shard, up to the CPU count
+    "change_tracker_dir": os.getenv("CHANGE_TRACKER_DIR", str(BACKUP_DIR / ".change_tracker")),
+    "version_index_path": os.getenv("VERSION_INDEX_PATH", str(BACKUP_DIR / ".version_index.sqlite")),
+}
+
+
+# Disaster Recovery Drill Configuration (python app/drill.py)
+DRILL_CONFIG = {
+    "results_path": os.getenv("DRILL_RESULTS_PATH", str(BACKUP_DIR / ".drills.ndjson")),
+    "scratch_dir": os.getenv("DRILL_SCRATCH_DIR") or None,  # None = system temp directory
+    "verify_workers": int(os.getenv("DRILL_VERIFY_WORKERS", "4")),
+    "rto_target_seconds": float(os.getenv("DRILL_RTO_TARGET_SECONDS", "0")),  # 0 = no target
+    "rpo_target_seconds": float(os.getenv("DRILL_RPO_TARGET_SECONDS", "0")),
 }
 
 
@@ -0,0 +1,324 @@
+"""Disaster Recovery Drills
+
+A drill restores a backup into a scratch directory the way a real recovery
+would, verifies every restored file against the source, and reports the
+achieved recovery time (RTO), the age of the recovered data (RPO),
+throughput per stage and the bottleneck. Each result is appended to an
+NDJSON file so trends can be charted over time.
+
+    python app/drill.py run [--backup NAME] [--cloud] [--keep]
+    python app/drill.py history [--limit 20]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import datetime
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# profiling.py sits at the repository root, shared with the cloud backup modules
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config import BACKUP_CONFIG, DRILL_CONFIG
+from profiling import StageTimer
+
+# Mismatched files listed in a drill result
+MAX_LISTED_MISMATCHES = 20
+
+# A stage whose CPU time is at least this share of its wall time is CPU bound
+CPU_BOUND_RATIO = 0.8
+
+
+class DrillRunner:
+    def __init__(self, backup_system, restore_system, config=None):
+        self.backup_system = backup_system
+        self.restore_system = restore_system
+        self.config = config or DRILL_CONFIG
+        self.results_path = Path(self.config["results_path"])
+
+    def run(self, backup_name=None, cloud=False, keep_scratch=False, progress_callback=None):
+        """Run a drill and record its result
+
+        Restores backup_name (default: the newest backup) from the local
+        backups directory, or from Azure when cloud=True or the backup only
+        exists there. progress_callback, if given, receives done and total
+        keyword arguments while files are restored.
+        """
+        started = time.time()
+        result = {
+            "drill_id": datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+            "started_at": datetime.datetime.fromtimestamp(started).isoformat(),
+            "backup_name": backup_name,
+            "status": "failed",
+            "error": None,
+        }
+        if self.config["scratch_dir"]:
+            Path(self.config["scratch_dir"]).mkdir(parents=True, exist_ok=True)
+        scratch = Path(tempfile.mkdtemp(prefix="drill_", dir=self.config["scratch_dir"]))
+        timer = StageTimer()
+
+        try:
+            logging.info(f"Starting DR drill in {scratch}")
+            print(f"💥 Disaster recovery drill: restoring into {scratch}")
+
+            with timer.stage("select"):
+                source, backup_name, backup_time, expected = self._select(backup_name, cloud)
+            result.update(backup_name=backup_name, source=source,
+                          backup_time=datetime.datetime.fromtimestamp(backup_time).isoformat())
+
+            if source == "cloud":
+                restored = self._restore_cloud(backup_name, scratch, timer)
+            else:
+                restored = self._restore_local(backup_name, scratch, timer, progress_callback)
+            recovered = time.time()
+
+            with timer.stage("verify"):
+                verification = self._verify(restored, expected, backup_time)
+
+            bytes_restored = sum(size for _, size in restored.values())
+            result.update(
+                rto_seconds=round(recovered - started, 2),
+                rpo_seconds=round(started - backup_time, 2),
+                verify_seconds=round(time.time() - recovered, 2),
+                files_restored=len(restored),
+                bytes_restored=bytes_restored,
+                verification=verification,
+            )
+            result["stages"] = self._stage_report(timer.breakdown(), bytes_restored)
+            result["bottleneck"] = self._bottleneck(result["stages"])
+            result["targets"] = self._check_targets(result)
+
+            passed = verification["mismatched"] == 0 and all(
+                met for key, met in result["targets"].items() if key.endswith("_met") and met is not None
+            )
+            result["status"] = "passed" if passed else "failed"
+        except Exception as e:
+            result["error"] = str(e)
+            logging.error(f"DR drill failed: {str(e)}")
+        finally:
+            result["total_seconds"] = round(time.time() - started, 2)
+            if not keep_scratch:
+                shutil.rmtree(scratch, ignore_errors=True)
+            else:
+                result["scratch_dir"] = str(scratch)
+
+        self._record(result)
+        if result["status"] == "passed":
+            print(f"✅ Drill passed: RTO {result['rto_seconds']}s, RPO {result['rpo_seconds']}s, "
+                  f"bottleneck {result['bottleneck']['stage']}")
+        else:
+            print(f"❌ Drill failed: {result['error'] or result.get('verification') or result.get('targets')}")
+        return result
+
+    def history(self, limit=None):
+        """Recorded drill results, oldest first"""
+        try:
+            with open(self.results_path, 'r') as f:
+                results = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+        return results[-limit:] if limit else results
+
+    def _select(self, backup_name, cloud):
+        """Pick the backup and the fastest place to restore it from
+
+        Returns (source, backup name, backup time, expected) where expected
+        maps every relative path the restore must produce to the source file
+        it came from.
+        """
+        if not cloud:
+            backups = self.backup_system.list_backups()
+            if backup_name is None and backups:
+                backup_name = backups[0]["backup_name"]
+            metadata = next((b for b in backups if b["backup_name"] == backup_name), None)
+            if metadata is not None:
+                # Local archives need no download, so they always win
+                backup_time = self.backup_system._backup_start_time(metadata)
+                sources = [Path(d) for d in metadata.get("source_dirs", BACKUP_CONFIG["source_dirs"])]
+                # Members of the backup's archives (across an incremental chain), read apart from the restore
+                names = self.restore_system._plan_members(backup_name).keys()
+                return "local", backup_name, backup_time, _LocalSourceMap(sources, names)
+
+        cloud_system = _cloud_backup_system()
+        if backup_name is None:
+            zips = [b for b in cloud_system.list_backups() if b.get("backup_type") == "directory_zip"]
+            if not zips:
+                raise FileNotFoundError("No local or cloud backups to drill")
+            backup_name = max(zips, key=lambda b: b["created"] or "")["name"]
+        run, members = cloud_system.get_manifest(backup_name)
+        backup_time = run.get("started_at") or (
+            datetime.datetime.fromisoformat(run["timestamp"]).timestamp() - run.get("total_time_seconds", 0)
+        )
+        return "cloud", backup_name, backup_time, {m["member"]: Path(m["original_file"]) for m in members}
+
+    def _restore_local(self, backup_name, scratch, timer, progress_callback):
+        with timer.stage("restore"):
+            success, timings = self.restore_system.restore_backup(backup_name, scratch, progress_callback=progress_callback)
+        if not success:
+            raise RuntimeError(f"Restore of {backup_name} failed, see the log")
+        for stage, timing in timings.items():
+            timer.add(f"restore.{stage}", timing["wall_seconds"], timing["cpu_seconds"])
+        return _restored_files(scratch)
+
+    def _restore_cloud(self, backup_name, scratch, timer):
+        # Members are extracted while the archive downloads
+        with timer.stage("restore"):
+            summary = _cloud_backup_system().restore_directory(backup_name, str(scratch))
+        for stage, timing in summary["timings"].items():
+            timer.add(f"restore.{stage}", timing["wall_seconds"], timing["cpu_seconds"])
+        return _restored_files(scratch)
+
+    def _verify(self, restored, expected, backup_time):
+        """Compare restored files with the source by SHA-256
+
+        A difference only counts as a mismatch when the source file has not
+        been modified since the backup was taken. Files of the backup that
+        the restore did not produce count as mismatches too.
+        """
+        def check(item):
+            relative, (path, size) = item
+            source = expected.get(relative)
+            if source is None or not source.exists():
+                return "missing_in_source", relative
+            if source.stat().st_mtime >= backup_time:
+                return "changed_since_backup", relative
+            if source.stat().st_size == size and _sha256(source) == _sha256(path):
+                return "verified", relative
+            return "mismatched", relative
+
+        counts = {"verified": 0, "changed_since_backup": 0, "missing_in_source": 0,
+                  "missing_from_restore": 0, "mismatched": 0}
+        mismatched_files = []
+        for relative in expected:
+            if relative not in restored:
+                counts["missing_from_restore"] += 1
+                if len(mismatched_files) < MAX_LISTED_MISMATCHES:
+                    mismatched_files.append(relative)
+        counts["mismatched"] = counts["missing_from_restore"]
+
+        with ThreadPoolExecutor(max_workers=self.config["verify_workers"]) as pool:
+            for outcome, relative in pool.map(check, restored.items()):
+                counts[outcome] += 1
+                if outcome == "mismatched" and len(mismatched_files) < MAX_LISTED_MISMATCHES:
+                    mismatched_files.append(relative)
+        counts["mismatched_files"] = mismatched_files
+        return counts
+
+    def _stage_report(self, timings, bytes_restored):
+        """Stage timings with the throughput each one achieved over the restored bytes"""
+        stages = {}
+        for stage, timing in timings.items():
+            wall = timing["wall_seconds"]
+            stages[stage] = dict(
+                timing,
+                mb_per_second=round(bytes_restored / (1024 * 1024) / wall, 2) if wall and stage != "select" else None,
+            )
+        return stages
+
+    def _bottleneck(self, stages):
+        """The slowest stage of the recovery (verification is not part of the RTO)"""
+        detailed = {name: s for name, s in stages.items() if name not in ("restore", "verify")}
+        name, stage = max(detailed.items(), key=lambda item: item[1]["wall_seconds"])
+        wall = stage["wall_seconds"]
+        return {
+            "stage": name,
+            "wall_seconds": wall,
+            "bound": "cpu" if wall and stage["cpu_seconds"] / wall >= CPU_BOUND_RATIO else "io",
+        }
+
+    def _check_targets(self, result):
+        rto_target = self.config["rto_target_seconds"]
+        rpo_target = self.config["rpo_target_seconds"]
+        return {
+            "rto_target_seconds": rto_target,
+            "rpo_target_seconds": rpo_target,
+            "rto_met": result["rto_seconds"] <= rto_target if rto_target else None,
+            "rpo_met": result["rpo_seconds"] <= rpo_target if rpo_target else None,
+        }
+
+    def _record(self, result):
+        self.results_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.results_path, 'a') as f:
+            f.write(json.dumps(result, default=str) + "\n")
+
+
+class _LocalSourceMap:
+    """Maps local archive members (named relative to each source's parent) to source files
+
+    Iterating yields the member names of the backup.
+    """
+
+    def __init__(self, source_dirs, names):
+        self.parents = {source.name: source.parent for source in source_dirs}
+        self.names = names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def get(self, relative):
+        top = relative.split("/", 1)[0]
+        parent = self.parents.get(top)
+        return parent / relative if parent is not None else None
+
+
+def _restored_files(scratch):
+    """Relative path (with forward slashes) -> (path, size) of every restored file"""
+    restored = {}
+    for root, dirs, files in os.walk(scratch):
+        for file in files:
+            path = Path(root) / file
+            restored[path.relative_to(scratch).as_posix()] = (path, path.stat().st_size)
+    return restored
+
+
+def _sha256(path):
+    sha256_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+
+def _cloud_backup_system():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from backup_system import BackupSystem as CloudBackupSystem
+    return CloudBackupSystem()
+
+
+if __name__ == "__main__":
+    from config import LOG_CONFIG
+    from backup import BackupSystem
+    from restore import RestoreSystem
+
+    logging.basicConfig(
+        filename=LOG_CONFIG["log_file"],
+        level=LOG_CONFIG["log_level"],
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description="Disaster recovery drills")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Restore a backup into scratch space and verify it")
+    run_parser.add_argument("--backup", help="Backup to drill (default: the newest)")
+    run_parser.add_argument("--cloud", action="store_true", help="Restore from Azure even if a local copy exists")
+    run_parser.add_argument("--keep", action="store_true", help="Keep the scratch directory")
+    history_parser = subparsers.add_parser("history", help="Show recorded drill results")
+    history_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    runner = DrillRunner(BackupSystem(), RestoreSystem())
+    if args.command == "run":
+        result = runner.run(args.backup, cloud=args.cloud, keep_scratch=args.keep)
+        print(json.dumps(result, indent=2))
+        sys.exit(0 if result["status"] == "passed" else 1)
+    else:
+        for result in runner.history(args.limit):
+            print(f"{result['drill_id']}  {result['status']:6}  {result.get('backup_name')}  "
+                  f"RTO {result.get('rto_seconds')}s  RPO {result.get('rpo_seconds')}s  "
+                  f"bottleneck {(result.get('bottleneck') or {}).get('stage')}")
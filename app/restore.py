@@ -1,9 +1,20 @@
 """Restore Module"""
+import os
+import sys
 import zipfile
+import zlib
+import time
 import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+
+# profiling.py sits at the repository root, shared with the cloud backup modules
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
 from config import BACKUP_CONFIG, LOG_CONFIG
+from profiling import StageTimer, profiled
 
 logging.basicConfig(
     filename=LOG_CONFIG["log_file"],
@@ -11,19 +22,39 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Zip timestamps only have a 2 second resolution
+MTIME_TOLERANCE_SECONDS = 2
+
+def _save_restore_profile(restore_system, result, profiler, backup_name, *args, **kwargs):
+    """Store a profiled restore's output next to the backup it restored"""
+    paths = profiler.save(restore_system.backup_dir / f"{backup_name}.restore")
+    logging.info(f"Saved restore profile: {', '.join(map(str, paths))}")
+
 class RestoreSystem:
     def __init__(self):
         self.config = BACKUP_CONFIG
         self.backup_dir = Path(self.config["backup_location"])
         
-    def restore_backup(self, backup_name, restore_location=None):
-        """Restore a specific backup"""
+    @profiled(_save_restore_profile)
+    def restore_backup(self, backup_name, restore_location=None, differential=False, delete_extras=False,
+                       progress_callback=None):
+        """Restore a specific backup
+        
+        With differential=True only members that differ from the files already
+        in restore_location are extracted. With delete_extras=True files in
+        restore_location that are not part of the backup are removed.
+        progress_callback, if given, is called with done and total keyword
+        arguments after each extracted file.
+        
+        Returns (True, per-stage wall/CPU breakdown) on success and
+        (False, None) otherwise.
+        """
         try:
             backup_path = self.backup_dir / backup_name
             
             if not backup_path.exists():
                 logging.error(f"Backup not found: {backup_name}")
-                return False
+                return False, None
             
             if restore_location is None:
                 restore_location = Path(self.config["backup_location"]).parent / "restored"
@@ -32,18 +63,167 @@ class RestoreSystem:
             
             restore_location.mkdir(parents=True, exist_ok=True)
             
-            logging.info(f"Starting restore: {backup_name} to {restore_location}")
+            mode = "differential" if differential else "full"
+            logging.info(f"Starting {mode} restore: {backup_name} to {restore_location}")
             print(f"♻️  Restoring backup: {backup_name}")
             
-            with zipfile.ZipFile(backup_path, 'r') as zipf:
-                zipf.extractall(restore_location)
-                total_files = len(zipf.namelist())
+            # Latest archive holding each member, across an incremental chain
+            timer = StageTimer()
+            with timer.stage("plan"):
+                plan = self._plan_members(backup_name)
+            by_archive = {}
+            for name, archive in plan.items():
+                by_archive.setdefault(archive, []).append(name)
             
-            logging.info(f"Restore completed: {total_files} files restored")
-            print(f"✅ Restore completed: {total_files} files")
-            return True
+            progress = {"done": 0, "total": 0}
+            progress_lock = threading.Lock()
+            
+            def archive_progress(planned=0, extracted=0):
+                with progress_lock:
+                    progress["total"] += planned
+                    progress["done"] += extracted
+                    if progress_callback and extracted:
+                        progress_callback(done=progress["done"], total=progress["total"])
+            
+            # Shards and chain layers are independent archives, restore them concurrently
+            workers = self.config.get("shard_workers") or min(len(by_archive), os.cpu_count() or 1) or 1
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(
+                    lambda item: self._restore_archive(item[0], item[1], restore_location, differential, archive_progress, timer),
+                    by_archive.items()
+                ))
+            
+            total_files = len(plan)
+            restored = sum(results)
+            
+            removed = 0
+            if delete_extras:
+                with timer.stage("delete_extras"):
+                    removed = self._delete_extras(plan.keys(), restore_location)
+            
+            skipped = total_files - restored
+            timings = timer.breakdown()
+            logging.info(
+                f"Restore completed: {restored} files restored, "
+                f"{skipped} unchanged, {removed} extras removed"
+            )
+            logging.info(f"Restore timings: {json.dumps(timings)}")
+            print(f"✅ Restore completed: {restored} of {total_files} files")
+            return True, timings
             
         except Exception as e:
             logging.error(f"Restore failed: {str(e)}")
             print(f"❌ Restore failed: {str(e)}")
+            return False, None
+    
+    def _load_metadata(self, backup_name):
+        """Load a backup's .meta file; backups without one are treated as full"""
+        try:
+            with open(self.backup_dir / f"{backup_name}.meta", 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"backup_name": backup_name}
+    
+    def _archive_paths(self, backup_name, metadata):
+        """Return the zip archives that make up a backup"""
+        backup_path = self.backup_dir / backup_name
+        if not backup_path.is_dir():
+            return [backup_path]
+        
+        # Sharded backup: the .meta file lists the shard archives
+        return [backup_path / shard["archive"] for shard in metadata["shards"]]
+    
+    def _plan_members(self, backup_name):
+        """Map every member name to the archive holding its latest version
+        
+        Incremental backups are resolved back to their full base backup and
+        applied oldest first, including the files they recorded as deleted.
+        """
+        chain = []
+        metadata = self._load_metadata(backup_name)
+        while True:
+            chain.append(metadata)
+            if metadata.get("backup_type") != "incremental":
+                break
+            metadata = self._load_metadata(metadata["base_backup"])
+        
+        plan = {}
+        for metadata in reversed(chain):
+            deleted = metadata.get("deleted")
+            if deleted:
+                exact = set(deleted)
+                prefixes = tuple(f"{name}/" for name in deleted)
+                plan = {name: archive for name, archive in plan.items()
+                        if name not in exact and not name.startswith(prefixes)}
+            
+            for archive in self._archive_paths(metadata["backup_name"], metadata):
+                with zipfile.ZipFile(archive, 'r') as zipf:
+                    for member in zipf.infolist():
+                        if not member.is_dir():
+                            plan[member.filename] = archive
+        return plan
+    
+    def _restore_archive(self, archive_path, names, restore_location, differential, progress, timer):
+        """Restore the given members of one archive, returning the restored count"""
+        with zipfile.ZipFile(archive_path, 'r') as zipf:
+            members = [zipf.getinfo(name) for name in names]
+            
+            if differential:
+                with timer.stage("compare"):
+                    members = [m for m in members if not self._member_matches(m, restore_location)]
+            progress(planned=len(members))
+            
+            for member in members:
+                with timer.stage("extract"):
+                    self._extract_member(zipf, member, restore_location)
+                progress(extracted=1)
+        
+        return len(members)
+    
+    def _member_matches(self, member, restore_location):
+        """Check whether the target already holds an identical copy of a member"""
+        target = restore_location / member.filename
+        try:
+            stat = target.stat()
+        except OSError:
             return False
+        
+        if stat.st_size != member.file_size:
+            return False
+        
+        member_mtime = time.mktime(member.date_time + (0, 0, -1))
+        if abs(stat.st_mtime - member_mtime) <= MTIME_TOLERANCE_SECONDS:
+            return True
+        
+        # Same size but different mtime, fall back to comparing the CRC
+        crc = 0
+        with open(target, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                crc = zlib.crc32(block, crc)
+        if crc != member.CRC:
+            return False
+        
+        # Align the mtime so the next differential restore takes the fast path
+        os.utime(target, (stat.st_atime, member_mtime))
+        return True
+    
+    def _extract_member(self, zipf, member, restore_location):
+        """Extract a single member and stamp it with the archived mtime"""
+        # Shards extracted concurrently can share parent directories
+        (restore_location / member.filename).parent.mkdir(parents=True, exist_ok=True)
+        extracted = zipf.extract(member, restore_location)
+        member_mtime = time.mktime(member.date_time + (0, 0, -1))
+        os.utime(extracted, (member_mtime, member_mtime))
+    
+    def _delete_extras(self, names, restore_location):
+        """Remove files under restore_location that are not in the backup"""
+        expected = {os.path.normpath(name) for name in names}
+        removed = 0
+        for root, dirs, files in os.walk(restore_location):
+            for file in files:
+                file_path = Path(root) / file
+                relative = os.path.normpath(file_path.relative_to(restore_location))
+                if relative not in expected:
+                    file_path.unlink()
+                    removed += 1
+        return removed
@@ -0,0 +1,586 @@
+"""
+Asyncio Disaster Recovery Backup System
+BackupSystem's operations on the azure.storage.blob.aio client, for async
+services and for workloads of many small objects. File reads, hashing,
+compression and encryption run in worker threads, and every transfer holds
+a slot of one shared semaphore, so a single process can keep thousands of
+transfers in flight while only the in-flight blocks are held in memory.
+
+Usage:
+    async with AsyncBackupSystem() as backup_system:
+        summary = await backup_system.backup_directory('/data', create_zip=False)
+"""
+import os
+import time
+import asyncio
+import logging
+import tempfile
+from datetime import datetime
+
+from azure.core import MatchConditions
+from azure.storage.blob.aio import BlobServiceClient
+
+from backup_crypto import Keyring, HEADER, MAX_BLOCKS, is_encrypted, plan_blocks, encrypt_block, encryption_metadata
+from backup_system import BackupSystem, zip_directory, backup_info, storage_stats
+from manifest import AsyncContainerIndex, AsyncManifestWriter, RunIndexRow, manifest_name, encode_manifest, decode_manifest, aiter_files_manifest
+from profiling import StageTimer
+from tiering import TieringPolicy, RestoreQueue, RehydrationPendingError, rehydration_entry
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBackupSystem:
+    """Handles backup and restore operations with asyncio
+
+    Use it as an async context manager, or call open() and close(), so the
+    client's connections are shut down cleanly. Directory backups without a
+    zip upload every file as its own blob (no bundle packing): with this
+    many requests in flight, small files are cheap enough on their own.
+    """
+
+    def __init__(self):
+        """Configure the Azure Storage client (connects in open())"""
+        self.connection_string = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
+        self.container_name = os.getenv('AZURE_CONTAINER_NAME', 'backups')
+
+        if not self.connection_string:
+            raise ValueError("AZURE_STORAGE_CONNECTION_STRING not set")
+
+        # Optional client-side encryption (disabled when no keys are configured)
+        self.keyring = Keyring.from_env()
+
+        # Transfers in flight across all operations; memory use is bounded
+        # by max_transfers blocks of block_size bytes
+        self.max_transfers = int(os.getenv('BACKUP_ASYNC_MAX_TRANSFERS', '64'))
+        self.block_size = int(os.getenv('BACKUP_ASYNC_BLOCK_MB', '4')) * 1024 * 1024
+        self._transfers = asyncio.Semaphore(self.max_transfers)
+
+        # "UseSimulator=true;Root=..." selects the local blob stand-in
+        if self.connection_string.startswith('UseSimulator='):
+            from app.cloud_simulator import AsyncSimulatedBlobServiceClient as service_client_class
+        else:
+            service_client_class = BlobServiceClient
+
+        self.blob_service_client = service_client_class.from_connection_string(self.connection_string)
+        self.container_client = self.blob_service_client.get_container_client(self.container_name)
+
+        # Rolling index of all backups, shared with BackupSystem
+        self.index = AsyncContainerIndex(self.container_client)
+        # Optional point-in-time file version index (version_index.py)
+        self.version_index_path = os.getenv('VERSION_INDEX_PATH')
+        # Restores of archived backups go on TieringEngine's queue
+        self.rehydrate_priority = TieringPolicy.from_env().rehydrate_priority
+        self.restore_queue = RestoreQueue()
+
+    async def open(self):
+        """Test the connection"""
+        try:
+            await self.container_client.get_container_properties()
+            logger.info("Azure Storage connection established")
+        except Exception as e:
+            logger.error(f"Failed to connect to Azure Storage: {str(e)}")
+            await self.close()
+            raise
+        return self
+
+    async def close(self):
+        await self.blob_service_client.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def backup_file(self, file_path, backup_name=None):
+        """
+        Backup a single file to Azure Storage
+
+        Args:
+            file_path: Path to file to backup
+            backup_name: Custom name for backup (optional)
+
+        Returns:
+            dict: Backup metadata including time taken
+        """
+        timer = StageTimer()
+        metadata, index_row = await self._backup_file(file_path, backup_name, timer)
+        metadata['timings'] = timer.breakdown()
+        metadata['manifest'] = await self._record_run(metadata['backup_name'], metadata, [metadata], [index_row])
+        return metadata
+
+    async def _backup_file(self, file_path, backup_name=None, timer=None):
+        """
+        Upload one file without recording a manifest
+
+        Returns:
+            tuple: (backup metadata, index row for the uploaded blob)
+        """
+        start_time = time.time()
+
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+
+        if not backup_name:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            backup_name = f"backup_{timestamp}_{os.path.basename(file_path)}"
+
+        file_size = os.path.getsize(file_path)
+        file_size_mb = file_size / (1024 * 1024)
+
+        logger.info(f"📦 Backing up: {file_path} ({file_size_mb:.2f} MB)")
+
+        timer = timer or StageTimer()
+        file_hash = await asyncio.to_thread(_in_stage, timer, 'hash', self._calculate_hash, file_path)
+
+        blob_client = self.container_client.get_blob_client(backup_name)
+        with timer.waiting('upload'):
+            upload_result, cipher = await self._upload_file(blob_client, file_path, timer)
+
+        upload_time = time.time() - start_time
+
+        metadata = {
+            'backup_name': backup_name,
+            'original_file': file_path,
+            'file_size_bytes': file_size,
+            'file_size_mb': round(file_size_mb, 2),
+            'file_hash': file_hash,
+            'mtime': os.path.getmtime(file_path),
+            'upload_time_seconds': round(upload_time, 2),
+            'timestamp': datetime.now().isoformat(),
+            'status': 'success',
+            'backup_type': 'file'
+        }
+        if cipher:
+            metadata['encryption'] = cipher.describe()
+
+        index_row = self._index_row(
+            backup_name, upload_result, cipher.encrypted_size if cipher else file_size, 'file'
+        )
+
+        logger.info(f"✅ Backup completed in {upload_time:.2f} seconds")
+
+        return metadata, index_row
+
+    async def backup_directory(self, directory_path, backup_prefix=None, create_zip=True):
+        """
+        Backup entire directory to Azure Storage
+
+        Args:
+            directory_path: Path to directory to backup
+            backup_prefix: Prefix for backup (optional)
+            create_zip: Create a single zip file (True) or individual files (False)
+
+        Returns:
+            dict: Backup summary with timing information
+        """
+        start_time = time.time()
+
+        if not os.path.isdir(directory_path):
+            raise NotADirectoryError(f"Not a directory: {directory_path}")
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if not backup_prefix:
+            dir_name = os.path.basename(os.path.normpath(directory_path))
+            backup_prefix = f"backup_{timestamp}_{dir_name}"
+
+        logger.info(f"📂 Starting directory backup: {directory_path}")
+        timer = StageTimer()
+
+        if create_zip:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp:
+                zip_path = tmp.name
+
+            logger.info(f"📦 Creating zip archive...")
+            zip_backup_name = f"{backup_prefix}.zip"
+            try:
+                members = await asyncio.to_thread(zip_directory, directory_path, zip_path, timer)
+                metadata, index_row = await self._backup_file(zip_path, zip_backup_name, timer)
+            finally:
+                os.unlink(zip_path)
+            index_row['backup_type'] = 'directory_zip'
+
+            summary = {
+                'backup_name': zip_backup_name,
+                'backup_type': 'directory_zip',
+                'directory': directory_path,
+                'file_size_mb': metadata['file_size_mb'],
+                'file_hash': metadata['file_hash'],
+                'files_backed_up': len(members),
+                'total_time_seconds': round(time.time() - start_time, 2),
+                'timings': timer.breakdown(),
+                'timestamp': datetime.now().isoformat(),
+                'status': 'success'
+            }
+            summary['manifest'] = await self._record_run(zip_backup_name, summary, members, [index_row])
+        else:
+            files_manifest = AsyncManifestWriter(self.container_client, backup_prefix)
+            run_row = RunIndexRow(backup_prefix, 'directory_individual')
+            total_size = 0
+
+            async def backup_one(file_path):
+                relative_path = os.path.relpath(file_path, directory_path)
+                try:
+                    file_metadata, index_row = await self._backup_file(
+                        file_path, f"{backup_prefix}/{relative_path}", timer
+                    )
+                except Exception as e:
+                    logger.error(f"❌ Failed to backup {file_path}: {str(e)}")
+                    return
+                nonlocal total_size
+                total_size += file_metadata['file_size_bytes']
+                run_row.add(index_row)
+                await files_manifest.add(file_metadata)
+
+            await self._for_each(_walk_files(directory_path, timer), backup_one)
+            files_manifest_name = await files_manifest.close()
+
+            summary = {
+                'backup_prefix': backup_prefix,
+                'backup_type': 'directory_individual',
+                'directory': directory_path,
+                'files_backed_up': files_manifest.count,
+                'total_size_mb': round(total_size / (1024 * 1024), 2),
+                'total_time_seconds': round(time.time() - start_time, 2),
+                'timings': timer.breakdown(),
+                'timestamp': datetime.now().isoformat(),
+                'status': 'success',
+                'files_manifest': files_manifest_name
+            }
+            summary['manifest'] = await self._record_run(backup_prefix, dict(summary), None, run_row.rows())
+
+        logger.info(f"✅ Directory backup completed in {summary['total_time_seconds']} seconds")
+
+        return summary
+
+    async def iter_backups(self):
+        """Yield list_backups() entries, from a container listing if there is no readable index"""
+        account_name = self.blob_service_client.account_name
+        entries, _ = await self.index.load()
+        if entries is None:
+            entries = await self.index.entries_from_listing()
+        for entry in entries:
+            yield backup_info(entry, account_name, self.container_name)
+
+    async def list_backups(self):
+        """
+        List all backups in Azure Storage
+
+        Returns:
+            list: List of backup information
+        """
+        try:
+            backups = [backup async for backup in self.iter_backups()]
+            logger.info(f"📋 Found {len(backups)} backups")
+            return backups
+        except Exception as e:
+            logger.error(f"❌ Failed to list backups: {str(e)}")
+            raise
+
+    async def restore_file(self, backup_name, restore_path):
+        """
+        Restore a file from Azure Storage with concurrent ranged downloads
+
+        An archived backup raises RehydrationPendingError once its
+        rehydration is started and the restore is queued.
+
+        Args:
+            backup_name: Name of backup in Azure
+            restore_path: Local path to restore to
+
+        Returns:
+            dict: Restore metadata with timing
+        """
+        start_time = time.time()
+
+        logger.info(f"🔄 Restoring: {backup_name} -> {restore_path}")
+
+        timer = StageTimer()
+        blob_client = self.container_client.get_blob_client(backup_name)
+        with timer.waiting('properties'):
+            async with self._transfers:
+                properties = await blob_client.get_blob_properties()
+
+        # Start the rehydration and queue the restore; TieringEngine.process_pending runs it
+        if properties.blob_tier == 'Archive' or properties.archive_status:
+            if not properties.archive_status:
+                async with self._transfers:
+                    await blob_client.set_standard_blob_tier('Hot', rehydrate_priority=self.rehydrate_priority)
+                logger.info(f"🔥 Rehydrating {backup_name} ({self.rehydrate_priority} priority)")
+            entry = rehydration_entry(backup_name, restore_path, self.rehydrate_priority)
+            await asyncio.to_thread(self.restore_queue.add, entry)
+            logger.info(f"⏳ Restore of archived backup queued: {backup_name} -> {restore_path}")
+            raise RehydrationPendingError(entry)
+
+        encrypted = is_encrypted(properties)
+        if encrypted and not self.keyring:
+            raise ValueError(f"Backup {backup_name} is encrypted but no encryption keys are configured")
+
+        os.makedirs(os.path.dirname(restore_path) or '.', exist_ok=True)
+
+        download_kwargs = {'etag': properties.etag, 'match_condition': MatchConditions.IfNotModified}
+        with timer.waiting('download'):
+            if encrypted:
+                await self._download_decrypted(blob_client, restore_path, timer, **download_kwargs)
+            else:
+                await self._download(blob_client, restore_path, properties.size, timer, **download_kwargs)
+
+        restore_time = time.time() - start_time
+        file_size = os.path.getsize(restore_path)
+
+        metadata = {
+            'backup_name': backup_name,
+            'restored_to': restore_path,
+            'file_size_mb': round(file_size / (1024 * 1024), 2),
+            'restore_time_seconds': round(restore_time, 2),
+            'encrypted': encrypted,
+            'timings': timer.breakdown(),
+            'timestamp': datetime.now().isoformat(),
+            'status': 'success'
+        }
+
+        logger.info(f"✅ Restore completed in {restore_time:.2f} seconds")
+
+        return metadata
+
+    async def delete_backup(self, backup_name):
+        """Delete a backup from Azure Storage"""
+        try:
+            async with self._transfers:
+                await self.container_client.get_blob_client(backup_name).delete_blob()
+
+            # Also delete the file backup's manifest and any legacy metadata sidecar
+            async def delete_if_present(name):
+                try:
+                    async with self._transfers:
+                        await self.container_client.get_blob_client(name).delete_blob()
+                except Exception:
+                    pass
+
+            await asyncio.gather(
+                delete_if_present(manifest_name(backup_name)),
+                delete_if_present(f"{backup_name}.metadata.json")
+            )
+            await self.index.update(removed=[backup_name])
+
+            logger.info(f"🗑️  Deleted backup: {backup_name}")
+            return {
+                'status': 'deleted',
+                'backup_name': backup_name,
+                'timestamp': datetime.now().isoformat()
+            }
+        except Exception as e:
+            logger.error(f"❌ Failed to delete {backup_name}: {str(e)}")
+            raise
+
+    async def get_storage_stats(self):
+        """Get storage usage statistics"""
+        return storage_stats(await self.list_backups())
+
+    async def get_manifest(self, run_name):
+        """
+        Fetch the manifest of a backup run
+
+        Returns:
+            tuple: (run summary, list of per-file metadata)
+        """
+        data = await self._read(self.container_client.get_blob_client(manifest_name(run_name)))
+        run, files = await asyncio.to_thread(decode_manifest, data)
+        if files is None:
+            files = [entry async for entry in self._iter_files_manifest(run)]
+        return run, files
+
+    async def iter_manifest_files(self, run_name):
+        """Yield the per-file metadata of a backup run, streaming NDJSON file manifests"""
+        data = await self._read(self.container_client.get_blob_client(manifest_name(run_name)))
+        run, files = await asyncio.to_thread(decode_manifest, data)
+        if files is not None:
+            for entry in files:
+                yield entry
+        else:
+            async for entry in self._iter_files_manifest(run):
+                yield entry
+
+    def _iter_files_manifest(self, run):
+        return aiter_files_manifest(self.container_client.get_blob_client(run['files_manifest']))
+
+    async def _upload_file(self, blob_client, file_path, timer=None):
+        """
+        Upload a local file, encrypted when a keyring is configured
+
+        Small plain files take a single request. Anything else is staged as
+        blocks concurrently, each read (and encrypted) in a worker thread
+        only once it holds a transfer slot. The worker threads' time goes to
+        timer's 'read' or 'encrypt' stage.
+
+        Returns:
+            tuple: (upload result, ChunkCipher or None)
+        """
+        timer = timer or StageTimer()
+        file_size = os.path.getsize(file_path)
+
+        if self.keyring:
+            cipher = self.keyring.new_cipher(file_size)
+            chunks_per_block, block_ids = plan_blocks(cipher)
+            read_block = lambda block: encrypt_block(cipher, file_path, block, chunks_per_block)
+            metadata = encryption_metadata(cipher)
+        elif file_size <= self.block_size:
+            async with self._transfers:
+                data = await asyncio.to_thread(_in_stage, timer, 'read', _read_at, file_path, 0, file_size)
+                return await blob_client.upload_blob(data, overwrite=True), None
+        else:
+            cipher = metadata = None
+            block_size = max(self.block_size, -(-file_size // MAX_BLOCKS))
+            block_ids = [f"{block:08d}" for block in range(-(-file_size // block_size))]
+            read_block = lambda block: _read_at(file_path, block * block_size, block_size)
+
+        read_stage = 'encrypt' if cipher else 'read'
+
+        async def stage(block):
+            async with self._transfers:
+                data = await asyncio.to_thread(_in_stage, timer, read_stage, read_block, block)
+                await blob_client.stage_block(block_ids[block], data)
+
+        await _gather(stage(block) for block in range(len(block_ids)))
+        async with self._transfers:
+            return await blob_client.commit_block_list(block_ids, metadata=metadata), cipher
+
+    async def _read(self, blob_client, offset=None, length=None, **download_kwargs):
+        downloader = await blob_client.download_blob(offset=offset, length=length, **download_kwargs)
+        return await downloader.readall()
+
+    async def _download(self, blob_client, dest_path, size, timer=None, **download_kwargs):
+        """Download a blob as concurrent ranged reads, each written into place (timer's 'write' stage)"""
+        timer = timer or StageTimer()
+        await asyncio.to_thread(_preallocate, dest_path, size)
+
+        async def fetch(offset):
+            async with self._transfers:
+                data = await self._read(blob_client, offset, min(self.block_size, size - offset), **download_kwargs)
+                await asyncio.to_thread(_in_stage, timer, 'write', _write_at, dest_path, offset, data)
+
+        await _gather(fetch(offset) for offset in range(0, size, self.block_size))
+
+    async def _download_decrypted(self, blob_client, dest_path, timer=None, **download_kwargs):
+        """Download an encrypted blob chunk by chunk, decrypting each one into place (timer's 'decrypt' stage)"""
+        timer = timer or StageTimer()
+        async with self._transfers:
+            header = await self._read(blob_client, 0, HEADER.size, **download_kwargs)
+        cipher = self.keyring.cipher_from_header(header)
+        await asyncio.to_thread(_preallocate, dest_path, cipher.plaintext_size)
+
+        def decrypt_into_place(index, data):
+            _write_at(dest_path, index * cipher.chunk_size, cipher.decrypt_chunk(index, data))
+
+        async def fetch(index):
+            offset, length = cipher.chunk_range(index, index)
+            async with self._transfers:
+                data = await self._read(blob_client, offset, length, **download_kwargs)
+                await asyncio.to_thread(_in_stage, timer, 'decrypt', decrypt_into_place, index, data)
+
+        await _gather(fetch(index) for index in range(cipher.chunk_count))
+        return cipher
+
+    async def _for_each(self, items, func):
+        """
+        Await func(item) for every item of an async iterable, with
+        max_transfers workers fed through a bounded queue so a huge tree
+        is never held in memory
+        """
+        queue = asyncio.Queue(maxsize=self.max_transfers * 2)
+
+        async def produce():
+            async for item in items:
+                await queue.put(item)
+            for _ in range(self.max_transfers):
+                await queue.put(None)
+
+        async def work():
+            while (item := await queue.get()) is not None:
+                await func(item)
+
+        await _gather([produce()] + [work() for _ in range(self.max_transfers)])
+
+    async def _record_run(self, run_name, run, files, index_rows):
+        """
+        Save one manifest for a backup run and add its blobs to the container index
+
+        files is None when the run streamed its entries to run['files_manifest'].
+
+        Returns:
+            str: Blob name of the manifest
+        """
+        name = manifest_name(run_name)
+        try:
+            data = await asyncio.to_thread(encode_manifest, run, files)
+            await self.container_client.get_blob_client(name).upload_blob(data, overwrite=True)
+            for index_row in index_rows:
+                index_row['manifest'] = name
+        except Exception as e:
+            logger.warning(f"⚠️  Failed to save metadata: {str(e)}")
+
+        try:
+            await self.index.update(added=index_rows)
+        except Exception as e:
+            # A stale index would hide this run, so drop it and let listings take over
+            logger.warning(f"⚠️  Failed to update the backup index, dropping it: {str(e)}")
+            try:
+                await self.index.invalidate()
+            except Exception as e:
+                logger.warning(f"⚠️  Failed to drop the backup index, rebuild it with 'python manifest.py rebuild': {str(e)}")
+
+        if self.version_index_path:
+            if files is None:
+                # The version index is written from a worker thread, so read the entries back first
+                files = [entry async for entry in self._iter_files_manifest(run)]
+            await asyncio.to_thread(self._add_to_version_index, name, run, files)
+        return name
+
+    # These don't touch the client, so they are shared with BackupSystem as is
+    _calculate_hash = BackupSystem._calculate_hash
+    _index_row = BackupSystem._index_row
+    _add_to_version_index = BackupSystem._add_to_version_index
+
+
+async def _gather(coroutines):
+    """Run coroutines concurrently; on the first failure cancel the rest and re-raise"""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def _walk_files(directory_path, timer):
+    """Yield the files under directory_path, walking the tree in a worker thread"""
+    walker = timer.iterate('scan', os.walk(directory_path))
+    while (step := await asyncio.to_thread(next, walker, None)) is not None:
+        root, dirs, files = step
+        for file in files:
+            yield os.path.join(root, file)
+
+
+def _in_stage(timer, name, func, *args):
+    # Run in the worker thread so the stage's CPU time is that thread's
+    with timer.stage(name):
+        return func(*args)
+
+
+def _read_at(path, offset, length):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def _write_at(path, offset, data):
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def _preallocate(path, size):
+    with open(path, 'wb') as f:
+        f.truncate(size)
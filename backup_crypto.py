@@ -0,0 +1,315 @@
+"""
+Client-side encryption for backups stored in Azure Blob Storage
+Files are split into fixed-size chunks that are encrypted independently
+(AES-256-GCM or ChaCha20-Poly1305), so uploads can stage blocks in parallel
+and restores can download and decrypt byte ranges in parallel.
+
+Blob layout: a fixed-size header followed by the encrypted chunks, each one
+the chunk's ciphertext plus a 16 byte authentication tag.
+"""
+import os
+import re
+import base64
+import struct
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+except ImportError:  # Only needed once encryption keys are configured
+    AESGCM = ChaCha20Poly1305 = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DRENC1"
+FORMAT_VERSION = 1
+
+# magic, version, algorithm, chunk size, plaintext size, salt, key ID length, key ID
+HEADER = struct.Struct(">6sBBIQ16sB63s")
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Azure allows at most 50,000 committed blocks per blob
+MAX_BLOCKS = 50000
+
+ALGORITHMS = {1: 'AES-256-GCM', 2: 'ChaCha20-Poly1305'}
+ALGORITHM_IDS = {name.lower(): algorithm_id for algorithm_id, name in ALGORITHMS.items()}
+
+KEY_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,63}$')
+
+
+class Keyring:
+    """Master keys by key ID
+
+    New backups are encrypted with the active key; restores pick the key
+    whose ID is recorded in the blob header, so old keys can stay in the
+    keyring after a rotation.
+    """
+
+    def __init__(self, keys, active_key_id, algorithm='AES-256-GCM', chunk_size=DEFAULT_CHUNK_SIZE):
+        if AESGCM is None:
+            raise ImportError("Backup encryption requires the 'cryptography' package")
+        for key_id, key in keys.items():
+            if not KEY_ID_PATTERN.match(key_id):
+                raise ValueError(f"Invalid encryption key ID: {key_id!r}")
+            if len(key) != 32:
+                raise ValueError(f"Encryption key {key_id} must be 32 bytes")
+        if active_key_id not in keys:
+            raise ValueError(f"Active encryption key {active_key_id!r} is not in the keyring")
+        if algorithm.lower() not in ALGORITHM_IDS:
+            raise ValueError(f"Unsupported encryption algorithm: {algorithm}")
+
+        self.keys = keys
+        self.active_key_id = active_key_id
+        self.algorithm_id = ALGORITHM_IDS[algorithm.lower()]
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a keyring from the environment, or return None if encryption is off
+
+        BACKUP_ENCRYPTION_KEYS holds "id:base64key" pairs separated by commas;
+        BACKUP_ENCRYPTION_KEY is a single base64 key. BACKUP_ENCRYPTION_KEY_ID
+        picks the key for new backups (default: the first one listed).
+        """
+        keys = {}
+        for entry in filter(None, (e.strip() for e in os.getenv('BACKUP_ENCRYPTION_KEYS', '').split(','))):
+            key_id, _, encoded = entry.partition(':')
+            keys[key_id.strip()] = base64.b64decode(encoded.strip())
+
+        active_key_id = os.getenv('BACKUP_ENCRYPTION_KEY_ID')
+        single_key = os.getenv('BACKUP_ENCRYPTION_KEY')
+        if single_key:
+            active_key_id = active_key_id or 'default'
+            keys[active_key_id] = base64.b64decode(single_key)
+
+        if not keys:
+            return None
+        return cls(
+            keys,
+            active_key_id or next(iter(keys)),
+            algorithm=os.getenv('BACKUP_ENCRYPTION_ALGORITHM', 'AES-256-GCM'),
+            chunk_size=int(os.getenv('BACKUP_ENCRYPTION_CHUNK_KB', '4096')) * 1024,
+        )
+
+    def new_cipher(self, plaintext_size):
+        """Cipher for a new backup of plaintext_size bytes, with a fresh salt"""
+        return ChunkCipher(
+            self.keys[self.active_key_id], self.active_key_id, self.algorithm_id,
+            self.chunk_size, plaintext_size, os.urandom(16)
+        )
+
+    def cipher_from_header(self, header):
+        """Cipher for an existing backup, from the first HEADER.size bytes of the blob"""
+        if len(header) < HEADER.size:
+            raise ValueError("Encrypted backup header is truncated")
+        magic, version, algorithm_id, chunk_size, plaintext_size, salt, key_id_length, key_id = \
+            HEADER.unpack(header[:HEADER.size])
+        if magic != MAGIC or version != FORMAT_VERSION or algorithm_id not in ALGORITHMS:
+            raise ValueError("Not an encrypted backup or unsupported format")
+        key_id = key_id[:key_id_length].decode('ascii')
+        if key_id not in self.keys:
+            raise ValueError(f"Backup was encrypted with unknown key ID: {key_id}")
+        return ChunkCipher(self.keys[key_id], key_id, algorithm_id, chunk_size, plaintext_size, salt)
+
+
+class ChunkCipher:
+    """Encrypts and decrypts the chunks of one blob
+
+    Each blob gets its own data key, derived from the master key and a
+    random salt, so chunk nonces can simply count up from zero. The header
+    and chunk index are authenticated with every chunk, which catches
+    reordered, truncated or tampered data.
+    """
+
+    def __init__(self, master_key, key_id, algorithm_id, chunk_size, plaintext_size, salt):
+        self.key_id = key_id
+        self.algorithm = ALGORITHMS[algorithm_id]
+        self.chunk_size = chunk_size
+        self.plaintext_size = plaintext_size
+        self.header = HEADER.pack(
+            MAGIC, FORMAT_VERSION, algorithm_id, chunk_size, plaintext_size,
+            salt, len(key_id), key_id.encode('ascii')
+        )
+
+        data_key = HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=salt, info=b"disaster-recovery-backup chunk key"
+        ).derive(master_key)
+        self._aead = AESGCM(data_key) if algorithm_id == 1 else ChaCha20Poly1305(data_key)
+
+    @property
+    def chunk_count(self):
+        # An empty file still has one (empty) chunk, so truncation is detectable
+        return max(1, -(-self.plaintext_size // self.chunk_size))
+
+    @property
+    def encrypted_size(self):
+        return HEADER.size + self.plaintext_size + self.chunk_count * TAG_SIZE
+
+    def describe(self):
+        """Encryption details for backup metadata"""
+        return {'algorithm': self.algorithm, 'key_id': self.key_id, 'chunk_size': self.chunk_size}
+
+    def plaintext_length(self, index):
+        return min(self.chunk_size, self.plaintext_size - index * self.chunk_size)
+
+    def chunk_range(self, first, last):
+        """(offset, length) of encrypted chunks first..last (inclusive) in the blob"""
+        offset = HEADER.size + first * (self.chunk_size + TAG_SIZE)
+        end = HEADER.size + last * (self.chunk_size + TAG_SIZE) + self.plaintext_length(last) + TAG_SIZE
+        return offset, end - offset
+
+    def encrypt_chunk(self, index, plaintext):
+        if len(plaintext) != self.plaintext_length(index):
+            raise IOError("File changed while it was being encrypted")
+        return self._aead.encrypt(self._nonce(index), plaintext, self._aad(index))
+
+    def decrypt_chunk(self, index, data):
+        try:
+            return self._aead.decrypt(self._nonce(index), bytes(data), self._aad(index))
+        except InvalidTag:
+            raise ValueError(f"Encrypted backup failed authentication at chunk {index}") from None
+
+    def decrypt_chunks(self, first, data):
+        """Decrypt consecutive encrypted chunks starting at chunk first"""
+        plaintext = []
+        view = memoryview(data)
+        index = first
+        while view:
+            length = self.plaintext_length(index) + TAG_SIZE
+            plaintext.append(self.decrypt_chunk(index, view[:length]))
+            view = view[length:]
+            index += 1
+        return b"".join(plaintext)
+
+    def _nonce(self, index):
+        return index.to_bytes(12, 'big')
+
+    def _aad(self, index):
+        return self.header + index.to_bytes(8, 'big')
+
+
+def is_encrypted(properties):
+    """Whether a blob was written by upload_encrypted, from its properties"""
+    return 'encryption_key_id' in (properties.metadata or {})
+
+
+def plan_blocks(cipher):
+    """
+    Split an encrypted blob into staged blocks of whole chunks
+
+    Returns:
+        tuple: (chunks per block, list of block IDs)
+    """
+    chunks_per_block = -(-cipher.chunk_count // MAX_BLOCKS)
+    block_count = -(-cipher.chunk_count // chunks_per_block)
+    return chunks_per_block, [f"{block:08d}" for block in range(block_count)]
+
+
+def encrypt_block(cipher, file_path, block, chunks_per_block):
+    """Encrypted bytes of one staged block (the first one starts with the header)"""
+    first = block * chunks_per_block
+    parts = [cipher.header] if block == 0 else []
+    with open(file_path, 'rb') as src:
+        src.seek(first * cipher.chunk_size)
+        for index in range(first, min(first + chunks_per_block, cipher.chunk_count)):
+            parts.append(cipher.encrypt_chunk(index, src.read(cipher.chunk_size)))
+    return b"".join(parts)
+
+
+def encryption_metadata(cipher):
+    """Blob metadata marking a blob as encrypted"""
+    return {
+        'encryption_algorithm': cipher.algorithm,
+        'encryption_key_id': cipher.key_id,
+        'encryption_chunk_size': str(cipher.chunk_size),
+    }
+
+
+def upload_encrypted(blob_client, file_path, keyring, max_concurrency=4, tee=None):
+    """
+    Encrypt a file and upload it as blocks staged in parallel
+
+    Each block is also written at its offset into tee (a restore cache
+    CacheTee) when given, so the cache gets exactly the uploaded bytes.
+
+    Returns:
+        tuple: (upload result, ChunkCipher used)
+    """
+    cipher = keyring.new_cipher(os.path.getsize(file_path))
+    chunks_per_block, block_ids = plan_blocks(cipher)
+
+    def stage(block):
+        data = encrypt_block(cipher, file_path, block, chunks_per_block)
+        blob_client.stage_block(block_ids[block], data)
+        if tee:
+            # Block 0 starts with the header; later ones at their first chunk
+            offset = HEADER.size + block * chunks_per_block * (cipher.chunk_size + TAG_SIZE) if block else 0
+            tee.write_at(offset, data)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        list(pool.map(stage, range(len(block_ids))))
+
+    return blob_client.commit_block_list(block_ids, metadata=encryption_metadata(cipher)), cipher
+
+
+def read_header(blob_client, keyring, **download_kwargs):
+    """Fetch an encrypted blob's header and return its ChunkCipher"""
+    header = blob_client.download_blob(offset=0, length=HEADER.size, **download_kwargs).readall()
+    return keyring.cipher_from_header(header)
+
+
+def download_decrypted(blob_client, dest_path, keyring, max_concurrency=4, **download_kwargs):
+    """
+    Download an encrypted blob with parallel ranged reads, decrypting each
+    chunk straight into its place in dest_path
+
+    Returns:
+        ChunkCipher: The blob's cipher
+    """
+    cipher = read_header(blob_client, keyring, **download_kwargs)
+    with open(dest_path, 'wb') as f:
+        f.truncate(cipher.plaintext_size)
+
+    def fetch(index):
+        offset, length = cipher.chunk_range(index, index)
+        data = blob_client.download_blob(offset=offset, length=length, **download_kwargs).readall()
+        plaintext = cipher.decrypt_chunk(index, data)
+        with open(dest_path, 'r+b') as f:
+            f.seek(index * cipher.chunk_size)
+            f.write(plaintext)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        list(pool.map(fetch, range(cipher.chunk_count)))
+    return cipher
+
+
+def read_range(blob_client, keyring, offset, length, cipher=None, **download_kwargs):
+    """
+    Read plaintext bytes [offset, offset + length) of an encrypted blob,
+    downloading only the chunks that cover them
+    """
+    cipher = cipher or read_header(blob_client, keyring, **download_kwargs)
+    length = min(length, cipher.plaintext_size - offset)
+    if length <= 0:
+        return b""
+    first = offset // cipher.chunk_size
+    last = (offset + length - 1) // cipher.chunk_size
+    range_offset, range_length = cipher.chunk_range(first, last)
+    data = blob_client.download_blob(offset=range_offset, length=range_length, **download_kwargs).readall()
+    start = offset - first * cipher.chunk_size
+    return cipher.decrypt_chunks(first, data)[start:start + length]
+
+
+def decrypt_file(src_path, dest_path, keyring):
+    """Decrypt a local copy of an encrypted blob, e.g. a restore cache entry"""
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        cipher = keyring.cipher_from_header(src.read(HEADER.size))
+        for index in range(cipher.chunk_count):
+            data = src.read(cipher.plaintext_length(index) + TAG_SIZE)
+            dest.write(cipher.decrypt_chunk(index, data))
+    return cipher
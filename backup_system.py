@@ -6,11 +6,26 @@ import os
 import json
 import logging
 from datetime import datetime
-from azure.storage.blob import BlobServiceClient
+from azure.core import MatchConditions
 import hashlib
+import itertools
 import time
+import shutil
 import zipfile
 import tempfile
+import threading
+from restore_cache import RestoreCache
+from backup_crypto import Keyring, upload_encrypted, download_decrypted, decrypt_file, is_encrypted, read_range, read_header
+from bundles import BundlePacker, find_bundle_entry, write_bundled_file
+from ranged_zip import BlobRangeReader, extract_ranges
+from manifest import (
+    ContainerIndex, RunIndexRow, ManifestWriter, manifest_name, encode_manifest, decode_manifest, iter_files_manifest,
+    is_internal_blob, PROFILE_PREFIX
+)
+from profiling import StageTimer, profiled
+from file_index import FileIndexBuilder
+from version_index import VersionIndex
+from tiering import TieringEngine, RehydrationPendingError
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,31 +33,145 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _save_profile(backup_system, result, profiler, *args, **kwargs):
+    """Upload a profiled run's output under _profiles/, next to its manifest"""
+    run_name = result.get('backup_prefix') or result['backup_name']
+    if 'restored_to' in result:
+        run_name = f"{run_name}.restore"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_path = os.path.join(tmp_dir, 'profile')
+        for path in profiler.save(base_path):
+            blob_name = f"{PROFILE_PREFIX}{run_name}{path[len(base_path):]}"
+            with open(path, 'rb') as data:
+                backup_system.container_client.get_blob_client(blob_name).upload_blob(data, overwrite=True)
+            logger.info(f"📈 Saved profile: {blob_name}")
+
+def zip_directory(directory_path, zip_path, timer):
+    """
+    Compress a directory tree into zip_path
+    
+    Returns:
+        list: Manifest entries for the archive's members
+    """
+    members = []
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for root, dirs, files in timer.iterate('scan', os.walk(directory_path)):
+            for file in files:
+                file_path = os.path.join(root, file)
+                members.append(zip_member(zipf, file_path, os.path.relpath(file_path, directory_path), timer))
+    return members
+
+def zip_member(zipf, file_path, arcname, timer):
+    """
+    Compress one file into an open archive
+    
+    Returns:
+        dict: Manifest entry for the member
+    """
+    with timer.stage('compress'):
+        zipf.write(file_path, arcname)
+    info = zipf.infolist()[-1]
+    return {
+        'member': info.filename,
+        'original_file': file_path,
+        'file_size_bytes': info.file_size,
+        'crc32': info.CRC,
+        'mtime': os.path.getmtime(file_path)
+    }
+
+def backup_info(entry, account_name, container_name):
+    """list_backups() entry for a container index entry"""
+    return {
+        'name': entry['name'],
+        'size_bytes': entry['size_bytes'],
+        'size_mb': round(entry['size_bytes'] / (1024 * 1024), 2),
+        'created': entry.get('created'),
+        'last_modified': entry.get('last_modified'),
+        'tier': entry.get('tier'),
+        'backup_type': entry.get('backup_type'),
+        'manifest': entry.get('manifest'),
+        'url': f"https://{account_name}.blob.core.windows.net/{container_name}/{entry['name']}"
+    }
+
+def storage_stats(backups):
+    """Storage usage statistics from list_backups() entries"""
+    total_size = sum(b['size_bytes'] for b in backups)
+    total_size_mb = total_size / (1024 * 1024)
+    total_size_gb = total_size / (1024 * 1024 * 1024)
+    
+    size_by_tier = {}
+    for b in backups:
+        tier = b.get('tier') or 'Hot'
+        size_by_tier[tier] = size_by_tier.get(tier, 0) + b['size_bytes']
+    
+    return {
+        'total_backups': len(backups),
+        'total_size_bytes': total_size,
+        'total_size_mb': round(total_size_mb, 2),
+        'total_size_gb': round(total_size_gb, 2),
+        'size_by_tier_mb': {tier: round(size / (1024 * 1024), 2) for tier, size in size_by_tier.items()},
+        'oldest_backup': min((b['created'] for b in backups if b['created']), default=None),
+        'newest_backup': max((b['created'] for b in backups if b['created']), default=None),
+        'timestamp': datetime.now().isoformat()
+    }
+
 class BackupSystem:
     """Handles backup and restore operations"""
     
-    def __init__(self):
-        """Initialize Azure Storage connection"""
+    def __init__(self, validate=True):
+        """
+        Initialize Azure Storage connection
+        
+        Args:
+            validate: Check the connection with a request to the container (optional).
+                Without it no request is made until the first operation.
+        """
         self.connection_string = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
         self.container_name = os.getenv('AZURE_CONTAINER_NAME', 'backups')
         
         if not self.connection_string:
             raise ValueError("AZURE_STORAGE_CONNECTION_STRING not set")
         
+        # Optional local cache in front of restore downloads
+        self.restore_cache = RestoreCache.from_env()
+        self.prewarm_count = int(os.getenv('RESTORE_CACHE_PREWARM', '0'))
+        self._prewarm_lock = threading.Lock()
+        
+        # Optional client-side encryption (disabled when no keys are configured)
+        self.keyring = Keyring.from_env()
+        self.max_concurrency = int(os.getenv('BACKUP_MAX_CONCURRENCY', '4'))
+        
+        # "UseSimulator=true;Root=..." selects the local blob stand-in; the
+        # storage SDK is imported here since it takes a while to load
+        if self.connection_string.startswith('UseSimulator='):
+            from app.cloud_simulator import SimulatedBlobServiceClient as service_client_class
+        else:
+            from azure.storage.blob import BlobServiceClient as service_client_class
+        
         try:
-            self.blob_service_client = BlobServiceClient.from_connection_string(
+            self.blob_service_client = service_client_class.from_connection_string(
                 self.connection_string
             )
             self.container_client = self.blob_service_client.get_container_client(
                 self.container_name
             )
-            # Test connection
-            self.container_client.get_container_properties()
-            logger.info("Azure Storage connection established")
+            if validate:
+                # Test connection
+                self.container_client.get_container_properties()
+                logger.info("Azure Storage connection established")
         except Exception as e:
             logger.error(f"Failed to connect to Azure Storage: {str(e)}")
             raise
+        
+        # Rolling index of all backups, read by list_backups and get_storage_stats
+        self.index = ContainerIndex(self.container_client)
+        # Optional point-in-time file version index (version_index.py)
+        self.version_index_path = os.getenv('VERSION_INDEX_PATH')
+        
+        # Age-based tier management and queued restores of archived backups
+        self.tiering = TieringEngine(self)
     
+    @profiled(_save_profile)
     def backup_file(self, file_path, backup_name=None):
         """
         Backup a single file to Azure Storage
@@ -54,6 +183,21 @@ class BackupSystem:
         Returns:
             dict: Backup metadata including time taken
         """
+        timer = StageTimer()
+        metadata, index_row = self._backup_file(file_path, backup_name, timer)
+        metadata['timings'] = timer.breakdown()
+        metadata['manifest'] = self._record_run(metadata['backup_name'], metadata, [metadata], [index_row])
+        return metadata
+    
+    def _backup_file(self, file_path, backup_name=None, timer=None):
+        """
+        Upload one file without recording a manifest
+        
+        Hashing and upload time are added to timer when given.
+        
+        Returns:
+            tuple: (backup metadata, index row for the uploaded blob)
+        """
         start_time = time.time()
         
         if not os.path.exists(file_path):
@@ -71,14 +215,20 @@ class BackupSystem:
         
         logger.info(f"📦 Backing up: {file_path} ({file_size_mb:.2f} MB)")
         
+        timer = timer or StageTimer()
+        
         # Calculate file hash for integrity verification
-        file_hash = self._calculate_hash(file_path)
+        with timer.stage('hash'):
+            file_hash = self._calculate_hash(file_path)
         
         # Upload to Azure
         blob_client = self.container_client.get_blob_client(backup_name)
         
-        with open(file_path, 'rb') as data:
-            blob_client.upload_blob(data, overwrite=True)
+        with timer.stage('upload'):
+            if self.restore_cache and self.prewarm_count > 0:
+                upload_result, cipher = self._upload_and_cache(blob_client, backup_name, file_path)
+            else:
+                upload_result, cipher = self._upload_file(blob_client, file_path)
         
         upload_time = time.time() - start_time
         
@@ -89,19 +239,27 @@ class BackupSystem:
             'file_size_bytes': file_size,
             'file_size_mb': round(file_size_mb, 2),
             'file_hash': file_hash,
+            'mtime': os.path.getmtime(file_path),
             'upload_time_seconds': round(upload_time, 2),
             'timestamp': datetime.now().isoformat(),
             'status': 'success',
             'backup_type': 'file'
         }
+        if cipher:
+            metadata['encryption'] = cipher.describe()
+        
+        index_row = self._index_row(
+            backup_name, upload_result, cipher.encrypted_size if cipher else file_size, 'file'
+        )
         
-        # Save metadata
-        self._save_metadata(backup_name, metadata)
+        if self.restore_cache and self.prewarm_count > 0:
+            self._prewarm_cache()
         
         logger.info(f"✅ Backup completed in {upload_time:.2f} seconds")
         
-        return metadata
+        return metadata, index_row
     
+    @profiled(_save_profile)
     def backup_directory(self, directory_path, backup_prefix=None, create_zip=True):
         """
         Backup entire directory to Azure Storage
@@ -125,6 +283,7 @@ class BackupSystem:
             backup_prefix = f"backup_{timestamp}_{dir_name}"
         
         logger.info(f"📂 Starting directory backup: {directory_path}")
+        timer = StageTimer()
         
         if create_zip:
             # Create zip file
@@ -132,16 +291,12 @@ class BackupSystem:
                 zip_path = tmp.name
             
             logger.info(f"📦 Creating zip archive...")
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(directory_path):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, directory_path)
-                        zipf.write(file_path, arcname)
+            members = zip_directory(directory_path, zip_path, timer)
             
             # Backup the zip file
             zip_backup_name = f"{backup_prefix}.zip"
-            metadata = self.backup_file(zip_path, zip_backup_name)
+            metadata, index_row = self._backup_file(zip_path, zip_backup_name, timer)
+            index_row['backup_type'] = 'directory_zip'
             
             # Clean up temp file
             os.unlink(zip_path)
@@ -153,41 +308,74 @@ class BackupSystem:
                 'backup_type': 'directory_zip',
                 'directory': directory_path,
                 'file_size_mb': metadata['file_size_mb'],
+                'file_hash': metadata['file_hash'],
+                'files_backed_up': len(members),
                 'total_time_seconds': round(total_time, 2),
+                'timings': timer.breakdown(),
                 'timestamp': datetime.now().isoformat(),
                 'status': 'success'
             }
+            # The manifest lists the archive's members
+            summary['manifest'] = self._record_run(zip_backup_name, summary, members, [index_row])
         else:
-            # Backup individual files
-            backed_up_files = []
+            # Backup individual files; small ones are packed into bundle blobs.
+            # File entries stream to the run's file manifest and the container
+            # index gets one row for the whole run, instead of piling up in memory
+            files_manifest = ManifestWriter(self.container_client, backup_prefix)
+            run_row = RunIndexRow(backup_prefix, 'directory_individual')
             total_size = 0
+            packer = BundlePacker(self, backup_prefix, run_row, timer=timer)
             
-            for root, dirs, files in os.walk(directory_path):
+            for root, dirs, files in timer.iterate('scan', os.walk(directory_path)):
                 for file in files:
                     file_path = os.path.join(root, file)
                     relative_path = os.path.relpath(file_path, directory_path)
                     backup_name = f"{backup_prefix}/{relative_path}"
                     
                     try:
-                        file_metadata = self.backup_file(file_path, backup_name)
-                        backed_up_files.append(file_metadata)
+                        if packer.should_pack(os.path.getsize(file_path)):
+                            with timer.stage('pack'):
+                                entry = packer.add(relative_path, file_path)
+                            file_metadata = {
+                                'backup_name': backup_name,
+                                'original_file': file_path,
+                                'file_size_bytes': entry['length'],
+                                'file_hash': entry['sha256'],
+                                'mtime': os.path.getmtime(file_path),
+                                'bundle': entry['bundle'],
+                                'bundle_offset': entry['offset']
+                            }
+                        else:
+                            file_metadata, index_row = self._backup_file(file_path, backup_name, timer)
+                            run_row.add(index_row)
+                        with timer.stage('manifest'):
+                            files_manifest.add(file_metadata)
                         total_size += file_metadata['file_size_bytes']
                     except Exception as e:
                         logger.error(f"❌ Failed to backup {file_path}: {str(e)}")
             
+            with timer.stage('upload_wait'):
+                bundle_index = packer.close()
+            with timer.stage('manifest'):
+                files_manifest_name = files_manifest.close()
+            
             total_time = time.time() - start_time
             
             summary = {
                 'backup_prefix': backup_prefix,
                 'backup_type': 'directory_individual',
                 'directory': directory_path,
-                'files_backed_up': len(backed_up_files),
+                'files_backed_up': files_manifest.count,
                 'total_size_mb': round(total_size / (1024 * 1024), 2),
                 'total_time_seconds': round(total_time, 2),
+                'timings': timer.breakdown(),
                 'timestamp': datetime.now().isoformat(),
                 'status': 'success',
-                'files': backed_up_files
+                'bundles': len(packer.bundles),
+                'bundle_index': bundle_index,
+                'files_manifest': files_manifest_name
             }
+            summary['manifest'] = self._record_run(backup_prefix, dict(summary), None, run_row.rows())
         
         logger.info(f"✅ Directory backup completed in {summary['total_time_seconds']} seconds")
         
@@ -203,20 +391,13 @@ class BackupSystem:
         backups = []
         
         try:
-            for blob in self.container_client.list_blobs():
-                # Skip metadata files
-                if blob.name.endswith('.metadata.json'):
-                    continue
-                
-                backup_info = {
-                    'name': blob.name,
-                    'size_bytes': blob.size,
-                    'size_mb': round(blob.size / (1024 * 1024), 2),
-                    'created': blob.creation_time.isoformat() if blob.creation_time else None,
-                    'last_modified': blob.last_modified.isoformat() if blob.last_modified else None,
-                    'url': f"https://{self.blob_service_client.account_name}.blob.core.windows.net/{self.container_name}/{blob.name}"
-                }
-                backups.append(backup_info)
+            # One GET of the container index; list the container if there is none yet
+            entries, _ = self.index.load()
+            if entries is None:
+                entries = self.index.entries_from_listing()
+            
+            for entry in entries:
+                backups.append(backup_info(entry, self.blob_service_client.account_name, self.container_name))
             
             logger.info(f"📋 Found {len(backups)} backups")
             return backups
@@ -224,10 +405,14 @@ class BackupSystem:
             logger.error(f"❌ Failed to list backups: {str(e)}")
             raise
     
+    @profiled(_save_profile)
     def restore_file(self, backup_name, restore_path):
         """
         Restore a file from Azure Storage
         
+        An archived backup raises RehydrationPendingError once its
+        rehydration is started and the restore is queued.
+        
         Args:
             backup_name: Name of backup in Azure
             restore_path: Local path to restore to
@@ -239,15 +424,49 @@ class BackupSystem:
         
         logger.info(f"🔄 Restoring: {backup_name} -> {restore_path}")
         
+        timer = StageTimer()
         blob_client = self.container_client.get_blob_client(backup_name)
+        with timer.stage('properties'):
+            properties = blob_client.get_blob_properties()
+        
+        # Archived backups can't be read until rehydrated, queue the restore
+        if properties.blob_tier == 'Archive' or properties.archive_status:
+            raise RehydrationPendingError(self.tiering.queue_restore(backup_name, restore_path, properties))
+        
+        encrypted = is_encrypted(properties)
+        if encrypted and not self.keyring:
+            raise ValueError(f"Backup {backup_name} is encrypted but no encryption keys are configured")
         
         # Create directory if needed
         os.makedirs(os.path.dirname(restore_path) or '.', exist_ok=True)
         
-        # Download from Azure
-        with open(restore_path, 'wb') as file:
-            data = blob_client.download_blob()
-            file.write(data.readall())
+        cache_hit = False
+        with timer.stage('download'):
+            if self.restore_cache:
+                # Serve repeat restores of the same blob version from local disk
+                etag = properties.etag
+                cache_key = RestoreCache.key(backup_name, etag)
+                # Encrypted blobs are cached as ciphertext and decrypted on the way out
+                copy = (lambda src, dst: decrypt_file(src, dst, self.keyring)) if encrypted else shutil.copyfile
+                cache_hit = self.restore_cache.fetch(cache_key, restore_path, copy)
+                if not cache_hit:
+                    self.restore_cache.populate(
+                        cache_key,
+                        lambda tmp: blob_client.download_blob(etag=etag, match_condition=MatchConditions.IfNotModified).readinto(tmp),
+                        restore_path,
+                        copy
+                    )
+            elif encrypted:
+                # Ranged parallel download, each chunk decrypted into place
+                download_decrypted(
+                    blob_client, restore_path, self.keyring, max_concurrency=self.max_concurrency,
+                    etag=properties.etag, match_condition=MatchConditions.IfNotModified
+                )
+            else:
+                # Download from Azure
+                with open(restore_path, 'wb') as file:
+                    data = blob_client.download_blob()
+                    file.write(data.readall())
         
         restore_time = time.time() - start_time
         file_size = os.path.getsize(restore_path)
@@ -257,6 +476,9 @@ class BackupSystem:
             'restored_to': restore_path,
             'file_size_mb': round(file_size / (1024 * 1024), 2),
             'restore_time_seconds': round(restore_time, 2),
+            'cache_hit': cache_hit,
+            'encrypted': encrypted,
+            'timings': timer.breakdown(),
             'timestamp': datetime.now().isoformat(),
             'status': 'success'
         }
@@ -265,19 +487,141 @@ class BackupSystem:
         
         return metadata
     
+    @profiled(_save_profile)
+    def restore_directory(self, backup_name, restore_dir):
+        """
+        Restore a directory_zip backup into a directory
+        
+        Members are extracted while later parts of the archive are still
+        downloading, without a local copy of the zip. An archived backup
+        raises RehydrationPendingError, like restore_file.
+        
+        Args:
+            backup_name: Name of the zip backup in Azure
+            restore_dir: Local directory to extract into
+            
+        Returns:
+            dict: Restore metadata with timing
+        """
+        start_time = time.time()
+        
+        logger.info(f"🔄 Restoring: {backup_name} -> {restore_dir}/")
+        
+        timer = StageTimer()
+        blob_client = self.container_client.get_blob_client(backup_name)
+        with timer.stage('properties'):
+            properties = blob_client.get_blob_properties()
+        
+        if properties.blob_tier == 'Archive' or properties.archive_status:
+            raise RehydrationPendingError(self.tiering.queue_restore(backup_name, restore_dir, properties, kind='directory'))
+        
+        encrypted = is_encrypted(properties)
+        if encrypted and not self.keyring:
+            raise ValueError(f"Backup {backup_name} is encrypted but no encryption keys are configured")
+        
+        download_kwargs = {'etag': properties.etag, 'match_condition': MatchConditions.IfNotModified}
+        with timer.stage('central_directory'):
+            cipher = read_header(blob_client, self.keyring, **download_kwargs) if encrypted else None
+            reader = BlobRangeReader(
+                blob_client, cipher.plaintext_size if cipher else properties.size,
+                keyring=self.keyring, cipher=cipher, **download_kwargs
+            )
+            zipf = zipfile.ZipFile(reader)
+        
+        # Download and inflate overlap, so their stage times add up to more than the wall time
+        files_restored, bytes_restored = extract_ranges(
+            reader, zipf, restore_dir, timer, max_concurrency=self.max_concurrency
+        )
+        
+        restore_time = time.time() - start_time
+        
+        metadata = {
+            'backup_name': backup_name,
+            'restored_to': restore_dir,
+            'files_restored': files_restored,
+            'total_size_mb': round(bytes_restored / (1024 * 1024), 2),
+            'restore_time_seconds': round(restore_time, 2),
+            'encrypted': encrypted,
+            'timings': timer.breakdown(),
+            'timestamp': datetime.now().isoformat(),
+            'status': 'success'
+        }
+        
+        logger.info(f"✅ Restored {files_restored} files in {restore_time:.2f} seconds")
+        
+        return metadata
+    
+    def restore_bundled_file(self, backup_prefix, relative_path, restore_path):
+        """
+        Restore one file packed into a bundle by a directory backup
+        
+        Only the file's byte range is downloaded from the bundle. An archived
+        bundle raises RehydrationPendingError, like restore_file.
+        
+        Args:
+            backup_prefix: Prefix of the directory backup
+            relative_path: Path of the file relative to the backed up directory
+            restore_path: Local path to restore to
+            
+        Returns:
+            dict: Restore metadata with timing
+        """
+        start_time = time.time()
+        
+        logger.info(f"🔄 Restoring: {backup_prefix}/{relative_path} -> {restore_path}")
+        
+        entry = find_bundle_entry(self.container_client, backup_prefix, relative_path)
+        if entry is None:
+            raise FileNotFoundError(f"{relative_path} is not in the bundles of {backup_prefix}")
+        
+        blob_client = self.container_client.get_blob_client(entry['bundle'])
+        properties = blob_client.get_blob_properties()
+        if properties.blob_tier == 'Archive' or properties.archive_status:
+            raise RehydrationPendingError(self.tiering.queue_restore(
+                entry['bundle'], restore_path, properties, kind='bundled_file',
+                backup_prefix=backup_prefix, relative_path=relative_path
+            ))
+        
+        download_kwargs = {'etag': properties.etag, 'match_condition': MatchConditions.IfNotModified}
+        if is_encrypted(properties):
+            if not self.keyring:
+                raise ValueError(f"Bundle {entry['bundle']} is encrypted but no encryption keys are configured")
+            data = read_range(blob_client, self.keyring, entry['offset'], entry['length'], **download_kwargs)
+        elif entry['length']:
+            data = blob_client.download_blob(offset=entry['offset'], length=entry['length'], **download_kwargs).readall()
+        else:
+            data = b""
+        write_bundled_file(data, entry, restore_path)
+        
+        restore_time = time.time() - start_time
+        
+        logger.info(f"✅ Restore completed in {restore_time:.2f} seconds")
+        
+        return {
+            'backup_name': f"{backup_prefix}/{relative_path}",
+            'bundle': entry['bundle'],
+            'restored_to': restore_path,
+            'file_size_mb': round(entry['length'] / (1024 * 1024), 2),
+            'restore_time_seconds': round(restore_time, 2),
+            'timestamp': datetime.now().isoformat(),
+            'status': 'success'
+        }
+    
     def delete_backup(self, backup_name):
         """Delete a backup from Azure Storage"""
         try:
             blob_client = self.container_client.get_blob_client(backup_name)
             blob_client.delete_blob()
             
-            # Also delete metadata if exists
-            metadata_name = f"{backup_name}.metadata.json"
-            try:
-                metadata_blob = self.container_client.get_blob_client(metadata_name)
-                metadata_blob.delete_blob()
-            except:
-                pass
+            # Also delete the file backup's manifest and any legacy metadata sidecar
+            for metadata_name in (manifest_name(backup_name), f"{backup_name}.metadata.json"):
+                try:
+                    metadata_blob = self.container_client.get_blob_client(metadata_name)
+                    metadata_blob.delete_blob()
+                except:
+                    pass
+            
+            self.index.update(removed=[backup_name])
             
             logger.info(f"🗑️  Deleted backup: {backup_name}")
             return {
@@ -291,21 +635,61 @@ class BackupSystem:
     
     def get_storage_stats(self):
         """Get storage usage statistics"""
-        backups = self.list_backups()
+        return storage_stats(self.list_backups())
+    
+    def _prewarm_cache(self):
+        """Download the newest backups into the restore cache in the background"""
+        # One pre-warm pass at a time; later uploads are covered by the running one
+        if not self._prewarm_lock.acquire(blocking=False):
+            return
         
-        total_size = sum(b['size_bytes'] for b in backups)
-        total_size_mb = total_size / (1024 * 1024)
-        total_size_gb = total_size / (1024 * 1024 * 1024)
+        def prewarm_thread():
+            try:
+                blobs = [b for b in self.container_client.list_blobs() if not is_internal_blob(b.name)]
+                blobs.sort(key=lambda b: b.last_modified, reverse=True)
+                for blob in blobs[:self.prewarm_count]:
+                    cache_key = RestoreCache.key(blob.name, blob.etag)
+                    if self.restore_cache.contains(cache_key):
+                        continue
+                    blob_client = self.container_client.get_blob_client(blob.name)
+                    self.restore_cache.populate(
+                        cache_key,
+                        lambda tmp: blob_client.download_blob(etag=blob.etag, match_condition=MatchConditions.IfNotModified).readinto(tmp)
+                    )
+                    logger.info(f"🔥 Pre-warmed restore cache: {blob.name}")
+            except Exception as e:
+                logger.warning(f"⚠️  Restore cache pre-warm failed: {str(e)}")
+            finally:
+                self._prewarm_lock.release()
+        
+        threading.Thread(target=prewarm_thread, daemon=True).start()
+    
+    def _upload_file(self, blob_client, file_path, tee=None):
+        """
+        Upload a local file, encrypted when a keyring is configured
         
-        return {
-            'total_backups': len(backups),
-            'total_size_bytes': total_size,
-            'total_size_mb': round(total_size_mb, 2),
-            'total_size_gb': round(total_size_gb, 2),
-            'oldest_backup': min((b['created'] for b in backups if b['created']), default=None),
-            'newest_backup': max((b['created'] for b in backups if b['created']), default=None),
-            'timestamp': datetime.now().isoformat()
-        }
+        The uploaded bytes are also copied into tee (a CacheTee) when given.
+        
+        Returns:
+            tuple: (upload result, ChunkCipher or None)
+        """
+        if self.keyring:
+            # Chunks are encrypted independently, so blocks upload in parallel
+            return upload_encrypted(blob_client, file_path, self.keyring, max_concurrency=self.max_concurrency, tee=tee)
+        with open(file_path, 'rb') as data:
+            return blob_client.upload_blob(tee.reader(data) if tee else data, overwrite=True), None
+    
+    def _upload_and_cache(self, blob_client, backup_name, file_path):
+        """
+        Upload a local file and add the bytes that were sent to the restore cache
+        
+        Copying the file after the upload could cache content the blob
+        doesn't have, if the file changed in between.
+        """
+        with self.restore_cache.tee() as tee:
+            upload_result, cipher = self._upload_file(blob_client, file_path, tee)
+            tee.key = RestoreCache.key(backup_name, upload_result.get('etag'))
+        return upload_result, cipher
     
     def _calculate_hash(self, file_path):
         """Calculate SHA256 hash of file for integrity verification"""
@@ -315,13 +699,117 @@ class BackupSystem:
                 sha256_hash.update(byte_block)
         return sha256_hash.hexdigest()
     
-    def _save_metadata(self, backup_name, metadata):
-        """Save backup metadata to Azure Storage"""
-        try:
-            metadata_name = f"{backup_name}.metadata.json"
-            blob_client = self.container_client.get_blob_client(metadata_name)
+    def get_manifest(self, run_name):
+        """
+        Fetch the manifest of a backup run
+        
+        Args:
+            run_name: Backup name of a file or zip backup, or prefix of an individual-files backup
             
-            metadata_json = json.dumps(metadata, indent=2)
-            blob_client.upload_blob(metadata_json, overwrite=True)
+        Returns:
+            tuple: (run summary, list of per-file metadata)
+        """
+        blob_client = self.container_client.get_blob_client(manifest_name(run_name))
+        run, files = decode_manifest(blob_client.download_blob().readall())
+        if files is None:
+            files = list(self._iter_files_manifest(run))
+        return run, files
+    
+    def iter_manifest_files(self, run_name):
+        """
+        Yield the per-file metadata of a backup run
+        
+        Entries of individual-files backups stream from their NDJSON file
+        manifest, so memory use doesn't grow with the number of files.
+        """
+        blob_client = self.container_client.get_blob_client(manifest_name(run_name))
+        run, files = decode_manifest(blob_client.download_blob().readall())
+        yield from files if files is not None else self._iter_files_manifest(run)
+    
+    def _iter_files_manifest(self, run):
+        return iter_files_manifest(self.container_client.get_blob_client(run['files_manifest']))
+    
+    def file_index(self, run_name):
+        """
+        Compact index of a backup run's files, keyed by their original paths
+        
+        Indexes of two runs compare with FileIndex.diff, without holding
+        either run's file entries as dicts.
+        
+        Args:
+            run_name: Backup name of a file or zip backup, or prefix of an individual-files backup
+            
+        Returns:
+            FileIndex: Sizes, mtimes and hash prefixes (SHA-256 for files, CRC-32 for zip members)
+        """
+        entries = self.iter_manifest_files(run_name)
+        first = next(entries, None)
+        if first is None:
+            return FileIndexBuilder().build()
+        
+        hash_kind = 'crc32' if 'member' in first else 'sha256'
+        builder = FileIndexBuilder(hash_kind)
+        for entry in itertools.chain([first], entries):
+            builder.add(
+                entry['original_file'].replace(os.sep, '/'),
+                entry['file_size_bytes'],
+                entry.get('mtime') or 0.0,
+                entry.get('crc32') if 'member' in entry else entry.get('file_hash')
+            )
+        return builder.build()
+    
+    def _index_row(self, backup_name, upload_result, size_bytes, backup_type=None):
+        """Container index entry for a blob that was just uploaded"""
+        last_modified = upload_result.get('last_modified')
+        last_modified = last_modified.isoformat() if last_modified else datetime.now().isoformat()
+        return {
+            'name': backup_name,
+            'size_bytes': size_bytes,
+            'created': last_modified,
+            'last_modified': last_modified,
+            'tier': None,
+            'backup_type': backup_type
+        }
+    
+    def _record_run(self, run_name, run, files, index_rows):
+        """
+        Save one manifest for a backup run and add its blobs to the container index
+        
+        files is None when the run streamed its entries to run['files_manifest'].
+        
+        Returns:
+            str: Blob name of the manifest
+        """
+        name = manifest_name(run_name)
+        try:
+            blob_client = self.container_client.get_blob_client(name)
+            blob_client.upload_blob(encode_manifest(run, files), overwrite=True)
+            for index_row in index_rows:
+                index_row['manifest'] = name
         except Exception as e:
             logger.warning(f"⚠️  Failed to save metadata: {str(e)}")
+        
+        try:
+            self.index.update(added=index_rows)
+        except Exception as e:
+            # A stale index would hide this run, so drop it and let listings take over
+            logger.warning(f"⚠️  Failed to update the backup index, dropping it: {str(e)}")
+            try:
+                self.index.invalidate()
+            except Exception as e:
+                logger.warning(f"⚠️  Failed to drop the backup index, rebuild it with 'python manifest.py rebuild': {str(e)}")
+        
+        if self.version_index_path:
+            self._add_to_version_index(name, run, files if files is not None else self._iter_files_manifest(run))
+        return name
+    
+    def _add_to_version_index(self, manifest, run, files):
+        """Record a run's file versions in the local version index (best effort)"""
+        try:
+            version_index = VersionIndex(self.version_index_path)
+            try:
+                version_index.add_cloud_run(manifest, run, files)
+            finally:
+                version_index.close()
+        except Exception as e:
+            logger.warning(f"⚠️  Failed to update version index: {str(e)}")
@@ -0,0 +1,355 @@
+"""
+Batched backup of many files and directories as one run
+A batch takes a list of paths, each with its own options, and feeds all of
+them through one pool of uploads, so a host with dozens of paths to back
+up costs one client, one manifest and one container index update instead
+of one of each per path. Paths that are already covered by a directory in
+the same batch, or listed twice, are skipped. Small files of directories
+backed up without zip share the batch's bundles.
+
+Blobs are named under the batch name: <batch>/<name> for files,
+<batch>/<name>.zip for zipped directories and <batch>/<name>/<relative
+path> for directories backed up file by file, where name defaults to the
+path's last component. Names may not be empty, start with '_' (internal
+blobs such as manifests and the index live under such names) or contain
+'..', '/' or '\\', and a batch name can't be reused.
+
+With allowed roots (BACKUP_BATCH_ALLOWED_ROOTS for the API) every path
+must be inside one of them.
+
+Usage:
+    python batch_backup.py /etc/nginx /var/www /home/app/.env
+    python batch_backup.py --items items.json --name nightly --concurrency 16
+
+items.json holds a list of paths or of objects like
+    {"path": "/var/www", "name": "www", "create_zip": false}
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from datetime import datetime
+
+from profiling import StageTimer
+from backup_system import BackupSystem, zip_directory
+from bundles import BundlePacker
+from manifest import ManifestWriter, RunIndexRow, manifest_name
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Uploads and zip jobs in flight across all items of a batch
+BATCH_CONCURRENCY = int(os.getenv('BACKUP_BATCH_CONCURRENCY', '8'))
+
+# Files queued per worker before the tree walk waits for uploads to finish
+QUEUED_PER_WORKER = 4
+
+# Directories that batches requested over the API may back up (os.pathsep-separated)
+BATCH_ALLOWED_ROOTS = [root for root in os.getenv('BACKUP_BATCH_ALLOWED_ROOTS', '').split(os.pathsep) if root]
+
+
+def check_name(name, what):
+    """Reject names that would step outside the batch or onto internal blobs"""
+    if not name or name.startswith('_') or '..' in name or '/' in name or '\\' in name:
+        raise ValueError(f"Invalid {what} {name!r}: must be non-empty, not start with '_' and not contain '..', '/' or '\\'")
+
+
+def is_under_roots(path, roots):
+    """Whether path, symlinks resolved, is one of roots or inside one"""
+    real_path = os.path.realpath(path)
+    for root in roots:
+        real_root = os.path.realpath(root)
+        if os.path.commonpath([real_path, real_root]) == real_root:
+            return True
+    return False
+
+
+def plan_batch(items, batch_name, allowed_roots=None):
+    """
+    Normalize batch items, skip overlapping ones and name the rest
+
+    An item is skipped when the same path is listed earlier or a directory
+    in the batch contains it. Paths are compared after resolving symlinks.
+    Invalid names and paths outside allowed_roots raise ValueError.
+
+    Args:
+        items: Paths, or dicts with 'path' and optional 'name' and 'create_zip'
+        batch_name: Prefix of the batch's blobs
+        allowed_roots: Directories every path must be inside (optional)
+
+    Returns:
+        list: One result dict per item, with status 'pending', 'skipped' or 'failed'
+    """
+    plan = []
+    for item in items:
+        if isinstance(item, str):
+            item = {'path': item}
+        path = os.path.abspath(os.path.expanduser(item['path']))
+        if allowed_roots is not None and not is_under_roots(path, allowed_roots):
+            raise ValueError(f"Path is outside the allowed backup roots: {path}")
+        if item.get('name') is not None:
+            check_name(item['name'], 'item name')
+        entry = {'path': path, 'name': item.get('name'), 'kind': None, 'status': 'pending'}
+        if os.path.isdir(path):
+            entry.update(kind='directory', create_zip=bool(item.get('create_zip', True)))
+        elif os.path.isfile(path):
+            entry['kind'] = 'file'
+        else:
+            entry.update(status='failed', error=f"Path not found: {path}")
+        plan.append(entry)
+
+    seen = {}
+    for entry in plan:
+        if entry['status'] != 'pending':
+            continue
+        real_path = os.path.realpath(entry['path'])
+        if real_path in seen:
+            entry.update(status='skipped', reason='duplicate', covered_by=seen[real_path]['path'])
+        else:
+            seen[real_path] = entry
+
+    directories = {real_path: e for real_path, e in seen.items() if e['kind'] == 'directory'}
+    for real_path, entry in seen.items():
+        # Report the outermost directory, which is the one that actually backs the path up
+        covered_by = None
+        child, parent = real_path, os.path.dirname(real_path)
+        while parent != child:
+            if parent in directories:
+                covered_by = directories[parent]
+            child, parent = parent, os.path.dirname(parent)
+        if covered_by is not None:
+            entry.update(status='skipped', reason='covered', covered_by=covered_by['path'])
+
+    targets = set()
+    for entry in plan:
+        if entry['status'] != 'pending':
+            continue
+        name = entry['name'] or os.path.basename(os.path.normpath(entry['path'])) or 'root'
+        check_name(name, 'item name')
+        zipped = entry['kind'] == 'directory' and entry['create_zip']
+        suffix = '.zip' if zipped else ''
+        target, n = f"{batch_name}/{name}{suffix}", 1
+        while target in targets:
+            n += 1
+            target = f"{batch_name}/{name}-{n}{suffix}"
+        targets.add(target)
+        entry['name'] = target[len(batch_name) + 1:len(target) - len(suffix)]
+        entry['backup_prefix' if entry['kind'] == 'directory' and not zipped else 'backup_name'] = target
+        entry.update(files_backed_up=0, files_failed=0, size_bytes=0)
+    return plan
+
+
+class BatchBackup:
+    """Backs up a list of files and directories through one shared pool of uploads"""
+
+    def __init__(self, backup_system, batch_name=None, max_concurrency=None, allowed_roots=None):
+        if batch_name is not None:
+            check_name(batch_name, 'batch name')
+        self.backup_system = backup_system
+        self.batch_name = batch_name or f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.max_concurrency = max_concurrency or BATCH_CONCURRENCY
+        self.allowed_roots = allowed_roots
+
+    def run(self, items):
+        """
+        Back up every item of the batch and record the batch as one run
+
+        A failing item doesn't stop the others; its error is in its result.
+        Invalid names, disallowed paths and a batch name that already has a
+        manifest raise ValueError before anything is uploaded.
+
+        Args:
+            items: Paths, or dicts with 'path' and optional 'name' and 'create_zip'
+
+        Returns:
+            dict: Batch summary with a result per item
+        """
+        if not items:
+            raise ValueError("No paths to back up")
+
+        start_time = time.time()
+        plan = plan_batch(items, self.batch_name, self.allowed_roots)
+        if self.backup_system.container_client.get_blob_client(manifest_name(self.batch_name)).exists():
+            raise ValueError(f"A backup named {self.batch_name} already exists")
+        pending = [item for item in plan if item['status'] == 'pending']
+        logger.info(f"📚 Starting batch backup {self.batch_name}: {len(pending)} of {len(plan)} items to back up")
+
+        self._timer = StageTimer()
+        self._files_manifest = ManifestWriter(self.backup_system.container_client, self.batch_name)
+        self._run_row = RunIndexRow(self.batch_name, 'batch')
+        self._in_flight = {}
+        packer = BundlePacker(self.backup_system, self.batch_name, self._run_row, timer=self._timer)
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            self._pool = pool
+            for item in pending:
+                try:
+                    if item['kind'] == 'file':
+                        self._submit(item, self._backup_file, item['path'], item['backup_name'])
+                    elif item['create_zip']:
+                        self._submit(item, self._backup_zip, item['path'], item['backup_name'])
+                    else:
+                        self._walk(item, packer)
+                except Exception as e:
+                    self._fail(item, e)
+            self._collect(ALL_COMPLETED)
+
+        with self._timer.stage('upload_wait'):
+            bundle_index = packer.close()
+        with self._timer.stage('manifest'):
+            files_manifest_name = self._files_manifest.close()
+
+        for item in pending:
+            if item['status'] == 'pending':
+                item['status'] = 'failed' if item['files_failed'] else 'success'
+
+        counts = {status: sum(item['status'] == status for item in plan) for status in ('success', 'failed', 'skipped')}
+        if not counts['failed']:
+            status = 'success'
+        elif counts['success']:
+            status = 'partial'
+        else:
+            status = 'failed'
+
+        summary = {
+            'backup_prefix': self.batch_name,
+            'backup_type': 'batch',
+            'items': plan,
+            'items_succeeded': counts['success'],
+            'items_failed': counts['failed'],
+            'items_skipped': counts['skipped'],
+            'files_backed_up': self._files_manifest.count,
+            'total_size_mb': round(sum(item.get('size_bytes', 0) for item in plan) / (1024 * 1024), 2),
+            'max_concurrency': self.max_concurrency,
+            'total_time_seconds': round(time.time() - start_time, 2),
+            'timings': self._timer.breakdown(),
+            'timestamp': datetime.now().isoformat(),
+            'status': status,
+            'bundles': len(packer.bundles),
+            'bundle_index': bundle_index,
+            'files_manifest': files_manifest_name
+        }
+        summary['manifest'] = self.backup_system._record_run(self.batch_name, dict(summary), None, self._run_row.rows())
+
+        logger.info(
+            f"✅ Batch backup {self.batch_name} finished in {summary['total_time_seconds']} seconds: "
+            f"{counts['success']} succeeded, {counts['failed']} failed, {counts['skipped']} skipped"
+        )
+        return summary
+
+    def _walk(self, item, packer):
+        """Queue the files of a directory backed up file by file; small ones go into the batch's bundles"""
+        directory_path = item['path']
+        for root, dirs, files in self._timer.iterate('scan', os.walk(directory_path)):
+            for file in files:
+                file_path = os.path.join(root, file)
+                relative_path = os.path.relpath(file_path, directory_path)
+                backup_name = f"{item['backup_prefix']}/{relative_path}"
+                try:
+                    if packer.should_pack(os.path.getsize(file_path)):
+                        with self._timer.stage('pack'):
+                            entry = packer.add(f"{item['name']}/{relative_path}", file_path)
+                        self._record(item, [{
+                            'backup_name': backup_name,
+                            'original_file': file_path,
+                            'file_size_bytes': entry['length'],
+                            'file_hash': entry['sha256'],
+                            'mtime': os.path.getmtime(file_path),
+                            'bundle': entry['bundle'],
+                            'bundle_offset': entry['offset']
+                        }], [])
+                    else:
+                        self._submit(item, self._backup_file, file_path, backup_name)
+                except Exception as e:
+                    item['files_failed'] += 1
+                    item.setdefault('error', str(e))
+                    logger.error(f"❌ Failed to backup {file_path}: {str(e)}")
+
+    def _backup_file(self, file_path, backup_name):
+        metadata, index_row = self.backup_system._backup_file(file_path, backup_name, self._timer)
+        return [metadata], [index_row]
+
+    def _backup_zip(self, directory_path, backup_name):
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp:
+            zip_path = tmp.name
+        try:
+            members = zip_directory(directory_path, zip_path, self._timer)
+            metadata, index_row = self.backup_system._backup_file(zip_path, backup_name, self._timer)
+        finally:
+            os.unlink(zip_path)
+        # Members name their archive the way shards of a distributed backup do
+        for member in members:
+            member['shard'] = backup_name
+        return members, [index_row]
+
+    def _submit(self, item, fn, *args):
+        """Queue work on the shared pool, first collecting results if too much is queued"""
+        if len(self._in_flight) >= self.max_concurrency * QUEUED_PER_WORKER:
+            self._collect(FIRST_COMPLETED)
+        self._in_flight[self._pool.submit(fn, *args)] = item
+
+    def _collect(self, return_when):
+        """Record finished work; entries are only written from the calling thread"""
+        with self._timer.stage('upload_wait'):
+            done, _ = wait(list(self._in_flight), return_when=return_when)
+        for future in done:
+            item = self._in_flight.pop(future)
+            try:
+                entries, index_rows = future.result()
+            except Exception as e:
+                if item['kind'] == 'directory' and not item['create_zip']:
+                    item['files_failed'] += 1
+                    item.setdefault('error', str(e))
+                    logger.error(f"❌ Failed to backup a file of {item['path']}: {str(e)}")
+                else:
+                    self._fail(item, e)
+                continue
+            self._record(item, entries, index_rows)
+
+    def _record(self, item, entries, index_rows):
+        with self._timer.stage('manifest'):
+            for entry in entries:
+                self._files_manifest.add(entry)
+        item['files_backed_up'] += len(entries)
+        item['size_bytes'] += sum(entry['file_size_bytes'] for entry in entries)
+        for index_row in index_rows:
+            self._run_row.add(index_row)
+
+    def _fail(self, item, error):
+        item.update(status='failed', error=str(error))
+        logger.error(f"❌ Failed to backup {item['path']}: {str(error)}")
+
+
+def _load_items(path):
+    with (sys.stdin if path == '-' else open(path, 'r')) as f:
+        items = json.load(f)
+    if not isinstance(items, list):
+        raise ValueError("The items file must hold a JSON list")
+    return items
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Back up many files and directories as one batch")
+    parser.add_argument('paths', nargs='*', help="Files and directories to back up")
+    parser.add_argument('--items', help="JSON file with a list of paths or item objects ('-' for stdin)")
+    parser.add_argument('--name', help="Batch name (default: batch_<timestamp>)")
+    parser.add_argument('--concurrency', type=int, default=None, help="Uploads in flight across all items")
+    parser.add_argument('--no-zip', action='store_true', help="Back up directory paths file by file")
+    args = parser.parse_args()
+
+    items = [{'path': path, 'create_zip': not args.no_zip} for path in args.paths]
+    if args.items:
+        items += _load_items(args.items)
+    if not items:
+        parser.error("no paths given")
+
+    result = BatchBackup(BackupSystem(), args.name, args.concurrency).run(items)
+    print(json.dumps(result, indent=2, default=str))
+    sys.exit(0 if result['status'] == 'success' else 1)
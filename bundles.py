@@ -0,0 +1,201 @@
+"""
+Small-file packing for directory backups
+Small files are concatenated into bundle blobs of tens of MB, with an index
+mapping each relative path to (bundle, offset, length, sha256), so a tree of
+many tiny files costs a handful of PUTs instead of two per file.
+
+The index is gzip'd NDJSON streamed block by block like a run's file
+manifest: a header line, then one line per packed file.
+"""
+import os
+import hashlib
+import logging
+import tempfile
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from manifest import FilesEncoder, iter_files_manifest
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "_bundles/index.ndjson.gz"
+INDEX_VERSION = 1
+
+
+def bundle_index_name(backup_prefix):
+    return f"{backup_prefix}/{INDEX_NAME}"
+
+
+class BundlePacker:
+    """Packs files into bundle blobs while a directory backup walks the tree
+
+    A finished bundle uploads in the background while the next one fills,
+    with at most two uploads in flight.
+    """
+
+    def __init__(self, backup_system, backup_prefix, run_row, target_bytes=None, small_file_max_bytes=None, timer=None):
+        self.backup_system = backup_system
+        self.run_row = run_row
+        self.timer = timer
+        self.backup_prefix = backup_prefix
+        self.target_bytes = target_bytes or int(os.getenv('BUNDLE_TARGET_MB', '32')) * 1024 * 1024
+        self.small_file_max_bytes = small_file_max_bytes or int(os.getenv('BUNDLE_SMALL_FILE_KB', '1024')) * 1024
+
+        self.bundles = []
+        self._current = None
+        self._current_size = 0
+        self._uploads = []
+        self._pool = ThreadPoolExecutor(max_workers=2)
+
+        self.index_name = bundle_index_name(backup_prefix)
+        self._index_blob = backup_system.container_client.get_blob_client(self.index_name)
+        self._index = FilesEncoder()
+        self._index_size = 0
+        self._add_to_index({'version': INDEX_VERSION, 'backup_prefix': backup_prefix})
+
+    @property
+    def count(self):
+        """Files packed so far"""
+        return self._index.count - 1
+
+    def should_pack(self, file_size):
+        return file_size <= self.small_file_max_bytes
+
+    def add(self, relative_path, file_path):
+        """
+        Append a file to the current bundle
+
+        Returns:
+            dict: Index entry for the file
+        """
+        if self._current is None:
+            self._start_bundle()
+
+        sha256_hash = hashlib.sha256()
+        offset = self._current_size
+        with open(file_path, 'rb') as src:
+            for block in iter(lambda: src.read(1024 * 1024), b""):
+                sha256_hash.update(block)
+                self._current.write(block)
+                self._current_size += len(block)
+
+        entry = {
+            'bundle': self.bundles[-1],
+            'offset': offset,
+            'length': self._current_size - offset,
+            'sha256': sha256_hash.hexdigest(),
+        }
+        self._add_to_index(dict(entry, path=relative_path.replace(os.sep, '/')))
+
+        if self._current_size >= self.target_bytes:
+            self._finish_bundle()
+        return entry
+
+    def close(self):
+        """
+        Upload the last bundle and the index
+
+        Returns:
+            str: Blob name of the index
+        """
+        try:
+            if self._current is not None:
+                self._finish_bundle()
+            for future in self._uploads:
+                future.result()
+        finally:
+            self._pool.shutdown(wait=True)
+
+        block_id, data = self._index.finish()
+        self._index_blob.stage_block(block_id, data)
+        self._index_size += len(data)
+        result = self._index_blob.commit_block_list(self._index.block_ids)
+        self.run_row.add(self.backup_system._index_row(self.index_name, result, self._index_size))
+
+        logger.info(f"📦 Packed {self.count} small files into {len(self.bundles)} bundles")
+        return self.index_name
+
+    def _add_to_index(self, line):
+        """Only one block of the compressed index is held; full ones are staged right away"""
+        block = self._index.add(line)
+        if block:
+            self._index_blob.stage_block(*block)
+            self._index_size += len(block[1])
+
+    def _start_bundle(self):
+        self.bundles.append(f"{self.backup_prefix}/_bundles/bundle-{len(self.bundles):05d}.bin")
+        self._current = tempfile.NamedTemporaryFile(delete=False, suffix='.bundle')
+        self._current_size = 0
+
+    def _finish_bundle(self):
+        tmp, name = self._current, self.bundles[-1]
+        tmp.close()
+        self._current = None
+
+        # Bound temp disk usage: wait for the oldest upload before queueing a third
+        pending = [f for f in self._uploads if not f.done()]
+        if len(pending) >= 2:
+            pending[0].result()
+        self._uploads.append(self._pool.submit(self._upload, tmp.name, name))
+
+    def _upload(self, tmp_path, name):
+        try:
+            blob_client = self.backup_system.container_client.get_blob_client(name)
+            size = os.path.getsize(tmp_path)
+            with self.timer.stage('upload') if self.timer else nullcontext():
+                result, cipher = self.backup_system._upload_file(blob_client, tmp_path)
+            self.run_row.add(self.backup_system._index_row(name, result, cipher.encrypted_size if cipher else size))
+            logger.info(f"⬆️  Uploaded bundle {name}")
+        finally:
+            os.unlink(tmp_path)
+
+
+def iter_bundle_index(container_client, backup_prefix):
+    """
+    Yield the entries of a bundle index while it downloads
+
+    Yields:
+        tuple: (relative path, {'bundle', 'offset', 'length', 'sha256'})
+    """
+    blob_client = container_client.get_blob_client(bundle_index_name(backup_prefix))
+    lines = iter_files_manifest(blob_client)
+    header = next(lines, {})
+    if header.get('version') != INDEX_VERSION:
+        raise ValueError(f"Unsupported bundle index version: {header.get('version')}")
+    for entry in lines:
+        yield entry.pop('path'), entry
+
+
+def find_bundle_entry(container_client, backup_prefix, relative_path):
+    """
+    Look one file up in a bundle index, reading only as far as its entry
+
+    Returns:
+        dict: {'bundle', 'offset', 'length', 'sha256'}, or None if the file wasn't packed
+    """
+    relative_path = relative_path.replace(os.sep, '/')
+    for path, entry in iter_bundle_index(container_client, backup_prefix):
+        if path == relative_path:
+            return entry
+    return None
+
+
+def load_bundle_index(container_client, backup_prefix):
+    """
+    Fetch and decode a bundle index
+
+    Returns:
+        dict: Relative path -> {'bundle', 'offset', 'length', 'sha256'}
+    """
+    return dict(iter_bundle_index(container_client, backup_prefix))
+
+
+def write_bundled_file(data, entry, restore_path):
+    """Write a file read out of a bundle after checking its hash"""
+    if hashlib.sha256(data).hexdigest() != entry['sha256']:
+        raise ValueError(f"Hash mismatch for file in {entry['bundle']} at offset {entry['offset']}")
+    os.makedirs(os.path.dirname(restore_path) or '.', exist_ok=True)
+    tmp_path = f"{restore_path}.partial"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, restore_path)
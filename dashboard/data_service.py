@@ -0,0 +1,111 @@
+"""Background data service for the Tkinter dashboard"""
+import queue
+import itertools
+import threading
+import time
+import traceback
+
+
+class DashboardDataService:
+    """Loads dashboard data and runs backup/restore jobs off the Tk main thread.
+
+    Worker threads never touch widgets. They push events onto a queue that the
+    UI drains from root.after(), and progress updates are coalesced so only the
+    latest value per task is delivered. Task events carry (task id, name), so
+    two tasks of the same kind running at once are told apart.
+    """
+
+    def __init__(self, backup_system, refresh_interval=30, debounce_seconds=0.5):
+        self.backup_system = backup_system
+        self.refresh_interval = refresh_interval
+        self.debounce_seconds = debounce_seconds
+
+        self.events = queue.Queue()
+        self.snapshot = None
+
+        self._refresh_requested = threading.Event()
+        self._stopped = threading.Event()
+        self._progress = {}
+        self._progress_lock = threading.Lock()
+        self._task_ids = itertools.count(1)
+        self._thread = None
+
+    def start(self):
+        """Start the background refresh loop and load the first snapshot"""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.request_refresh()
+
+    def stop(self):
+        """Stop the refresh loop"""
+        self._stopped.set()
+        self._refresh_requested.set()
+
+    def request_refresh(self):
+        """Ask for a new snapshot; bursts of requests are coalesced"""
+        self._refresh_requested.set()
+
+    def run_task(self, name, func, *args, **kwargs):
+        """Run func in a worker thread, reporting progress and result as events.
+
+        func receives a progress_callback keyword argument. Returns the task's
+        id, which its progress is keyed by.
+        """
+        task = (next(self._task_ids), name)
+
+        def task_thread():
+            try:
+                result = func(*args, progress_callback=lambda **info: self.post_progress(task[0], **info), **kwargs)
+                self.events.put(("task_done", task, result))
+            except Exception as e:
+                self.events.put(("task_failed", task, f"{e}\n{traceback.format_exc()}"))
+            finally:
+                with self._progress_lock:
+                    self._progress.pop(task[0], None)
+                self.request_refresh()
+
+        self.events.put(("task_started", task, None))
+        threading.Thread(target=task_thread, daemon=True).start()
+        return task[0]
+
+    def post_progress(self, task_id, **info):
+        """Record the latest progress of a task (called from worker threads)"""
+        with self._progress_lock:
+            self._progress[task_id] = info
+
+    def take_progress(self):
+        """Return and clear the progress updates since the last call"""
+        with self._progress_lock:
+            progress, self._progress = self._progress, {}
+        return progress
+
+    def drain(self, max_events=50):
+        """Return up to max_events pending events without blocking"""
+        drained = []
+        try:
+            while len(drained) < max_events:
+                drained.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return drained
+
+    def _run(self):
+        """Refresh loop: on request (debounced) or every refresh_interval seconds"""
+        while not self._stopped.is_set():
+            requested = self._refresh_requested.wait(timeout=self.refresh_interval)
+            if self._stopped.is_set():
+                break
+            if requested:
+                time.sleep(self.debounce_seconds)
+            self._refresh_requested.clear()
+
+            try:
+                backups = self.backup_system.list_backups()
+                stats = self.backup_system.get_backup_stats(backups)
+                snapshot = {"stats": stats, "backups": backups}
+
+                if snapshot != self.snapshot:
+                    self.snapshot = snapshot
+                    self.events.put(("snapshot", None, snapshot))
+            except Exception as e:
+                self.events.put(("error", None, str(e)))
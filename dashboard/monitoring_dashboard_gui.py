@@ -3,17 +3,38 @@ import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import sys
 from pathlib import Path
-import psutil
 import datetime
-import threading
-import time
 
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent / "app"))
+sys.path.insert(0, str(Path(__file__).parent))
 
 from backup import BackupSystem
 from restore import RestoreSystem
+from drill import DrillRunner
+from data_service import DashboardDataService
+from resource_monitor import ResourceSampler
+
+
+# Backup list columns: heading, width, anchor
+BACKUP_COLUMNS = {
+    "backup_name": ("Backup", 360, "w"),
+    "total_files": ("Files", 80, "e"),
+    "total_size_mb": ("Size (MB)", 100, "e"),
+    "timestamp": ("Timestamp", 180, "w"),
+}
+
+# Resource sparklines: title, host metric, process metric, unit
+SPARKLINES = (
+    ("CPU", "host_cpu", "process_cpu", "%"),
+    ("Disk read", "host_disk_read", "process_disk_read", "MB/s"),
+    ("Disk write", "host_disk_write", "process_disk_write", "MB/s"),
+    ("Net send", "net_sent", None, "MB/s"),
+    ("Net recv", "net_recv", None, "MB/s"),
+)
+SPARKLINE_WIDTH = 120
+SPARKLINE_HEIGHT = 30
 
 
 class DisasterRecoveryDashboard:
@@ -26,9 +47,13 @@ class DisasterRecoveryDashboard:
         # Initialize systems
         self.backup_system = BackupSystem()
         self.restore_system = RestoreSystem()
+        self.drill_runner = DrillRunner(self.backup_system, self.restore_system)
         
-        # Auto-refresh flag
-        self.auto_refresh = True
+        # Background data service, drained by poll_events on the main thread
+        self.data_service = DashboardDataService(self.backup_system)
+        self.resource_sampler = ResourceSampler()
+        # Tasks still running, task id -> name
+        self.running_tasks = {}
         
         # Create UI
         self.create_header()
@@ -36,11 +61,13 @@ class DisasterRecoveryDashboard:
         self.create_actions_section()
         self.create_backups_section()
         
-        # Start auto-refresh
-        self.start_auto_refresh()
+        # Start auto-refresh and initial data load
+        self.data_service.start()
+        self.poll_events()
         
-        # Initial data load
-        self.refresh_data()
+        # Start resource sampling
+        self.resource_sampler.start()
+        self.update_sparklines()
     
     def create_header(self):
         """Create header section"""
@@ -180,7 +207,7 @@ class DisasterRecoveryDashboard:
         ).pack(side="left", padx=(0, 10))
         
         # Test Disaster Button
-        tk.Button(
+        self.drill_btn = tk.Button(
             button_frame,
             text="💥 Test Disaster Recovery",
             font=("Helvetica", 11, "bold"),
@@ -191,142 +218,274 @@ class DisasterRecoveryDashboard:
             relief="flat",
             padx=20,
             pady=10
-        ).pack(side="left")
-    
-    def create_backups_section(self):
-        """Create backups list section"""
-        backups_frame = tk.Frame(self.root, bg="white")
-        backups_frame.pack(fill="both", expand=True, padx=20, pady=(10, 20))
+        )
+        self.drill_btn.pack(side="left")
         
-        tk.Label(
-            backups_frame,
-            text="📦 Recent Backups",
-            font=("Helvetica", 14, "bold"),
-            bg="white",
-            fg="#667eea"
-        ).pack(anchor="w", padx=20, pady=(20, 10))
+        # Progress of the running backup or restore
+        progress_frame = tk.Frame(actions_frame, bg="white")
+        progress_frame.pack(fill="x", padx=20, pady=(10, 0))
         
-        # Scrollable frame for backups
-        canvas = tk.Canvas(backups_frame, bg="white", highlightthickness=0)
-        scrollbar = ttk.Scrollbar(backups_frame, orient="vertical", command=canvas.yview)
-        self.backups_container = tk.Frame(canvas, bg="white")
+        self.progress_bar = ttk.Progressbar(progress_frame, mode="determinate", length=300)
+        self.progress_bar.pack(side="left")
         
-        self.backups_container.bind(
-            "<Configure>",
-            lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
+        self.progress_label = tk.Label(
+            progress_frame,
+            text="Idle",
+            font=("Helvetica", 9),
+            bg="white",
+            fg="#666"
         )
+        self.progress_label.pack(side="left", padx=10)
         
-        canvas.create_window((0, 0), window=self.backups_container, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
+        # Host/process resource usage, to tell disk, CPU and network bound jobs apart
+        resources_frame = tk.Frame(actions_frame, bg="white")
+        resources_frame.pack(fill="x", padx=20, pady=(10, 0))
         
-        canvas.pack(side="left", fill="both", expand=True, padx=20, pady=(0, 20))
-        scrollbar.pack(side="right", fill="y", pady=(0, 20))
-    
-    def refresh_data(self):
-        """Refresh dashboard data"""
-        try:
-            # Get statistics
-            stats = self.backup_system.get_backup_stats()
+        self.sparklines = []
+        for title, host_metric, process_metric, unit in SPARKLINES:
+            cell = tk.Frame(resources_frame, bg="white")
+            cell.pack(side="left", padx=(0, 10))
             
-            # Update stat cards
-            self.total_backups_label.config(text=str(stats.get('total_backups', 0)))
-            self.storage_used_label.config(text=f"{stats.get('total_size_mb', 0):.2f}")
-            self.last_backup_label.config(
-                text=stats.get('latest_backup', 'No backups yet')[:20],
-                font=("Helvetica", 12, "bold")
+            canvas = tk.Canvas(
+                cell,
+                width=SPARKLINE_WIDTH,
+                height=SPARKLINE_HEIGHT,
+                bg="#f7fafc",
+                highlightthickness=0
             )
+            canvas.pack()
+            line = canvas.create_line(0, SPARKLINE_HEIGHT, 0, SPARKLINE_HEIGHT, fill="#667eea", width=1.5)
             
-            # Get backups list
-            backups = self.backup_system.list_backups()
-            
-            # Clear previous backups
-            for widget in self.backups_container.winfo_children():
-                widget.destroy()
-            
-            # Display backups
-            if not backups:
-                no_backups = tk.Label(
-                    self.backups_container,
-                    text="No backups found. Click 'Run Backup Now' to create your first backup.",
-                    font=("Helvetica", 10),
-                    bg="#f7fafc",
-                    fg="#666",
-                    pady=20
-                )
-                no_backups.pack(fill="x", pady=5)
-            else:
-                for backup in backups:
-                    self.create_backup_item(backup)
-            
-            self.status_label.config(text="🟢 System Operational", bg="#c6f6d5", fg="#22543d")
+            label = tk.Label(cell, text=title, font=("Helvetica", 8), bg="white", fg="#666")
+            label.pack()
             
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to refresh data: {str(e)}")
-            self.status_label.config(text="🔴 Error Loading Data", bg="#fed7d7", fg="#742a2a")
+            self.sparklines.append((title, host_metric, process_metric, unit, canvas, line, label))
     
-    def create_backup_item(self, backup):
-        """Create a backup item in the list"""
-        item_frame = tk.Frame(self.backups_container, bg="#f7fafc", relief="solid", borderwidth=1)
-        item_frame.pack(fill="x", pady=5, padx=5)
-        
-        # Info section
-        info_frame = tk.Frame(item_frame, bg="#f7fafc")
-        info_frame.pack(side="left", fill="both", expand=True, padx=15, pady=10)
+    def create_backups_section(self):
+        """Create backups list section"""
+        backups_frame = tk.Frame(self.root, bg="white")
+        backups_frame.pack(fill="both", expand=True, padx=20, pady=(10, 20))
         
-        tk.Label(
-            info_frame,
-            text=f"📦 {backup.get('backup_name', 'Unknown')}",
-            font=("Helvetica", 11, "bold"),
-            bg="#f7fafc",
-            fg="#333",
-            anchor="w"
-        ).pack(anchor="w")
+        header_frame = tk.Frame(backups_frame, bg="white")
+        header_frame.pack(fill="x", padx=20, pady=(20, 10))
         
         tk.Label(
-            info_frame,
-            text=f"{backup.get('total_files', 0)} files • {backup.get('total_size_mb', 0):.2f} MB • {backup.get('timestamp', 'Unknown')}",
-            font=("Helvetica", 9),
-            bg="#f7fafc",
-            fg="#666",
-            anchor="w"
-        ).pack(anchor="w")
+            header_frame,
+            text="📦 Recent Backups",
+            font=("Helvetica", 14, "bold"),
+            bg="white",
+            fg="#667eea"
+        ).pack(side="left")
         
-        # Restore button
+        # Restore selected backup
         tk.Button(
-            item_frame,
+            header_frame,
             text="♻️ Restore",
             font=("Helvetica", 10, "bold"),
             bg="#667eea",
             fg="white",
-            command=lambda: self.restore_backup(backup.get('backup_name')),
+            command=self.restore_selected,
             cursor="hand2",
             relief="flat",
             padx=15,
             pady=5
-        ).pack(side="right", padx=15)
+        ).pack(side="right")
+        
+        # Filter entry, applied to the cached backups list
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add("write", lambda *args: self.apply_view())
+        tk.Entry(
+            header_frame,
+            textvariable=self.filter_var,
+            font=("Helvetica", 10),
+            width=30
+        ).pack(side="right", padx=10)
+        
+        tk.Label(
+            header_frame,
+            text="🔍 Filter:",
+            font=("Helvetica", 10),
+            bg="white",
+            fg="#666"
+        ).pack(side="right")
+        
+        # Treeview only renders visible rows, so thousands of backups stay cheap
+        list_frame = tk.Frame(backups_frame, bg="white")
+        list_frame.pack(fill="both", expand=True, padx=20, pady=(0, 20))
+        
+        self.backups_tree = ttk.Treeview(list_frame, columns=list(BACKUP_COLUMNS), show="headings")
+        for column, (heading, width, anchor) in BACKUP_COLUMNS.items():
+            self.backups_tree.heading(column, text=heading, command=lambda c=column: self.sort_by(c))
+            self.backups_tree.column(column, width=width, anchor=anchor)
+        self.backups_tree.bind("<Double-1>", lambda e: self.restore_selected())
+        
+        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.backups_tree.yview)
+        self.backups_tree.configure(yscrollcommand=scrollbar.set)
+        
+        self.backups_tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        
+        # Cached backups keyed by name, and the current view settings
+        self.backup_rows = {}
+        self.sort_column = "timestamp"
+        self.sort_reverse = True
+    
+    def refresh_data(self):
+        """Ask the data service for fresh dashboard data"""
+        self.data_service.request_refresh()
+    
+    def poll_events(self):
+        """Apply queued data service events; runs on the Tk main thread"""
+        for progress in self.data_service.take_progress().values():
+            self.show_progress(progress)
+        
+        for kind, task, payload in self.data_service.drain():
+            if kind == "snapshot":
+                self.apply_snapshot(payload)
+            elif kind == "error":
+                self.status_label.config(text="🔴 Error Loading Data", bg="#fed7d7", fg="#742a2a")
+            elif kind == "task_started":
+                task_id, name = task
+                self.running_tasks[task_id] = name
+                self.progress_bar.config(value=0)
+                self.progress_label.config(text=f"⏳ {name} running...")
+            elif kind in ("task_done", "task_failed"):
+                task_id, name = task
+                self.running_tasks.pop(task_id, None)
+                self.finish_task(name, kind == "task_done", payload)
+        
+        # ~60 polls per second keeps the UI responsive during long jobs
+        self.root.after(16, self.poll_events)
+    
+    def apply_snapshot(self, snapshot):
+        """Update the stat cards and backups list from a data snapshot"""
+        stats = snapshot["stats"]
+        
+        # Update stat cards
+        self.total_backups_label.config(text=str(stats.get('total_backups', 0)))
+        self.storage_used_label.config(text=f"{stats.get('total_size_mb', 0):.2f}")
+        self.last_backup_label.config(
+            text=stats.get('latest_backup', 'No backups yet')[:20],
+            font=("Helvetica", 12, "bold")
+        )
+        
+        self.update_backups(snapshot["backups"])
+        
+        self.status_label.config(text="🟢 System Operational", bg="#c6f6d5", fg="#22543d")
+    
+    def show_progress(self, progress):
+        """Show the latest progress update of a backup or restore"""
+        if "total" in progress:
+            self.progress_bar.config(maximum=max(progress["total"], 1), value=progress["done"])
+            self.progress_label.config(text=f"♻️ {progress['done']} / {progress['total']} files restored")
+        else:
+            self.progress_bar.step(1)
+            self.progress_label.config(
+                text=f"📦 {progress['files']} files • {progress['bytes'] / (1024 * 1024):.2f} MB"
+            )
+    
+    def finish_task(self, name, succeeded, result):
+        """Report the result of a backup or restore task"""
+        self.progress_bar.config(value=0)
+        if self.running_tasks:
+            self.progress_label.config(text=f"⏳ {', '.join(self.running_tasks.values())} running...")
+        else:
+            self.progress_label.config(text="Idle")
+        
+        if name == "drill":
+            self.drill_btn.config(state="normal", text="💥 Test Disaster Recovery")
+            if not succeeded:
+                messagebox.showerror("Drill Failed", f"❌ Drill failed: {result}")
+            elif result["status"] == "passed":
+                messagebox.showinfo("Drill Passed", self.format_drill(result))
+            else:
+                messagebox.showerror("Drill Failed", self.format_drill(result))
+        elif name == "backup":
+            self.backup_btn.config(state="normal", text="▶️ Run Backup Now")
+            success, backup_name = (result[0], result[1]) if succeeded else (False, None)
+            if success:
+                messagebox.showinfo("Success", f"✅ Backup created successfully!\n\n{backup_name}")
+            elif succeeded:
+                messagebox.showerror("Error", "❌ Backup failed!")
+            else:
+                messagebox.showerror("Error", f"❌ Backup failed: {result}")
+        else:
+            # restore_backup returns (success, timings)
+            if succeeded and result[0]:
+                messagebox.showinfo("Success", "✅ Restore completed successfully!")
+            elif succeeded:
+                messagebox.showerror("Error", "❌ Restore failed!")
+            else:
+                messagebox.showerror("Error", f"❌ Restore failed: {result}")
+    
+    def update_backups(self, backups):
+        """Apply the difference between the cached and the new backups list"""
+        rows = {}
+        for backup in backups:
+            name = backup.get('backup_name', 'Unknown')
+            rows[name] = (
+                name,
+                backup.get('total_files', 0),
+                backup.get('total_size_mb', 0),
+                backup.get('timestamp', 'Unknown'),
+            )
+        
+        for name in self.backup_rows.keys() - rows.keys():
+            self.backups_tree.delete(name)
+        
+        for name, row in rows.items():
+            if name not in self.backup_rows:
+                self.backups_tree.insert("", "end", iid=name, values=self.format_row(row))
+            elif self.backup_rows[name] != row:
+                self.backups_tree.item(name, values=self.format_row(row))
+        
+        self.backup_rows = rows
+        self.apply_view()
+    
+    def format_row(self, row):
+        """Format a cached backup row for display"""
+        name, total_files, total_size_mb, timestamp = row
+        return (f"📦 {name}", total_files, f"{total_size_mb:.2f}", timestamp)
+    
+    def apply_view(self):
+        """Filter and sort the cached rows without reloading backups"""
+        query = self.filter_var.get().strip().lower()
+        index = list(BACKUP_COLUMNS).index(self.sort_column)
+        
+        visible = [name for name in self.backup_rows if query in name.lower()]
+        visible.sort(key=lambda name: self.backup_rows[name][index], reverse=self.sort_reverse)
+        
+        visible_set = set(visible)
+        hidden = [name for name in self.backup_rows if name not in visible_set]
+        if hidden:
+            self.backups_tree.detach(*hidden)
+        
+        # Only reorder when the visible order actually changed
+        if list(self.backups_tree.get_children("")) != visible:
+            for position, name in enumerate(visible):
+                self.backups_tree.move(name, "", position)
+    
+    def sort_by(self, column):
+        """Sort the backups list by a column, toggling direction on repeat clicks"""
+        if self.sort_column == column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column = column
+            self.sort_reverse = False
+        self.apply_view()
+    
+    def restore_selected(self):
+        """Restore the backup selected in the list"""
+        selection = self.backups_tree.selection()
+        if not selection:
+            messagebox.showinfo("Restore", "Select a backup to restore.")
+            return
+        self.restore_backup(selection[0])
     
     def run_backup(self):
         """Run backup in background thread"""
-        def backup_thread():
-            try:
-                self.backup_btn.config(state="disabled", text="⏳ Creating backup...")
-                self.root.update()
-                
-                success, backup_name, metadata = self.backup_system.create_backup()
-                
-                if success:
-                    messagebox.showinfo("Success", f"✅ Backup created successfully!\n\n{backup_name}")
-                else:
-                    messagebox.showerror("Error", "❌ Backup failed!")
-                
-                self.backup_btn.config(state="normal", text="▶️ Run Backup Now")
-                self.refresh_data()
-                
-            except Exception as e:
-                messagebox.showerror("Error", f"❌ Backup failed: {str(e)}")
-                self.backup_btn.config(state="normal", text="▶️ Run Backup Now")
-        
-        threading.Thread(target=backup_thread, daemon=True).start()
+        self.backup_btn.config(state="disabled", text="⏳ Creating backup...")
+        self.data_service.run_task("backup", self.backup_system.create_backup)
     
     def restore_backup(self, backup_name):
         """Restore a backup"""
@@ -334,45 +493,65 @@ class DisasterRecoveryDashboard:
             "Confirm Restore",
             f"⚠️ Restore backup: {backup_name}?\n\nThis will overwrite current files."
         ):
-            def restore_thread():
-                try:
-                    success = self.restore_system.restore_backup(backup_name)
-                    
-                    if success:
-                        messagebox.showinfo("Success", "✅ Restore completed successfully!")
-                    else:
-                        messagebox.showerror("Error", "❌ Restore failed!")
-                        
-                except Exception as e:
-                    messagebox.showerror("Error", f"❌ Restore failed: {str(e)}")
-            
-            threading.Thread(target=restore_thread, daemon=True).start()
+            self.data_service.run_task("restore", self.restore_system.restore_backup, backup_name)
     
     def test_disaster(self):
-        """Test disaster recovery"""
+        """Run a disaster recovery drill on the newest backup"""
         if messagebox.askyesno(
             "Test Disaster",
-            "⚠️ This will simulate a disaster scenario and create a backup.\n\nContinue?"
+            "⚠️ This will restore the newest backup into a scratch directory,\n"
+            "verify it against the source and record the recovery time.\n\nContinue?"
         ):
-            messagebox.showinfo("Disaster Simulated", "💥 Disaster simulated! Automatic backup triggered.")
-            self.run_backup()
+            self.drill_btn.config(state="disabled", text="⏳ Drill running...")
+            self.data_service.run_task("drill", self.drill_runner.run)
+    
+    def format_drill(self, result):
+        """Summarize a drill result for a message box"""
+        if result["error"]:
+            return f"❌ {result['error']}"
+        verification = result["verification"]
+        bottleneck = result["bottleneck"]
+        lines = [
+            f"Backup: {result['backup_name']} ({result['source']})",
+            f"⏱️ Recovery time (RTO): {result['rto_seconds']}s",
+            f"🕒 Data age (RPO): {result['rpo_seconds'] / 3600:.1f}h",
+            f"✅ {verification['verified']} verified, {verification['changed_since_backup']} changed since backup, "
+            f"{verification['mismatched']} mismatched",
+            f"🐢 Bottleneck: {bottleneck['stage']} ({bottleneck['wall_seconds']}s, {bottleneck['bound']} bound)",
+        ]
+        for key in ("rto", "rpo"):
+            met = result["targets"][f"{key}_met"]
+            if met is not None:
+                lines.append(f"{'🟢' if met else '🔴'} {key.upper()} target {result['targets'][f'{key}_target_seconds']}s")
+        return "\n".join(lines)
     
-    def start_auto_refresh(self):
-        """Auto-refresh data every 30 seconds"""
-        def auto_refresh_thread():
-            while self.auto_refresh:
-                time.sleep(30)
-                if self.auto_refresh:
-                    try:
-                        self.root.after(0, self.refresh_data)
-                    except:
-                        break
-        
-        threading.Thread(target=auto_refresh_thread, daemon=True).start()
+    def update_sparklines(self):
+        """Redraw the resource sparklines from the sampler's ring buffers"""
+        buffers = self.resource_sampler.buffers
+        for title, host_metric, process_metric, unit, canvas, line, label in self.sparklines:
+            values = buffers[host_metric].ordered()
+            scale = 1 if unit == "%" else 1024 * 1024
+            
+            if len(values) >= 2:
+                peak = max(max(values), scale)
+                step = SPARKLINE_WIDTH / (len(values) - 1)
+                coords = []
+                for i, value in enumerate(values):
+                    coords.append(i * step)
+                    coords.append(SPARKLINE_HEIGHT - (value / peak) * (SPARKLINE_HEIGHT - 2) - 1)
+                canvas.coords(line, *coords)
+            
+            text = f"{title} {buffers[host_metric].latest() / scale:.1f} {unit}"
+            if process_metric:
+                text += f" (app {buffers[process_metric].latest() / scale:.1f})"
+            label.config(text=text)
+        
+        self.root.after(1000, self.update_sparklines)
     
     def on_closing(self):
         """Handle window closing"""
-        self.auto_refresh = False
+        self.data_service.stop()
+        self.resource_sampler.stop()
         self.root.destroy()
 
 
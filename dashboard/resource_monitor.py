@@ -0,0 +1,97 @@
+"""Host and process resource sampling for the Tkinter dashboard"""
+import threading
+import time
+from array import array
+
+import psutil
+
+
+class RingBuffer:
+    """Fixed-size float history backed by an array, oldest values overwritten"""
+
+    def __init__(self, size):
+        self.size = size
+        self.values = array('d', bytes(8 * size))
+        self.index = 0
+        self.count = 0
+
+    def append(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def latest(self):
+        return self.values[self.index - 1] if self.count else 0.0
+
+    def ordered(self):
+        """Return the recorded values, oldest first"""
+        if self.count < self.size:
+            return self.values[:self.count]
+        return self.values[self.index:] + self.values[:self.index]
+
+
+class ResourceSampler:
+    """Samples CPU, disk and network rates for the host and this process.
+
+    Each metric is kept in its own RingBuffer. Rates are bytes per second
+    computed from the psutil counters between two samples.
+    """
+
+    METRICS = (
+        "host_cpu", "process_cpu",
+        "host_disk_read", "host_disk_write",
+        "process_disk_read", "process_disk_write",
+        "net_sent", "net_recv",
+    )
+
+    def __init__(self, interval=1.0, history=120):
+        self.interval = interval
+        self.buffers = {metric: RingBuffer(history) for metric in self.METRICS}
+        self.process = psutil.Process()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling in a daemon thread"""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _counters(self):
+        """Read the cumulative byte counters used for rate calculation"""
+        disk = psutil.disk_io_counters()
+        net = psutil.net_io_counters()
+        try:
+            process_io = self.process.io_counters()
+        except (AttributeError, psutil.Error):
+            # io_counters is not available on every platform
+            process_io = None
+        return {
+            "host_disk_read": disk.read_bytes if disk else 0,
+            "host_disk_write": disk.write_bytes if disk else 0,
+            "process_disk_read": process_io.read_bytes if process_io else 0,
+            "process_disk_write": process_io.write_bytes if process_io else 0,
+            "net_sent": net.bytes_sent if net else 0,
+            "net_recv": net.bytes_recv if net else 0,
+        }
+
+    def _run(self):
+        # The first cpu_percent calls only set the baseline
+        psutil.cpu_percent(interval=None)
+        self.process.cpu_percent(interval=None)
+        previous = self._counters()
+        previous_time = time.monotonic()
+
+        while not self._stopped.wait(self.interval):
+            counters = self._counters()
+            now = time.monotonic()
+            elapsed = max(now - previous_time, 1e-6)
+
+            self.buffers["host_cpu"].append(psutil.cpu_percent(interval=None))
+            self.buffers["process_cpu"].append(self.process.cpu_percent(interval=None))
+            for metric, value in counters.items():
+                self.buffers[metric].append(max(value - previous[metric], 0) / elapsed)
+
+            previous, previous_time = counters, now
@@ -0,0 +1,682 @@
+"""
+Distributed backup across several worker processes
+A job splits the source tree into work units: each directory at
+DISTRIBUTED_SPLIT_DEPTH below the root with its whole subtree, plus the
+loose files of every directory above that depth. Workers, on one host or
+many, run the same job against the same container and claim units by
+leasing one blob per unit under _distributed/<job>/. While a worker holds
+a unit's lease it zips the unit into shard blobs, renewing the lease as it
+goes; if the worker dies the lease expires and another worker redoes the
+unit. A unit is marked done by writing its result into the unit blob with
+the lease ID, so only the current holder can complete it. Once every unit
+is done, one worker combines the results into a single manifest for the
+job, and the shards restore into one tree.
+
+The source tree must be mounted at the same path on every worker, and
+each run needs a new job name.
+
+Usage:
+    python distributed_backup.py worker --job nightly-2024-05-14 --source /mnt/share
+    python distributed_backup.py local --job nightly-2024-05-14 --source /mnt/share --workers 4
+    python distributed_backup.py status --job nightly-2024-05-14
+    python distributed_backup.py restore --job nightly-2024-05-14 --to /mnt/restore
+    python distributed_backup.py cleanup --job nightly-2024-05-14
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import zipfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+
+from profiling import StageTimer
+from backup_system import BackupSystem, zip_member
+from manifest import DISTRIBUTED_PREFIX, ManifestWriter, RunIndexRow, encode_manifest, decode_manifest, manifest_name
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SPLIT_DEPTH = int(os.getenv('DISTRIBUTED_SPLIT_DEPTH', '2'))
+# Azure accepts fixed leases of 15 to 60 seconds
+LEASE_SECONDS = int(os.getenv('DISTRIBUTED_LEASE_SECONDS', '30'))
+POLL_SECONDS = float(os.getenv('DISTRIBUTED_POLL_SECONDS', '5'))
+SHARD_BYTES = int(os.getenv('DISTRIBUTED_SHARD_MB', '1024')) * 1024 * 1024
+
+
+class LeaseLostError(RuntimeError):
+    """The worker no longer holds the lease on the unit it was working on"""
+
+
+def job_prefix(job_name):
+    return f"{DISTRIBUTED_PREFIX}{job_name}/"
+
+
+def plan_units(source_dir, split_depth=None):
+    """
+    Split a source tree into work units, listing directories only down to split_depth
+
+    Returns:
+        list: {'path': directory relative to source_dir ('' for the root), 'recursive': bool}
+    """
+    split_depth = SPLIT_DEPTH if split_depth is None else split_depth
+    units = []
+
+    def visit(path, relative, depth):
+        if depth >= split_depth:
+            units.append({'path': relative, 'recursive': True})
+            return
+        with os.scandir(path) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        if any(entry.is_file() for entry in entries):
+            units.append({'path': relative, 'recursive': False})
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                visit(entry.path, f"{relative}/{entry.name}" if relative else entry.name, depth + 1)
+
+    visit(source_dir, '', 0)
+    return units
+
+
+def unit_files(source_dir, unit):
+    """Yield the paths of the files in a work unit"""
+    top = os.path.join(source_dir, *unit['path'].split('/')) if unit['path'] else source_dir
+    if unit['recursive']:
+        for root, dirs, files in os.walk(top):
+            for file in files:
+                yield os.path.join(root, file)
+        return
+    try:
+        with os.scandir(top) as entries:
+            paths = sorted(entry.path for entry in entries if entry.is_file())
+    except FileNotFoundError:
+        return
+    yield from paths
+
+
+class DistributedBackup:
+    """One worker's handle on a distributed backup job"""
+
+    def __init__(self, backup_system, job_name, source_dir=None, worker_id=None,
+                 split_depth=None, lease_seconds=None, poll_seconds=None, shard_bytes=None):
+        self.backup_system = backup_system
+        self.container_client = backup_system.container_client
+        self.job_name = job_name
+        self.source_dir = os.path.abspath(source_dir) if source_dir else None
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.split_depth = SPLIT_DEPTH if split_depth is None else split_depth
+        self.lease_seconds = lease_seconds or LEASE_SECONDS
+        self.poll_seconds = POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.shard_bytes = shard_bytes or SHARD_BYTES
+        self.prefix = job_prefix(job_name)
+        self._failed = set()
+
+    def run(self):
+        """
+        Work on the job until no unit is left, then make sure its manifest is written
+
+        Returns:
+            dict: The job's run summary, or a failed status when units this
+            worker could not back up are left
+        """
+        finished = self._finished_run()
+        if finished:
+            return finished
+
+        job = self._load_or_plan()
+        if self.source_dir != job['source_dir']:
+            raise ValueError(f"Job {self.job_name} backs up {job['source_dir']}, not {self.source_dir}")
+
+        # Workers go through the units in different orders so they rarely contend for the same lease
+        order = list(range(len(job['units'])))
+        random.Random(self.worker_id).shuffle(order)
+        completed = 0
+
+        while True:
+            done = self._done_units()
+            pending = [index for index in order if index not in done]
+            if not pending:
+                break
+            if all(index in self._failed for index in pending):
+                logger.error(f"❌ {self.worker_id}: units {sorted(self._failed)} failed, giving up on {self.job_name}")
+                return {'backup_name': self.job_name, 'status': 'failed', 'worker': self.worker_id,
+                        'units_completed': completed, 'failed_units': sorted(self._failed)}
+
+            claimed = False
+            for index in pending:
+                if index in self._failed:
+                    continue
+                lease = self._claim(index)
+                if lease is None:
+                    continue
+                claimed = True
+                try:
+                    self._run_unit(job, index, lease)
+                    completed += 1
+                except LeaseLostError as e:
+                    logger.warning(f"⚠️  {self.worker_id}: {str(e)}")
+                except Exception as e:
+                    logger.error(f"❌ {self.worker_id}: unit {index} failed: {str(e)}")
+                    self._failed.add(index)
+                    self._release(lease)
+            if not claimed:
+                # Everything left is leased by other workers; wait for them to finish or their leases to expire
+                time.sleep(self.poll_seconds)
+
+        logger.info(f"✅ {self.worker_id}: all units of {self.job_name} done ({completed} by this worker)")
+        return self._finalize(job)
+
+    def status(self):
+        """
+        Progress of the job
+
+        Returns:
+            dict: Unit counts and the workers holding leases
+        """
+        finished = self._finished_run()
+        job = self._read_json(self.prefix + 'job.json')
+        if job is None and finished is None:
+            raise FileNotFoundError(f"No distributed backup job named {self.job_name}")
+
+        done, leased, workers = 0, 0, set()
+        for blob in self.container_client.list_blobs(name_starts_with=self.prefix + 'units/', include=['metadata']):
+            if blob.size > 0:
+                done += 1
+            elif blob.lease.state == 'leased':
+                leased += 1
+                workers.add((blob.metadata or {}).get('worker'))
+        units = len(job['units']) if job else finished['units']
+        return {
+            'job_name': self.job_name,
+            'status': 'complete' if finished else 'running',
+            'units': units,
+            'units_done': done if job else units,
+            'units_in_progress': leased,
+            'units_waiting': units - done - leased if job else 0,
+            'active_workers': sorted(w for w in workers if w),
+            'manifest': manifest_name(self.job_name) if finished else None,
+        }
+
+    def restore(self, restore_dir, max_workers=4):
+        """
+        Restore every shard of a finished job into one directory
+
+        Returns:
+            dict: Restore metadata with per-shard results
+        """
+        start_time = time.time()
+        run = self._read_run()
+        if run.get('backup_type') != 'distributed':
+            raise ValueError(f"{self.job_name} is not a distributed backup")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(lambda shard: self.backup_system.restore_directory(shard, restore_dir), run['shards']))
+
+        restore_time = time.time() - start_time
+        logger.info(f"✅ Restored {len(results)} shards of {self.job_name} in {restore_time:.2f} seconds")
+        return {
+            'backup_name': self.job_name,
+            'restored_to': restore_dir,
+            'shards': len(results),
+            'files_restored': sum(r['files_restored'] for r in results),
+            'total_size_mb': round(sum(r['total_size_mb'] for r in results), 2),
+            'restore_time_seconds': round(restore_time, 2),
+            'timestamp': datetime.now().isoformat(),
+            'status': 'success'
+        }
+
+    def cleanup(self):
+        """
+        Delete the job's coordination blobs once its manifest is written
+
+        Run it after every worker has exited.
+
+        Returns:
+            int: Number of blobs deleted
+        """
+        if not self._finished_run():
+            raise RuntimeError(f"Job {self.job_name} has not finished")
+        deleted = 0
+        for blob in self.container_client.list_blobs(name_starts_with=self.prefix):
+            try:
+                self.container_client.get_blob_client(blob.name).delete_blob()
+                deleted += 1
+            except ResourceNotFoundError:
+                pass
+        return deleted
+
+    def _load_or_plan(self):
+        """The job's unit plan; the first worker to get here writes it"""
+        job = self._read_json(self.prefix + 'job.json')
+        if job is not None:
+            return job
+
+        if not self.source_dir or not os.path.isdir(self.source_dir):
+            raise FileNotFoundError(f"Directory not found: {self.source_dir}")
+        logger.info(f"🗂️  Planning {self.job_name}: splitting {self.source_dir} at depth {self.split_depth}")
+        job = {
+            'job_name': self.job_name,
+            'source_dir': self.source_dir,
+            'split_depth': self.split_depth,
+            'units': plan_units(self.source_dir, self.split_depth),
+            'planned_by': self.worker_id,
+            'created': time.time(),
+        }
+        try:
+            self.container_client.get_blob_client(self.prefix + 'job.json').upload_blob(
+                json.dumps(job), overwrite=False
+            )
+            logger.info(f"🗂️  {self.job_name}: {len(job['units'])} work units")
+        except ResourceExistsError:
+            # Another worker planned it first; everyone must work from the same plan
+            job = self._read_json(self.prefix + 'job.json')
+        return job
+
+    def _done_units(self):
+        """Indexes of units whose result has been written"""
+        return {
+            int(blob.name.rsplit('/', 1)[1])
+            for blob in self.container_client.list_blobs(name_starts_with=self.prefix + 'units/')
+            if blob.size > 0
+        }
+
+    def _claim(self, index):
+        """
+        Lease a unit's blob, creating it on first use
+
+        Returns:
+            BlobLeaseClient or None when another worker holds it or it is already done
+        """
+        blob_client = self.container_client.get_blob_client(self._unit_blob(index))
+        try:
+            blob_client.upload_blob(b"", overwrite=False)
+        except ResourceExistsError:
+            pass
+
+        lease = self._acquire(blob_client)
+        if lease is None:
+            return None
+        if blob_client.get_blob_properties().size > 0:
+            # Finished by another worker since we listed the units
+            self._release(lease)
+            return None
+        try:
+            blob_client.set_blob_metadata({'worker': self.worker_id}, lease=lease)
+        except HttpResponseError:
+            pass
+        return lease
+
+    def _acquire(self, blob_client):
+        try:
+            return blob_client.acquire_lease(lease_duration=self.lease_seconds)
+        except HttpResponseError as e:
+            if _is_conflict(e):
+                return None
+            raise
+
+    def _release(self, lease):
+        try:
+            lease.release()
+        except HttpResponseError:
+            pass
+
+    def _run_unit(self, job, index, lease):
+        """Back up one unit into shards and record the result while still holding its lease"""
+        unit = job['units'][index]
+        label = f"{unit['path'] or '.'}{'/**' if unit['recursive'] else '/*'}"
+        logger.info(f"🧩 {self.worker_id}: unit {index} ({label})")
+        started = time.time()
+        timer = StageTimer()
+
+        with _LeaseKeeper(lease, self.lease_seconds, f"unit {index}") as keeper:
+            writer = _ShardWriter(
+                self.backup_system, f"{self.job_name}/unit-{index:06d}-{lease.id[:8]}", self.shard_bytes, timer
+            )
+            try:
+                for file_path in timer.iterate('scan', unit_files(self.source_dir, unit)):
+                    keeper.check()
+                    writer.add(file_path, os.path.relpath(file_path, self.source_dir))
+                writer.close()
+                keeper.check()
+
+                unit_run = {
+                    'unit': index,
+                    'path': unit['path'],
+                    'recursive': unit['recursive'],
+                    'worker': self.worker_id,
+                    'shards': [shard['backup_name'] for shard in writer.shards],
+                    'shard_sizes': {row['name']: row['size_bytes'] for row in writer.index_rows},
+                    'index_rows': writer.index_rows,
+                    'encrypted': any('encryption' in shard for shard in writer.shards),
+                    'files_backed_up': len(writer.members),
+                    'total_size_bytes': sum(m['file_size_bytes'] for m in writer.members),
+                    'started_at': started,
+                    'unit_time_seconds': round(time.time() - started, 2),
+                    'timings': timer.breakdown(),
+                }
+                try:
+                    # Conditional on the lease: a worker whose lease expired cannot overwrite the new holder's work
+                    self.container_client.get_blob_client(self._unit_blob(index)).upload_blob(
+                        encode_manifest(unit_run, writer.members), overwrite=True, lease=lease
+                    )
+                except HttpResponseError as e:
+                    raise LeaseLostError(f"lost the lease on unit {index}: {str(e)}") from e
+            except BaseException:
+                writer.abort()
+                raise
+
+        self._release(lease)
+        logger.info(f"✅ {self.worker_id}: unit {index} done, {len(writer.members)} files in "
+                    f"{len(writer.shards)} shards ({time.time() - started:.2f} seconds)")
+
+    def _finalize(self, job):
+        """Write the job's manifest; one worker does it while the others wait"""
+        job_blob = self.container_client.get_blob_client(self.prefix + 'job.json')
+        while True:
+            finished = self._finished_run()
+            if finished:
+                return finished
+            lease = self._acquire(job_blob)
+            if lease is not None:
+                break
+            time.sleep(self.poll_seconds)
+
+        with _LeaseKeeper(lease, self.lease_seconds, "the job manifest") as keeper:
+            finished = self._finished_run()
+            if finished:
+                self._release(lease)
+                return finished
+
+            # Unit results stream into the job's file manifest one unit at a time
+            files_manifest = ManifestWriter(self.container_client, self.job_name)
+            run_row = RunIndexRow(self.job_name, 'distributed')
+            shards, workers, timings = [], set(), {}
+            total_size = compressed_size = 0
+            encrypted = False
+            for unit_run, members in self._iter_unit_results(job):
+                keeper.check()
+                for member in members:
+                    files_manifest.add(member)
+                total_size += sum(m['file_size_bytes'] for m in members)
+                shards.extend(unit_run['shards'])
+                workers.add(unit_run['worker'])
+                encrypted = encrypted or unit_run['encrypted']
+                for row in unit_run['index_rows']:
+                    compressed_size += row['size_bytes']
+                    run_row.add(row)
+                for stage, timing in unit_run['timings'].items():
+                    total = timings.setdefault(stage, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0})
+                    for key in total:
+                        total[key] += timing[key]
+            files_manifest_name = files_manifest.close()
+
+            run = {
+                'backup_name': self.job_name,
+                'backup_type': 'distributed',
+                'directory': job['source_dir'],
+                'units': len(job['units']),
+                'shards': shards,
+                'workers': sorted(workers),
+                'files_backed_up': files_manifest.count,
+                'total_size_mb': round(total_size / (1024 * 1024), 2),
+                'compressed_size_mb': round(compressed_size / (1024 * 1024), 2),
+                'encrypted': encrypted,
+                'started_at': job['created'],
+                'total_time_seconds': round(time.time() - job['created'], 2),
+                # Summed over all workers, so stages add up to more than the wall time
+                'timings': {stage: {k: round(v, 4) for k, v in t.items()} for stage, t in timings.items()},
+                'timestamp': datetime.now().isoformat(),
+                'status': 'success',
+                'files_manifest': files_manifest_name,
+            }
+            keeper.check()
+            run['manifest'] = self.backup_system._record_run(self.job_name, run, None, run_row.rows())
+
+        self._remove_orphans(shards)
+        self._release(lease)
+        logger.info(f"✅ {self.job_name}: {run['files_backed_up']} files in {len(shards)} shards from {len(workers)} workers")
+        return run
+
+    def _iter_unit_results(self, job):
+        """Yield (unit run, members) in unit order, with a bounded number of downloads ahead"""
+        def load(index):
+            data = self.container_client.get_blob_client(self._unit_blob(index)).download_blob().readall()
+            return decode_manifest(data)
+
+        ahead = self.backup_system.max_concurrency
+        with ThreadPoolExecutor(max_workers=ahead) as pool:
+            pending = deque()
+            for index in range(len(job['units'])):
+                pending.append(pool.submit(load, index))
+                if len(pending) >= ahead:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _remove_orphans(self, shards):
+        """Delete shards uploaded by attempts that lost their lease before finishing"""
+        keep = set(shards)
+        for blob in self.container_client.list_blobs(name_starts_with=f"{self.job_name}/unit-"):
+            if blob.name not in keep:
+                try:
+                    self.container_client.get_blob_client(blob.name).delete_blob()
+                    logger.info(f"🗑️  Deleted orphaned shard {blob.name}")
+                except ResourceNotFoundError:
+                    pass
+
+    def _finished_run(self):
+        """The job's run summary if its manifest has been written"""
+        blob_client = self.container_client.get_blob_client(manifest_name(self.job_name))
+        if not blob_client.exists():
+            return None
+        run = self._read_run()
+        if run.get('backup_type') != 'distributed':
+            raise ValueError(f"{self.job_name} is already the name of a {run.get('backup_type')} backup")
+        return run
+
+    def _read_run(self):
+        """The job's run summary, without its file entries"""
+        data = self.container_client.get_blob_client(manifest_name(self.job_name)).download_blob().readall()
+        run, _ = decode_manifest(data)
+        return run
+
+    def _read_json(self, blob_name):
+        try:
+            return json.loads(self.container_client.get_blob_client(blob_name).download_blob().readall())
+        except ResourceNotFoundError:
+            return None
+
+    def _unit_blob(self, index):
+        return f"{self.prefix}units/{index:06d}"
+
+
+class _LeaseKeeper:
+    """Renews a lease in the background for the duration of a with block"""
+
+    def __init__(self, lease, lease_seconds, label):
+        self.lease = lease
+        self.lease_seconds = lease_seconds
+        self.label = label
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def check(self):
+        if self.lost:
+            raise LeaseLostError(f"lost the lease on {self.label}")
+
+    def _renew(self):
+        interval = self.lease_seconds / 3
+        renewed = time.monotonic()
+        while not self._stop.wait(interval):
+            try:
+                self.lease.renew()
+                renewed = time.monotonic()
+            except Exception as e:
+                # Transient errors are retried until the lease may have run out
+                if time.monotonic() - renewed + interval >= self.lease_seconds:
+                    logger.warning(f"⚠️  Could not renew the lease on {self.label}: {str(e)}")
+                    self.lost = True
+                    return
+
+
+class _ShardWriter:
+    """Zips files into shard blobs of about shard_bytes each
+
+    A full shard uploads in the background while the next one fills, so at
+    most two shards are on local disk at a time.
+    """
+
+    def __init__(self, backup_system, name_prefix, shard_bytes, timer):
+        self.backup_system = backup_system
+        self.name_prefix = name_prefix
+        self.shard_bytes = shard_bytes
+        self.timer = timer
+
+        self.shards = []
+        self.index_rows = []
+        self.members = []
+        self._zipf = None
+        self._name = None
+        self._count = 0
+        self._tmp_dir = tempfile.mkdtemp(prefix='shards_')
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._upload = None
+
+    def add(self, file_path, arcname):
+        if self._zipf is None:
+            self._start()
+        try:
+            member = zip_member(self._zipf, file_path, arcname, self.timer)
+        except FileNotFoundError:
+            logger.warning(f"⚠️  Skipped {file_path}: removed during the backup")
+            return
+        member['shard'] = self._name
+        self.members.append(member)
+        if self._zipf.fp.tell() >= self.shard_bytes:
+            self._finish()
+
+    def close(self):
+        try:
+            if self._zipf is not None:
+                self._finish()
+            if self._upload is not None:
+                self._upload.result()
+        finally:
+            self._pool.shutdown(wait=True)
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def abort(self):
+        """Stop and delete any shards already uploaded (best effort)"""
+        if self._zipf is not None:
+            self._zipf.close()
+            self._zipf = None
+        self._pool.shutdown(wait=True)
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        for shard in self.shards:
+            try:
+                self.backup_system.container_client.get_blob_client(shard['backup_name']).delete_blob()
+            except HttpResponseError:
+                pass
+
+    def _start(self):
+        self._name = f"{self.name_prefix}-{self._count:04d}.zip"
+        self._count += 1
+        self._zipf = zipfile.ZipFile(os.path.join(self._tmp_dir, os.path.basename(self._name)), 'w', zipfile.ZIP_DEFLATED)
+
+    def _finish(self):
+        zip_path, name = self._zipf.filename, self._name
+        self._zipf.close()
+        self._zipf = None
+        # Wait for the previous shard before queueing this one, bounding disk usage
+        if self._upload is not None:
+            self._upload.result()
+        self._upload = self._pool.submit(self._upload_shard, zip_path, name)
+
+    def _upload_shard(self, zip_path, name):
+        try:
+            metadata, index_row = self.backup_system._backup_file(zip_path, name, self.timer)
+            self.shards.append(metadata)
+            self.index_rows.append(index_row)
+        finally:
+            os.unlink(zip_path)
+
+
+def _is_conflict(error):
+    """Lease already present (409), however the SDK version maps it"""
+    return isinstance(error, ResourceExistsError) or getattr(error, 'status_code', None) == 409
+
+
+def _worker_main(job_name, source_dir, worker_id, split_depth):
+    summary = DistributedBackup(BackupSystem(), job_name, source_dir, worker_id=worker_id, split_depth=split_depth).run()
+    sys.exit(0 if summary['status'] == 'success' else 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Distributed backup coordinated through blob leases")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    worker_parser = subparsers.add_parser('worker', help="Work on a job until it is finished")
+    local_parser = subparsers.add_parser('local', help="Run several workers on this host")
+    local_parser.add_argument('--workers', type=int, default=os.cpu_count())
+    for command_parser in (worker_parser, local_parser):
+        command_parser.add_argument('--source', required=True, help="Source directory (same path on every worker)")
+        command_parser.add_argument('--split-depth', type=int, default=None)
+    worker_parser.add_argument('--worker-id', help="Default: hostname-pid")
+    subparsers.add_parser('status', help="Show a job's progress")
+    restore_parser = subparsers.add_parser('restore', help="Restore a finished job")
+    restore_parser.add_argument('--to', required=True, dest='restore_dir')
+    subparsers.add_parser('cleanup', help="Delete a finished job's coordination blobs")
+    for command_parser in subparsers.choices.values():
+        command_parser.add_argument('--job', required=True, help="Job name, shared by all of its workers")
+    args = parser.parse_args()
+
+    if args.command == 'local':
+        processes = [
+            multiprocessing.Process(
+                target=_worker_main,
+                args=(args.job, args.source, f"{socket.gethostname()}-{i}", args.split_depth)
+            )
+            for i in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        sys.exit(max(process.exitcode for process in processes))
+
+    backup = DistributedBackup(
+        BackupSystem(), args.job, getattr(args, 'source', None),
+        worker_id=getattr(args, 'worker_id', None), split_depth=getattr(args, 'split_depth', None)
+    )
+    if args.command == 'worker':
+        result = backup.run()
+    elif args.command == 'status':
+        result = backup.status()
+    elif args.command == 'restore':
+        result = backup.restore(args.restore_dir)
+    else:
+        result = {'job_name': args.job, 'blobs_deleted': backup.cleanup()}
+    print(json.dumps(result, indent=2, default=str))
+    sys.exit(0 if result.get('status') != 'failed' else 1)
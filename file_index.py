@@ -0,0 +1,353 @@
+"""Compact File Index
+
+A snapshot of a file tree (path, size, mtime and a hash prefix per file)
+kept in flat columns instead of a dict per file. Directory names are
+interned once, file names share one byte buffer, and the numeric columns
+are arrays sorted by a 64-bit hash of the path, so a lookup is a binary
+search and two snapshots are compared column against column. That is about
+40 bytes per file plus its name.
+
+NumPy is optional: with it, diffs are vectorized and a loaded index is a
+set of zero-copy views over the memory-mapped file; without it the same
+operations run on array.array in pure Python, only slower.
+"""
+import os
+import sys
+import json
+import mmap
+import bisect
+import hashlib
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # Optional, see above
+    np = None
+
+MAGIC = b"FILEIDX1"
+VERSION = 1
+
+# Column name, array typecode, NumPy dtype (stored little-endian)
+COLUMNS = (
+    ("path_hash", "Q", "<u8"),
+    ("dir_id", "I", "<u4"),
+    ("name_offset", "Q", "<u8"),
+    ("name_length", "H", "<u2"),
+    ("size", "q", "<i8"),
+    ("mtime", "d", "<f8"),
+    ("hash_prefix", "I", "<u4"),
+)
+
+# Rows compared per step of a vectorized diff, bounding its temporary arrays
+DIFF_CHUNK_ROWS = 1 << 20
+
+
+def path_hash(path):
+    """64-bit sort key of a path"""
+    digest = hashlib.blake2b(path.encode("utf-8", "surrogateescape"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def hash_prefix(file_hash):
+    """First 32 bits of a hex digest, a CRC-32 as is, or 0 when unknown"""
+    if file_hash is None:
+        return 0
+    if isinstance(file_hash, int):
+        return file_hash & 0xFFFFFFFF
+    return int(file_hash.rsplit(":", 1)[-1][:8], 16)
+
+
+class FileIndexBuilder:
+    """Collects entries for a FileIndex without keeping a Python object per file
+
+    hash_kind names what the hash prefixes are ("sha256", "crc32", ...), so
+    indexes with different kinds of hash are compared by size and mtime only.
+    """
+
+    def __init__(self, hash_kind=None):
+        self.hash_kind = hash_kind
+        self.dirs = []
+        self._dir_ids = {}
+        self.names = bytearray()
+        self.columns = {name: array(typecode) for name, typecode, _ in COLUMNS}
+
+    def __len__(self):
+        return len(self.columns["path_hash"])
+
+    def add(self, path, size, mtime, file_hash=None):
+        """Add a file; path uses forward slashes"""
+        directory, _, name = path.rpartition("/")
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self._dir_ids[directory] = len(self.dirs)
+            self.dirs.append(directory)
+        encoded = name.encode("utf-8", "surrogateescape")
+
+        columns = self.columns
+        columns["path_hash"].append(path_hash(path))
+        columns["dir_id"].append(dir_id)
+        columns["name_offset"].append(len(self.names))
+        columns["name_length"].append(len(encoded))
+        columns["size"].append(size)
+        columns["mtime"].append(mtime)
+        columns["hash_prefix"].append(hash_prefix(file_hash))
+        self.names += encoded
+
+    def build(self):
+        """Sort the rows by path hash into a FileIndex; the builder is left empty"""
+        keys = self.columns["path_hash"]
+        if np is not None:
+            order = np.argsort(np.frombuffer(keys, dtype=keys.typecode), kind="stable")
+        else:
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+        del keys
+
+        # Sort one column at a time, releasing each unsorted column as it goes
+        columns = {}
+        for name in list(self.columns):
+            column = self.columns.pop(name)
+            if np is not None:
+                columns[name] = np.frombuffer(column, dtype=column.typecode)[order]
+            else:
+                columns[name] = array(column.typecode, map(column.__getitem__, order))
+            del column
+        index = FileIndex(self.dirs, self.names, columns, self.hash_kind)
+        self.__init__(self.hash_kind)
+        return index
+
+
+class FileIndex:
+    """Sorted, column-oriented snapshot of a file tree
+
+    Build one with FileIndexBuilder or load a saved one with FileIndex.load.
+    Columns are NumPy arrays when NumPy is installed, array.array otherwise.
+    """
+
+    def __init__(self, dirs, names, columns, hash_kind=None):
+        self.dirs = dirs
+        self.names = names
+        self.columns = columns
+        self.hash_kind = hash_kind
+        for name, _, _ in COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.path_hash)
+
+    def __iter__(self):
+        """Entries in index (path hash) order"""
+        return (self.entry(row) for row in range(len(self)))
+
+    def __contains__(self, path):
+        return self.find(path) >= 0
+
+    def path(self, row):
+        offset = int(self.name_offset[row])
+        name = bytes(self.names[offset:offset + int(self.name_length[row])]).decode("utf-8", "surrogateescape")
+        directory = self.dirs[int(self.dir_id[row])]
+        return f"{directory}/{name}" if directory else name
+
+    def entry(self, row):
+        return {
+            "path": self.path(row),
+            "size": int(self.size[row]),
+            "mtime": float(self.mtime[row]),
+            "hash_prefix": int(self.hash_prefix[row]),
+        }
+
+    def find(self, path):
+        """Row of path, or -1"""
+        key = path_hash(path)
+        if np is not None:
+            row = int(np.searchsorted(self.path_hash, np.uint64(key)))
+        else:
+            row = bisect.bisect_left(self.path_hash, key)
+        # Rows sharing the hash are adjacent; check the names in case of a collision
+        while row < len(self) and int(self.path_hash[row]) == key:
+            if self.path(row) == path:
+                return row
+            row += 1
+        return -1
+
+    def get(self, path):
+        row = self.find(path)
+        return self.entry(row) if row >= 0 else None
+
+    def diff(self, newer):
+        """
+        Compare with a newer snapshot of the same tree
+
+        A file counts as changed when its size or mtime differs, or its
+        hash prefix when both indexes have the same kind of hash. Files are
+        matched by path hash, so two paths colliding on all 64 bits (about a
+        one-in-a-million chance with ten million files) would be mistaken
+        for one another.
+
+        Returns:
+            FileIndexDiff
+        """
+        compare_hashes = self.hash_kind is not None and self.hash_kind == newer.hash_kind
+        if np is not None:
+            added, deleted, changed = _diff_vectorized(self, newer, compare_hashes)
+        else:
+            added, deleted, changed = _diff_merge(self, newer, compare_hashes)
+        return FileIndexDiff(self, newer, added, deleted, changed)
+
+    def save(self, path):
+        """Write the index to one file whose columns FileIndex.load can memory-map"""
+        rows = len(self)
+        dirs = "\0".join(self.dirs).encode("utf-8", "surrogateescape")
+        sections = [(name, self.columns[name], rows * array(typecode).itemsize) for name, typecode, _ in COLUMNS]
+        sections += [("names", self.names, len(self.names)), ("dirs", dirs, len(dirs))]
+
+        layout, offset = {}, 0
+        for name, _, length in sections:
+            layout[name] = [offset, length]
+            offset = _align(offset + length)
+        header = json.dumps({
+            "version": VERSION,
+            "rows": rows,
+            "dirs": len(self.dirs),
+            "hash_kind": self.hash_kind,
+            "sections": layout,
+        }).encode("utf-8")
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+            data_start = _align(f.tell())
+            # One column at a time, so saving needs no copy of the whole index
+            for name, data, _ in sections:
+                f.seek(data_start + layout[name][0])
+                f.write(_little_endian_bytes(data) if name in self.columns else data)
+            # Pad to the end of the last section, so empty sections still lie inside the file
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Open a saved index; with NumPy its columns are views over the mapped file"""
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapping[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a file index: {path}")
+        header_length = int.from_bytes(mapping[len(MAGIC):len(MAGIC) + 8], "little")
+        header_start = len(MAGIC) + 8
+        header = json.loads(mapping[header_start:header_start + header_length])
+        if header.get("version") != VERSION:
+            raise ValueError(f"Unsupported file index version: {header.get('version')}")
+        data_start = _align(header_start + header_length)
+        sections = header["sections"]
+
+        def section(name):
+            offset, length = sections[name]
+            return data_start + offset, length
+
+        columns = {}
+        for name, typecode, dtype in COLUMNS:
+            offset, length = section(name)
+            if np is not None:
+                columns[name] = np.frombuffer(mapping, dtype=dtype, count=header["rows"], offset=offset)
+            else:
+                column = array(typecode)
+                column.frombytes(mapping[offset:offset + length])
+                if sys.byteorder == "big":
+                    column.byteswap()
+                columns[name] = column
+
+        offset, length = section("names")
+        names = memoryview(mapping)[offset:offset + length] if np is not None else mapping[offset:offset + length]
+        offset, length = section("dirs")
+        dirs = mapping[offset:offset + length].decode("utf-8", "surrogateescape").split("\0") if header["dirs"] else []
+        return cls(dirs, names, columns, header.get("hash_kind"))
+
+
+class FileIndexDiff:
+    """What changed between two snapshots, as row numbers into them
+
+    added and changed are rows of the newer index, deleted rows of the older.
+    """
+
+    def __init__(self, older, newer, added, deleted, changed):
+        self.older = older
+        self.newer = newer
+        self.added = added
+        self.deleted = deleted
+        self.changed = changed
+
+    def counts(self):
+        return {"added": len(self.added), "deleted": len(self.deleted), "changed": len(self.changed)}
+
+    def added_paths(self):
+        return (self.newer.path(row) for row in self.added)
+
+    def deleted_paths(self):
+        return (self.older.path(row) for row in self.deleted)
+
+    def changed_paths(self):
+        return (self.newer.path(row) for row in self.changed)
+
+
+def _diff_vectorized(older, newer, compare_hashes):
+    """Match rows by path hash with searchsorted, a chunk of older rows at a time"""
+    deleted, changed = [], []
+    seen = np.zeros(len(newer), dtype=bool)
+    if len(newer) == 0:
+        return np.arange(0), np.arange(len(older)), np.arange(0)
+
+    for start in range(0, len(older), DIFF_CHUNK_ROWS):
+        keys = older.path_hash[start:start + DIFF_CHUNK_ROWS]
+        positions = np.minimum(np.searchsorted(newer.path_hash, keys), len(newer) - 1)
+        matched = newer.path_hash[positions] == keys
+        deleted.append(np.flatnonzero(~matched) + start)
+
+        old_rows = np.flatnonzero(matched) + start
+        new_rows = positions[matched]
+        seen[new_rows] = True
+        differs = (older.size[old_rows] != newer.size[new_rows]) | (older.mtime[old_rows] != newer.mtime[new_rows])
+        if compare_hashes:
+            old_hashes, new_hashes = older.hash_prefix[old_rows], newer.hash_prefix[new_rows]
+            differs |= (old_hashes != 0) & (new_hashes != 0) & (old_hashes != new_hashes)
+        changed.append(new_rows[differs])
+
+    added = np.flatnonzero(~seen)
+    deleted = np.concatenate(deleted) if deleted else np.arange(0)
+    changed = np.sort(np.concatenate(changed)) if changed else np.arange(0)
+    return added, deleted, changed
+
+
+def _diff_merge(older, newer, compare_hashes):
+    """Walk both sorted hash columns together"""
+    added, deleted, changed = [], [], []
+    old_keys, new_keys = older.path_hash, newer.path_hash
+    i = j = 0
+    while i < len(old_keys) and j < len(new_keys):
+        if old_keys[i] < new_keys[j]:
+            deleted.append(i)
+            i += 1
+        elif old_keys[i] > new_keys[j]:
+            added.append(j)
+            j += 1
+        else:
+            if (older.size[i] != newer.size[j] or older.mtime[i] != newer.mtime[j] or (
+                    compare_hashes and older.hash_prefix[i] and newer.hash_prefix[j]
+                    and older.hash_prefix[i] != newer.hash_prefix[j])):
+                changed.append(j)
+            i += 1
+            j += 1
+    deleted.extend(range(i, len(old_keys)))
+    added.extend(range(j, len(new_keys)))
+    return added, deleted, changed
+
+
+def _little_endian_bytes(column):
+    if np is not None:
+        return np.asarray(column).astype(np.asarray(column).dtype.newbyteorder("<"), copy=False).tobytes()
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _align(offset):
+    return (offset + 7) & ~7
@@ -0,0 +1,480 @@
+"""
+Backup manifests and the container index
+Each backup run writes one gzip'd, column-oriented manifest with all of its
+file entries, and a rolling index of every backup blob lives at
+_index/backups.json.gz so listing and stats take a single GET.
+
+Runs that back up files one by one stream their file entries instead: a
+gzip'd NDJSON blob is uploaded block by block while the run goes on, and
+the run's manifest holds only the summary and that blob's name. In the
+index such a run is a single row for all of its blobs.
+
+The encode/decode helpers are plain functions so the async client can use
+them too.
+"""
+import argparse
+import gzip
+import json
+import zlib
+import asyncio
+import random
+import time
+import logging
+import threading
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+# Summary-only manifest; file entries are in run['files_manifest']
+STREAMED_MANIFEST_VERSION = 2
+MANIFEST_PREFIX = "_manifests/"
+INDEX_BLOB = "_index/backups.json.gz"
+PROFILE_PREFIX = "_profiles/"
+DISTRIBUTED_PREFIX = "_distributed/"
+
+# blobs is set on rows that stand for all of a run's blobs under <name>/
+INDEX_COLUMNS = ('name', 'size_bytes', 'created', 'last_modified', 'tier', 'backup_type', 'manifest', 'blobs')
+
+# Attempts at the index read-modify-write before giving up
+INDEX_UPDATE_ATTEMPTS = 10
+
+# Compressed file entries buffered before a block is staged
+FILES_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+def manifest_name(run_name):
+    return f"{MANIFEST_PREFIX}{run_name}.json.gz"
+
+
+def files_manifest_name(run_name):
+    return f"{MANIFEST_PREFIX}{run_name}.files.ndjson.gz"
+
+
+def is_internal_blob(name):
+    """Manifests, profiles, the index, distributed job state and legacy sidecars are not backups themselves"""
+    return name.startswith((MANIFEST_PREFIX, PROFILE_PREFIX, DISTRIBUTED_PREFIX, INDEX_BLOB)) or name.endswith('.metadata.json')
+
+
+def encode_columns(rows):
+    """List of dicts -> {column: [values]} (columns in first-seen order)"""
+    columns = {}
+    for row in rows:
+        for key in row:
+            columns.setdefault(key, None)
+    return {key: [row.get(key) for row in rows] for key in columns}
+
+
+def decode_columns(columns):
+    """{column: [values]} -> list of dicts, dropping missing (None) values"""
+    if not columns:
+        return []
+    keys = list(columns)
+    return [
+        {key: value for key, value in zip(keys, values) if value is not None}
+        for values in zip(*(columns[key] for key in keys))
+    ]
+
+
+def _dump(document):
+    return gzip.compress(json.dumps(document, separators=(',', ':'), default=str).encode('utf-8'))
+
+
+def encode_manifest(run, files):
+    """Serialize a run summary and its per-file entries (None when they were streamed)"""
+    if files is None:
+        return _dump({'version': STREAMED_MANIFEST_VERSION, 'run': run})
+    return _dump({'version': MANIFEST_VERSION, 'run': run, 'files': encode_columns(files)})
+
+
+def decode_manifest(data):
+    """
+    Returns:
+        tuple: (run summary dict, list of file entry dicts), with None for
+        the entries of a streamed manifest
+    """
+    document = json.loads(gzip.decompress(data))
+    if document.get('version') == STREAMED_MANIFEST_VERSION:
+        return document['run'], None
+    if document.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version: {document.get('version')}")
+    return document['run'], decode_columns(document['files'])
+
+
+class FilesEncoder:
+    """Compresses file entries to gzip'd NDJSON and cuts the stream into blocks"""
+
+    def __init__(self, block_bytes=None):
+        self.block_bytes = block_bytes or FILES_BLOCK_BYTES
+        self.block_ids = []
+        self.count = 0
+        self._compressor = zlib.compressobj(wbits=31)
+        self._buffer = bytearray()
+
+    def add(self, entry):
+        """
+        Returns:
+            tuple: (block ID, data) once a block is full, otherwise None
+        """
+        line = json.dumps(entry, separators=(',', ':'), default=str).encode('utf-8') + b'\n'
+        self._buffer += self._compressor.compress(line)
+        self.count += 1
+        if len(self._buffer) >= self.block_bytes:
+            return self._take()
+        return None
+
+    def finish(self):
+        """The last block, which ends the gzip stream"""
+        self._buffer += self._compressor.flush()
+        return self._take()
+
+    def _take(self):
+        block_id = f"{len(self.block_ids):08d}"
+        self.block_ids.append(block_id)
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return block_id, data
+
+
+class FilesDecoder:
+    """Turns the compressed chunks of an NDJSON file manifest back into entries"""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(wbits=31)
+        self._pending = b""
+
+    def feed(self, chunk):
+        """
+        Returns:
+            list: Entries completed by this chunk
+        """
+        *lines, self._pending = (self._pending + self._decompressor.decompress(chunk)).split(b'\n')
+        return [json.loads(line) for line in lines if line]
+
+    def close(self):
+        rest = self._pending + self._decompressor.flush()
+        self._pending = b""
+        return [json.loads(rest)] if rest.strip() else []
+
+
+class ManifestWriter:
+    """Streams a run's file entries to its NDJSON file manifest as they complete
+
+    Only one block of compressed entries is held in memory; full blocks are
+    staged right away and committed by close().
+    """
+
+    def __init__(self, container_client, run_name, block_bytes=None):
+        self.name = files_manifest_name(run_name)
+        self.blob_client = container_client.get_blob_client(self.name)
+        self._encoder = FilesEncoder(block_bytes)
+
+    @property
+    def count(self):
+        return self._encoder.count
+
+    def add(self, entry):
+        block = self._encoder.add(entry)
+        if block:
+            self.blob_client.stage_block(*block)
+
+    def close(self):
+        """
+        Returns:
+            str: Blob name of the file manifest
+        """
+        self.blob_client.stage_block(*self._encoder.finish())
+        self.blob_client.commit_block_list(self._encoder.block_ids)
+        return self.name
+
+
+class AsyncManifestWriter(ManifestWriter):
+    """ManifestWriter for an azure.storage.blob.aio container client"""
+
+    async def add(self, entry):
+        block = self._encoder.add(entry)
+        if block:
+            await self.blob_client.stage_block(*block)
+
+    async def close(self):
+        await self.blob_client.stage_block(*self._encoder.finish())
+        await self.blob_client.commit_block_list(self._encoder.block_ids)
+        return self.name
+
+
+def iter_files_manifest(blob_client):
+    """Yield the entries of an NDJSON file manifest while it downloads"""
+    decoder = FilesDecoder()
+    for chunk in blob_client.download_blob().chunks():
+        yield from decoder.feed(chunk)
+    yield from decoder.close()
+
+
+async def aiter_files_manifest(blob_client):
+    """iter_files_manifest for an azure.storage.blob.aio blob client"""
+    decoder = FilesDecoder()
+    downloader = await blob_client.download_blob()
+    async for chunk in downloader.chunks():
+        for entry in decoder.feed(chunk):
+            yield entry
+    for entry in decoder.close():
+        yield entry
+
+
+def encode_index(entries):
+    return _dump({
+        'version': MANIFEST_VERSION,
+        'columns': {key: [entry.get(key) for entry in entries] for key in INDEX_COLUMNS},
+    })
+
+
+def decode_index(data):
+    document = json.loads(gzip.decompress(data))
+    if document.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported index version: {document.get('version')}")
+    return decode_columns(document['columns'])
+
+
+def listing_entry(blob):
+    """Index entry for a blob from a container listing"""
+    return {
+        'name': blob.name,
+        'size_bytes': blob.size,
+        'created': blob.creation_time.isoformat() if blob.creation_time else None,
+        'last_modified': blob.last_modified.isoformat() if blob.last_modified else None,
+        'tier': blob.blob_tier,
+    }
+
+
+def index_from_listing(blobs):
+    """
+    Index entries for the backup blobs of a container listing
+
+    Blobs under <run>/ of a run with a manifest are summed into one row for
+    the run, as _record_run would have written it.
+    """
+    entries = []
+    runs = {}
+    for blob in blobs:
+        if blob.name.startswith(MANIFEST_PREFIX) and blob.name.endswith('.json.gz') and not blob.name.endswith('.files.ndjson.gz'):
+            run_name = blob.name[len(MANIFEST_PREFIX):-len('.json.gz')]
+            runs[run_name] = RunIndexRow(run_name, None)
+        elif not is_internal_blob(blob.name):
+            entries.append(listing_entry(blob))
+
+    compacted = []
+    for entry in entries:
+        run_row = runs.get(entry['name'].split('/', 1)[0]) if '/' in entry['name'] else None
+        if run_row is None:
+            if entry['name'] in runs:
+                entry['manifest'] = manifest_name(entry['name'])
+            compacted.append(entry)
+        else:
+            run_row.add(entry)
+    for run_name, run_row in runs.items():
+        for row in run_row.rows():
+            row['manifest'] = manifest_name(run_name)
+            compacted.append(row)
+    return compacted
+
+
+def merge_index(entries, added=(), removed=(), changed=None):
+    """
+    New index entries with added rows replacing rows of the same name,
+    removed names dropped and changed ({name: {column: value}}) applied
+
+    An added run row (one with blobs) also replaces rows of the blobs under
+    it, e.g. ones a listing found before the run was recorded.
+    """
+    drop = set(removed) | {row['name'] for row in added}
+    under = tuple(f"{row['name']}/" for row in added if row.get('blobs'))
+    changed = changed or {}
+    merged = [
+        dict(entry, **changed.get(entry['name'], {}))
+        for entry in entries
+        if entry['name'] not in drop and not (under and entry['name'].startswith(under))
+    ]
+    merged.extend(added)
+    merged.sort(key=lambda entry: entry['name'])
+    return merged
+
+
+class ContainerIndex:
+    """The rolling backup index of a container
+
+    Writers do a read-modify-write guarded by the index blob's ETag and
+    retry when another writer got there first. An index that can't be
+    decoded is treated as missing, so readers fall back to a listing and the
+    next update replaces it.
+    """
+
+    def __init__(self, container_client):
+        self.container_client = container_client
+        self.blob_client = container_client.get_blob_client(INDEX_BLOB)
+
+    def load(self):
+        """
+        Returns:
+            tuple: (list of entries, ETag), or (None, None) if there is no index
+        """
+        try:
+            downloader = self.blob_client.download_blob()
+        except ResourceNotFoundError:
+            return None, None
+        etag = downloader.properties.etag
+        try:
+            return decode_index(downloader.readall()), etag
+        except (OSError, EOFError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️  Unreadable backup index, using a container listing: {e}")
+            return None, etag
+
+    def entries_from_listing(self):
+        """Index entries for every backup blob, from a full container listing"""
+        return index_from_listing(self.container_client.list_blobs())
+
+    def update(self, added=(), removed=(), changed=None):
+        """Add or replace rows, drop removed names and apply column changes"""
+        for attempt in range(INDEX_UPDATE_ATTEMPTS):
+            entries, etag = self.load()
+            if entries is None:
+                # First write to this container, or an unreadable index: start from what is there
+                entries = self.entries_from_listing()
+            data = encode_index(merge_index(entries, added, removed, changed))
+            try:
+                if etag:
+                    self.blob_client.upload_blob(data, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+                else:
+                    self.blob_client.upload_blob(data, overwrite=False)
+                return
+            except (ResourceExistsError, ResourceModifiedError):
+                # Lost the race to another writer; re-read and try again
+                time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+        raise RuntimeError("Could not update the backup index, too many concurrent writers")
+
+    def invalidate(self):
+        """
+        Drop the index after an update failed, so it can't hide the run that
+        wasn't added; readers list the container until the next update
+        """
+        try:
+            self.blob_client.delete_blob()
+        except ResourceNotFoundError:
+            pass
+
+    def rebuild(self):
+        """Overwrite the index from a full listing, e.g. after blobs changed behind its back"""
+        entries = merge_index(self.entries_from_listing())
+        self.blob_client.upload_blob(encode_index(entries), overwrite=True)
+        return entries
+
+
+class AsyncContainerIndex:
+    """ContainerIndex for an azure.storage.blob.aio container client
+
+    Decoding and encoding run in a worker thread so a large index doesn't
+    stall the event loop. An unreadable index is treated as missing.
+    """
+
+    def __init__(self, container_client):
+        self.container_client = container_client
+        self.blob_client = container_client.get_blob_client(INDEX_BLOB)
+
+    async def load(self):
+        """
+        Returns:
+            tuple: (list of entries, ETag), or (None, None) if there is no index
+        """
+        try:
+            downloader = await self.blob_client.download_blob()
+            data = await downloader.readall()
+        except ResourceNotFoundError:
+            return None, None
+        etag = downloader.properties.etag
+        try:
+            return await asyncio.to_thread(decode_index, data), etag
+        except (OSError, EOFError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️  Unreadable backup index, using a container listing: {e}")
+            return None, etag
+
+    async def entries_from_listing(self):
+        """Index entries for every backup blob, from a full container listing"""
+        return index_from_listing([blob async for blob in self.container_client.list_blobs()])
+
+    async def update(self, added=(), removed=(), changed=None):
+        """Add or replace rows, drop removed names and apply column changes"""
+        for attempt in range(INDEX_UPDATE_ATTEMPTS):
+            entries, etag = await self.load()
+            if entries is None:
+                entries = await self.entries_from_listing()
+            data = await asyncio.to_thread(lambda: encode_index(merge_index(entries, added, removed, changed)))
+            try:
+                if etag:
+                    await self.blob_client.upload_blob(data, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+                else:
+                    await self.blob_client.upload_blob(data, overwrite=False)
+                return
+            except (ResourceExistsError, ResourceModifiedError):
+                await asyncio.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+        raise RuntimeError("Could not update the backup index, too many concurrent writers")
+
+    async def invalidate(self):
+        """Drop the index after an update failed; see ContainerIndex.invalidate"""
+        try:
+            await self.blob_client.delete_blob()
+        except ResourceNotFoundError:
+            pass
+
+
+class RunIndexRow:
+    """Sums the blobs of a run into the one container-index row that stands for it
+
+    Runs that upload a blob per file list those blobs in their file manifest;
+    the index only gets the run's total, so its size doesn't grow with the
+    number of files. Blobs may be added from upload threads.
+    """
+
+    def __init__(self, run_name, backup_type):
+        self.run_name = run_name
+        self.backup_type = backup_type
+        self.blobs = 0
+        self.size_bytes = 0
+        self._created = None
+        self._last_modified = None
+        self._lock = threading.Lock()
+
+    def add(self, row):
+        with self._lock:
+            self.blobs += 1
+            self.size_bytes += row['size_bytes']
+            self._created = min(filter(None, (self._created, row['created'])), default=None)
+            self._last_modified = max(filter(None, (self._last_modified, row['last_modified'])), default=None)
+
+    def rows(self):
+        """
+        Returns:
+            list: The run's index row for _record_run, or no rows if it uploaded nothing
+        """
+        if not self.blobs:
+            return []
+        return [{
+            'name': self.run_name,
+            'size_bytes': self.size_bytes,
+            'created': self._created,
+            'last_modified': self._last_modified,
+            'tier': None,
+            'backup_type': self.backup_type,
+            'blobs': self.blobs,
+        }]
+
+
+if __name__ == '__main__':
+    from backup_system import BackupSystem
+
+    parser = argparse.ArgumentParser(description="Backup container index maintenance")
+    parser.add_argument('command', choices=['rebuild'])
+    args = parser.parse_args()
+
+    entries = BackupSystem().index.rebuild()
+    print(f"Rebuilt the backup index with {len(entries)} entries")
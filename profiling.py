@@ -0,0 +1,160 @@
+"""Profiling Hooks
+
+StageTimer records wall and CPU time per stage of a backup or restore run
+(scan, hash, compress, upload, ...), which ends up in the run's metadata.
+
+With BACKUP_PROFILE=1 a run is also wrapped in cProfile and tracemalloc,
+and the profile (.prof, readable with `python -m pstats`) and a memory
+report (.memory.txt) are saved next to the backup.
+"""
+import os
+import time
+import cProfile
+import logging
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Allocation sites listed in the memory report
+MEMORY_REPORT_LINES = 25
+
+_active = threading.Lock()
+
+
+def profiling_enabled():
+    return os.getenv("BACKUP_PROFILE", "False").lower() in ("true", "1", "yes")
+
+
+class StageTimer:
+    """Accumulates wall and CPU time per named stage
+
+    Stages may run in several threads at once; CPU time is measured per
+    thread, so a parallel stage can report more CPU than wall time.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    @contextmanager
+    def waiting(self, name):
+        """Charge only wall time to a stage, e.g. around an await
+
+        While a coroutine waits, the event loop's thread runs other
+        coroutines, so its CPU time doesn't belong to this stage.
+        """
+        wall = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, 0.0)
+
+    def iterate(self, name, iterable):
+        """Yield from iterable, charging the time spent producing items to a stage"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def add(self, name, wall_seconds, cpu_seconds):
+        with self._lock:
+            stage = self._stages.setdefault(name, [0.0, 0.0, 0])
+            stage[0] += wall_seconds
+            stage[1] += cpu_seconds
+            stage[2] += 1
+
+    def breakdown(self):
+        """Stage -> wall_seconds, cpu_seconds and calls, in first-seen order"""
+        with self._lock:
+            return {
+                name: {"wall_seconds": round(wall, 4), "cpu_seconds": round(cpu, 4), "calls": calls}
+                for name, (wall, cpu, calls) in self._stages.items()
+            }
+
+
+class RunProfiler:
+    """cProfile and tracemalloc around one run"""
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+        self._snapshot = None
+        self._peak = 0
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self._profile.disable()
+        self._peak = tracemalloc.get_traced_memory()[1]
+        self._snapshot = tracemalloc.take_snapshot()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    def save(self, base_path):
+        """
+        Write <base_path>.prof and <base_path>.memory.txt
+
+        Returns:
+            list: Paths written
+        """
+        profile_path = f"{base_path}.prof"
+        memory_path = f"{base_path}.memory.txt"
+        self._profile.dump_stats(profile_path)
+
+        with open(memory_path, 'w') as f:
+            f.write(f"Peak traced memory: {self._peak / (1024 * 1024):.2f} MB\n\n")
+            f.write(f"Top {MEMORY_REPORT_LINES} allocation sites still held at the end of the run:\n")
+            for stat in self._snapshot.statistics("lineno")[:MEMORY_REPORT_LINES]:
+                f.write(f"{stat}\n")
+        return [profile_path, memory_path]
+
+
+def profiled(save):
+    """
+    Decorator: with BACKUP_PROFILE set, run the method under a RunProfiler
+    and then call save(self, result, profiler) to store the output
+
+    save also receives the method's arguments. cProfile only sees the calling
+    thread, so work done in pools shows up as time waiting on futures; the
+    StageTimer breakdown covers those stages. Nested profiled calls (e.g. an
+    incremental backup falling back to a full one) are covered by the
+    outermost profiler.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not profiling_enabled() or not _active.acquire(blocking=False):
+                return func(self, *args, **kwargs)
+            try:
+                profiler = RunProfiler()
+                with profiler:
+                    result = func(self, *args, **kwargs)
+            finally:
+                _active.release()
+            try:
+                save(self, result, profiler, *args, **kwargs)
+            except Exception as e:
+                logging.warning(f"Failed to save profile: {str(e)}")
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,491 @@
+"""
+Single-read fan-out replication
+The source tree is read and compressed once into a zip stream that is copied
+to every destination concurrently: the local backups/ directory, one or
+more blob containers, or the simulator. Every copy is the same archive,
+under the same name and with the same hash, except that a local copy gets
+a -2, -3, ... suffix if a backup from the same second already has its name.
+
+Each destination has its own bounded queue, worker thread, retries and
+result. The producer only waits when a destination's queue is full, and a
+destination that fails is dropped without holding up the others.
+
+Usage:
+    python replication.py run --to local --to azure --to azure:backups-dr
+"""
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from file_index import FileIndexBuilder
+from profiling import StageTimer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv('REPLICATION_CHUNK_MB', '4')) * 1024 * 1024
+QUEUE_CHUNKS = int(os.getenv('REPLICATION_QUEUE_CHUNKS', '8'))
+RETRIES = int(os.getenv('REPLICATION_RETRIES', '3'))
+RETRY_BACKOFF_SECONDS = 0.5
+
+
+class _Commit:
+    """Last queue item: the stream is complete, finish the copy"""
+
+    def __init__(self, run, members):
+        self.run = run
+        self.members = members
+
+
+class Destination:
+    """One copy of the replicated stream
+
+    Subclasses implement open, write, commit and abort; they run in the
+    destination's own worker thread. Idempotent calls go through
+    with_retries.
+    """
+
+    def __init__(self, label, queue_chunks=None, retries=None):
+        self.label = label
+        self.queue = queue.Queue(maxsize=queue_chunks or QUEUE_CHUNKS)
+        self.retries = RETRIES if retries is None else retries
+        self.error = None
+        self.retry_count = 0
+        self.bytes_written = 0
+        self.location = None
+        self.busy_seconds = 0.0
+        self._thread = None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def start(self, backup_name):
+        self._thread = threading.Thread(target=self._run, args=(backup_name,), daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        """Queue an item, waiting while the queue is full (dropped once this destination failed)"""
+        while not self.failed:
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def join(self):
+        self._thread.join()
+
+    def result(self):
+        return {
+            'destination': self.label,
+            'status': 'failed' if self.failed else 'success',
+            'location': self.location,
+            'bytes_written': self.bytes_written,
+            'retries': self.retry_count,
+            'busy_seconds': round(self.busy_seconds, 2),
+            'error': str(self.error) if self.error else None
+        }
+
+    def with_retries(self, func, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                self.retry_count += 1
+                logger.warning(f"⚠️  {self.label}: {str(e)}, retrying ({attempt + 1}/{self.retries})")
+                time.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt))
+
+    def open(self, backup_name):
+        raise NotImplementedError
+
+    def write(self, chunk):
+        raise NotImplementedError
+
+    def commit(self, run, members):
+        raise NotImplementedError
+
+    def abort(self):
+        pass
+
+    def _run(self, backup_name):
+        try:
+            self.open(backup_name)
+            while True:
+                item = self.queue.get()
+                started = time.perf_counter()
+                if item is None:
+                    raise RuntimeError("Replication source failed")
+                if isinstance(item, _Commit):
+                    self.commit(item.run, item.members)
+                    self.busy_seconds += time.perf_counter() - started
+                    logger.info(f"✅ Replicated to {self.label}: {self.location}")
+                    return
+                self.write(item)
+                self.bytes_written += len(item)
+                self.busy_seconds += time.perf_counter() - started
+        except Exception as e:
+            self.error = e
+            logger.error(f"❌ Replication to {self.label} failed: {str(e)}")
+            try:
+                self.abort()
+            except Exception as abort_error:
+                logger.warning(f"⚠️  {self.label}: cleanup failed: {str(abort_error)}")
+            # Unblock a producer waiting on this queue
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+
+class LocalDestination(Destination):
+    """A backup in the local backups/ directory, as written by app/backup.py
+
+    The archive name is reserved like a local backup's, so it gets a -2, -3,
+    ... suffix if a backup from the same second exists, and the file index
+    is saved with it for the next incremental backup.
+    """
+
+    def __init__(self, backup_dir=None, **kwargs):
+        sys.path.insert(0, str(Path(__file__).parent / "app"))
+        from backup import BackupSystem as LocalBackupSystem
+        self.local = LocalBackupSystem()
+        if backup_dir:
+            self.local.backup_dir = Path(backup_dir)
+            self.local.backup_dir.mkdir(parents=True, exist_ok=True)
+        super().__init__(f"local:{self.local.backup_dir}", **kwargs)
+        self._file = None
+
+    def open(self, backup_name):
+        timestamp = backup_name.removesuffix('.zip').removeprefix('backup_')
+        self.backup_name, backup_path = self.local._reserve_backup_name(timestamp, '.zip')
+        self.location = str(backup_path)
+        self._partial_path = f"{self.location}.partial"
+        self._file = open(self._partial_path, 'wb')
+
+    def write(self, chunk):
+        self._file.write(chunk)
+
+    def commit(self, run, members):
+        self._file.close()
+        os.replace(self._partial_path, self.location)
+        file_index = FileIndexBuilder()
+        for member in members:
+            file_index.add(member['member'], member['file_size_bytes'], member['mtime'])
+        self.local._save_file_index(self.backup_name, file_index)
+        metadata = {
+            "backup_name": self.backup_name,
+            "timestamp": run['timestamp'],
+            "started_at": run['started_at'],
+            "total_files": run['files_backed_up'],
+            "total_size_bytes": run['total_size_bytes'],
+            "total_size_mb": round(run['total_size_bytes'] / (1024 * 1024), 2),
+            "source_dirs": run['source_dirs'],
+            "file_hash": run['file_hash'],
+            "timings": run['timings'],
+        }
+        self.local._save_metadata(self.backup_name, metadata)
+
+    def abort(self):
+        if self._file:
+            self._file.close()
+            # The partial copy and the reserved name
+            for path in (self._partial_path, self.location):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+class BlobDestination(Destination):
+    """A directory_zip backup in a blob container, with its manifest and index row
+
+    Chunks are staged as blocks while the stream is produced (up to
+    max_concurrency at a time) and committed at the end. With encryption
+    keys configured the stream is spooled to a temp file instead, since the
+    encrypted format needs the plaintext size up front, and uploaded with
+    upload_encrypted once complete.
+    """
+
+    def __init__(self, connection_string, container_name, keyring=None, max_concurrency=None, **kwargs):
+        # "UseSimulator=true;Root=..." selects the local blob stand-in
+        if connection_string.startswith('UseSimulator='):
+            from app.cloud_simulator import SimulatedBlobServiceClient as service_client_class
+            label = f"simulator:{container_name}"
+        else:
+            from azure.storage.blob import BlobServiceClient as service_client_class
+            label = f"azure:{container_name}"
+        super().__init__(label, **kwargs)
+        self.container_client = service_client_class.from_connection_string(
+            connection_string
+        ).get_container_client(container_name)
+        self.keyring = keyring
+        self.max_concurrency = max_concurrency or int(os.getenv('BACKUP_MAX_CONCURRENCY', '4'))
+        self._pool = None
+        self._spool = None
+
+    def open(self, backup_name):
+        self.location = backup_name
+        self.blob_client = self.container_client.get_blob_client(backup_name)
+        self.with_retries(self.container_client.get_container_properties)
+        if self.keyring:
+            self._spool = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency)
+            self._block_ids = []
+            self._staging = []
+
+    def write(self, chunk):
+        if self._spool:
+            self._spool.write(chunk)
+            return
+        # Bound the blocks held in memory: wait for the oldest before adding another
+        if len(self._staging) >= self.max_concurrency:
+            self._staging[0].result()
+        for future in self._staging:
+            if future.done():
+                future.result()
+        self._staging = [f for f in self._staging if not f.done()]
+        block_id = f"{len(self._block_ids):08d}"
+        self._block_ids.append(block_id)
+        self._staging.append(self._pool.submit(self.with_retries, self.blob_client.stage_block, block_id, chunk))
+
+    def commit(self, run, members):
+        from backup_crypto import upload_encrypted
+        from manifest import ContainerIndex, manifest_name, encode_manifest
+
+        if self._spool:
+            self._spool.close()
+            result, cipher = self.with_retries(
+                upload_encrypted, self.blob_client, self._spool.name, self.keyring, max_concurrency=self.max_concurrency
+            )
+            size = cipher.encrypted_size
+            run = dict(run, encryption=cipher.describe())
+            os.unlink(self._spool.name)
+            self._spool = None
+        else:
+            for future in self._staging:
+                future.result()
+            self._pool.shutdown()
+            result = self.with_retries(self.blob_client.commit_block_list, self._block_ids)
+            size = run['file_size_bytes']
+
+        name = manifest_name(run['backup_name'])
+        self.with_retries(
+            self.container_client.get_blob_client(name).upload_blob, encode_manifest(run, members), overwrite=True
+        )
+        last_modified = result.get('last_modified')
+        last_modified = last_modified.isoformat() if last_modified else datetime.now().isoformat()
+        ContainerIndex(self.container_client).update(added=[{
+            'name': run['backup_name'],
+            'size_bytes': size,
+            'created': last_modified,
+            'last_modified': last_modified,
+            'tier': None,
+            'backup_type': 'directory_zip',
+            'manifest': name
+        }])
+
+    def abort(self):
+        # Uncommitted blocks are discarded by the service
+        if self._pool:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+        if self._spool:
+            self._spool.close()
+            os.unlink(self._spool.name)
+
+
+class _FanOut:
+    """Write-only stream that hashes the zip and hands it to every destination in chunks"""
+
+    def __init__(self, destinations, timer, chunk_size=None):
+        self.destinations = destinations
+        self.timer = timer
+        self.chunk_size = chunk_size or CHUNK_SIZE
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._emit(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buffer:
+            self._emit(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _emit(self, chunk):
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        if not any(not d.failed for d in self.destinations):
+            raise RuntimeError("Every replication destination failed")
+        with self.timer.stage('backpressure'):
+            for destination in self.destinations:
+                destination.put(chunk)
+
+
+def replicate(source_dirs, destinations, backup_name=None):
+    """
+    Compress source_dirs once and copy the archive to every destination
+
+    Archive members are named relative to each source directory's parent,
+    as in local backups.
+
+    Args:
+        source_dirs: Directories to back up
+        destinations: Destination instances
+        backup_name: Archive name (default backup_<timestamp>.zip)
+
+    Returns:
+        dict: Run summary with one result per destination; status is
+            'success', 'partial' (some destinations failed) or 'failed'
+    """
+    if not destinations:
+        raise ValueError("No replication destinations given")
+
+    started_at = time.time()
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    backup_name = backup_name or f"backup_{timestamp}.zip"
+    timer = StageTimer()
+
+    logger.info(f"🔁 Replicating {', '.join(map(str, source_dirs))} to {len(destinations)} destinations as {backup_name}")
+
+    for destination in destinations:
+        destination.start(backup_name)
+
+    stream = _FanOut(destinations, timer)
+    members = []
+    total_size = 0
+    try:
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for source_dir in source_dirs:
+                source_path = Path(source_dir)
+                if not source_path.exists():
+                    logger.warning(f"Source directory not found: {source_dir}")
+                    continue
+
+                for root, dirs, files in timer.iterate('scan', os.walk(source_path)):
+                    for file in files:
+                        file_path = Path(root) / file
+                        arcname = file_path.relative_to(source_path.parent)
+                        with timer.stage('compress'):
+                            zipf.write(file_path, arcname)
+                        info = zipf.infolist()[-1]
+                        members.append({
+                            'member': info.filename,
+                            'original_file': str(file_path),
+                            'file_size_bytes': info.file_size,
+                            'crc32': info.CRC,
+                            'mtime': file_path.stat().st_mtime
+                        })
+                        total_size += info.file_size
+        stream.close()
+    except Exception as e:
+        logger.error(f"❌ Replication source failed: {str(e)}")
+        for destination in destinations:
+            destination.put(None)
+        for destination in destinations:
+            destination.join()
+        raise
+
+    run = {
+        'backup_name': backup_name,
+        'backup_type': 'directory_zip',
+        'directory': ', '.join(map(str, source_dirs)),
+        'source_dirs': [str(d) for d in source_dirs],
+        'timestamp': timestamp,
+        'started_at': started_at,
+        'files_backed_up': len(members),
+        'total_size_bytes': total_size,
+        'file_size_bytes': stream.size,
+        'file_size_mb': round(stream.size / (1024 * 1024), 2),
+        'file_hash': stream.sha256.hexdigest(),
+        'timings': timer.breakdown(),
+        'status': 'success'
+    }
+    commit = _Commit(run, members)
+    with timer.stage('commit'):
+        for destination in destinations:
+            destination.put(commit)
+        for destination in destinations:
+            destination.join()
+
+    results = [destination.result() for destination in destinations]
+    succeeded = sum(1 for r in results if r['status'] == 'success')
+    summary = dict(
+        run,
+        status='success' if succeeded == len(results) else 'partial' if succeeded else 'failed',
+        timings=timer.breakdown(),
+        total_time_seconds=round(time.time() - started_at, 2),
+        destinations=results
+    )
+
+    logger.info(f"✅ Replication finished: {succeeded} of {len(results)} destinations in {summary['total_time_seconds']} seconds")
+    return summary
+
+
+def destination_from_spec(spec):
+    """
+    Build a destination from a spec string:
+        local[:DIR]              the local backups directory (default: BACKUP_CONFIG)
+        azure[:CONTAINER]        AZURE_STORAGE_CONNECTION_STRING, container default AZURE_CONTAINER_NAME
+        simulator:ROOT[:CONTAINER]
+    """
+    kind, _, rest = spec.partition(':')
+    if kind == 'local':
+        return LocalDestination(rest or None)
+
+    from backup_crypto import Keyring
+    if kind == 'azure':
+        connection_string = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
+        if not connection_string:
+            raise ValueError("AZURE_STORAGE_CONNECTION_STRING not set")
+        container_name = rest or os.getenv('AZURE_CONTAINER_NAME', 'backups')
+    elif kind == 'simulator':
+        root, _, container_name = rest.partition(':')
+        if not root:
+            raise ValueError("simulator destinations need a root directory: simulator:ROOT[:CONTAINER]")
+        connection_string = f"UseSimulator=true;Root={root}"
+        container_name = container_name or os.getenv('AZURE_CONTAINER_NAME', 'backups')
+    else:
+        raise ValueError(f"Unknown replication destination: {spec}")
+    return BlobDestination(connection_string, container_name, keyring=Keyring.from_env())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Back up once, replicate to several destinations")
+    parser.add_argument('command', choices=['run'])
+    parser.add_argument('--to', action='append', dest='destinations',
+                        help="Destination spec (repeatable): local[:DIR], azure[:CONTAINER], simulator:ROOT[:CONTAINER]")
+    parser.add_argument('--source', action='append', dest='sources', help="Source directory (default: BACKUP_CONFIG source_dirs)")
+    args = parser.parse_args()
+
+    specs = args.destinations or [s.strip() for s in os.getenv('REPLICATION_DESTINATIONS', 'local,azure').split(',') if s.strip()]
+    sources = args.sources
+    if not sources:
+        sys.path.insert(0, str(Path(__file__).parent / "app"))
+        from config import BACKUP_CONFIG
+        sources = BACKUP_CONFIG["source_dirs"]
+
+    summary = replicate(sources, [destination_from_spec(spec) for spec in specs])
+    print(json.dumps(summary, indent=2, default=str))
+    sys.exit(0 if summary['status'] == 'success' else 1)
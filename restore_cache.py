@@ -0,0 +1,227 @@
+"""
+Local disk cache for backups downloaded from Azure Storage
+Size-bounded LRU, safe to share between processes
+"""
+import os
+import hashlib
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Unfinished downloads older than this are removed during eviction
+STALE_TEMP_SECONDS = 24 * 60 * 60
+
+
+class RestoreCache:
+    """Content-addressed cache of downloaded blobs
+
+    Entries are keyed by blob name plus ETag, so a blob that is overwritten
+    gets a new entry and stale copies age out. Access updates the entry's
+    mtime, which is what eviction orders by.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._thread_lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """Create a cache from RESTORE_CACHE_DIR, or return None if it is not set"""
+        cache_dir = os.getenv('RESTORE_CACHE_DIR')
+        if not cache_dir:
+            return None
+        max_mb = int(os.getenv('RESTORE_CACHE_MAX_MB', '10240'))
+        return cls(cache_dir, max_mb * 1024 * 1024)
+
+    @staticmethod
+    def key(blob_name, etag):
+        """Cache key for a blob version"""
+        return hashlib.sha256(f"{blob_name}\0{etag}".encode('utf-8')).hexdigest()
+
+    def contains(self, key):
+        return os.path.exists(self._entry_path(key))
+
+    def fetch(self, key, dest_path, copy=shutil.copyfile):
+        """
+        Copy a cached entry to dest_path
+
+        copy(src, dst) may transform the entry on the way out, e.g. decrypt it.
+
+        Returns:
+            bool: True on a cache hit
+        """
+        entry_path = self._entry_path(key)
+        with self._lock(shared=True):
+            try:
+                copy(entry_path, dest_path)
+                os.utime(entry_path)
+            except FileNotFoundError:
+                return False
+        logger.info(f"⚡ Restore cache hit: {key[:12]}")
+        return True
+
+    def populate(self, key, write_to, dest_path=None, copy=shutil.copyfile):
+        """
+        Fill a cache entry by calling write_to(file) and optionally copy it out
+
+        The download goes to a temporary file first, so concurrent readers
+        never see a partial entry.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                write_to(tmp)
+            if dest_path:
+                copy(tmp_path, dest_path)
+            self._commit(tmp_path, key)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    @contextmanager
+    def tee(self):
+        """
+        Collect a blob's bytes while they upload, for an entry keyed once the upload returns its ETag
+
+        Yields a CacheTee; set its key when the upload succeeded. Caching is
+        best effort: if the copy can't be written the entry is skipped and
+        the upload carries on.
+        """
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        except OSError as e:
+            logger.warning(f"⚠️  Restore cache unavailable: {str(e)}")
+            yield CacheTee(None)
+            return
+        tee = CacheTee(os.fdopen(fd, 'wb'))
+        try:
+            with tee.file:
+                yield tee
+            if tee.key and not tee.failed:
+                try:
+                    self._commit(tmp_path, tee.key)
+                except OSError as e:
+                    logger.warning(f"⚠️  Failed to add upload to the restore cache: {str(e)}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def _commit(self, tmp_path, key):
+        """Move a finished download into place and evict old entries"""
+        size = os.path.getsize(tmp_path)
+        if size > self.max_bytes:
+            logger.info(f"Restore cache: {size} bytes exceeds the cache size, not cached")
+            return
+        with self._lock(shared=False):
+            os.replace(tmp_path, self._entry_path(key))
+            self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits (lock held)"""
+        entries = []
+        total = 0
+        now = time.time()
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                stat = entry.stat()
+                if entry.name.endswith('.tmp'):
+                    if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                        os.unlink(entry.path)
+                    continue
+                if entry.name.endswith('.blob'):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.unlink(path)
+            total -= size
+            logger.info(f"🗑️  Restore cache evicted {os.path.basename(path)[:12]}")
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.blob")
+
+    @contextmanager
+    def _lock(self, shared):
+        """Cross-process lock on the cache directory (flock where available)"""
+        with self._thread_lock if not shared else nullcontext():
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.cache_dir, '.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class CacheTee:
+    """Copies the bytes of an upload into a pending cache entry, at their offsets in the blob
+
+    Parallel block uploads can share one. A write error drops the entry
+    rather than failing the upload.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.key = None
+        self.failed = file is None
+        self._lock = threading.Lock()
+
+    def write_at(self, offset, data):
+        with self._lock:
+            if self.failed:
+                return
+            try:
+                self.file.seek(offset)
+                self.file.write(data)
+            except OSError as e:
+                self.failed = True
+                logger.warning(f"⚠️  Restore cache copy dropped: {str(e)}")
+
+    def reader(self, stream):
+        """Wrap a stream that is about to be uploaded so every read is copied into the entry"""
+        return _TeeReader(stream, self)
+
+
+class _TeeReader:
+    """Seekable stream whose reads also go to a CacheTee; re-reads after a retry just overwrite"""
+
+    def __init__(self, stream, tee):
+        self._stream = stream
+        self._tee = tee
+
+    def read(self, size=-1):
+        offset = self._stream.tell()
+        data = self._stream.read(size)
+        self._tee.write_at(offset, data)
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._stream.seek(offset, whence)
+
+    def tell(self):
+        return self._stream.tell()
+
+    def fileno(self):
+        return self._stream.fileno()
@@ -0,0 +1,385 @@
+"""
+Backup Scheduler Daemon
+Runs backup jobs on cron schedules with jitter, concurrency caps per
+destination and restore-first priority
+
+Restore jobs are drills and the queue of restores waiting on archived
+backups (rehydrated_restores); with such jobs configured, one worker is
+kept free for them by default. Restores started from the API or the
+dashboard run in those processes and are not scheduled here.
+"""
+import os
+import sys
+import json
+import heapq
+import random
+import logging
+import argparse
+import itertools
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'scheduler_state.json')
+
+# Lower runs first
+PRIORITY = {'restore': 0, 'backup': 10}
+
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 6),
+)
+
+
+class CronExpression:
+    """Standard 5-field cron expression (minute hour day month weekday)"""
+
+    def __init__(self, expression):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+
+        self.fields = {}
+        for part, (name, low, high) in zip(parts, CRON_FIELDS):
+            values = self._parse_field(part, low, high if name != 'weekday' else 7)
+            if name == 'weekday' and 7 in values:
+                values = (values - {7}) | {0}  # 7 is also Sunday
+            self.fields[name] = values
+
+        # Like cron: when both day fields are restricted, either may match
+        self._day_restricted = parts[2] != '*'
+        self._weekday_restricted = parts[4] != '*'
+
+    @staticmethod
+    def _parse_field(part, low, high):
+        values = set()
+        for item in part.split(','):
+            step = 1
+            if '/' in item:
+                item, step_text = item.split('/', 1)
+                step = int(step_text)
+            if item == '*':
+                start, end = low, high
+            elif '-' in item:
+                start, end = (int(x) for x in item.split('-', 1))
+            else:
+                start = int(item)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Invalid cron field {part!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt):
+        day_ok = dt.day in self.fields['day']
+        weekday_ok = (dt.weekday() + 1) % 7 in self.fields['weekday']
+        if self._day_restricted and self._weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, dt):
+        """First matching minute strictly after dt"""
+        dt = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.fields['month']:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.fields['hour']:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.fields['minute']:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+
+class Job:
+    """A scheduled backup (or restore) job"""
+
+    def __init__(self, name, cron, action, kind='backup', destination='default', jitter_seconds=0):
+        self.name = name
+        self.cron = CronExpression(cron)
+        self.action = action
+        self.kind = kind
+        self.destination = destination
+        self.jitter_seconds = jitter_seconds
+        self.next_run = None
+        self.active = False
+
+    def schedule_after(self, dt):
+        """Set next_run to the next cron time after dt plus random jitter"""
+        jitter = random.uniform(0, self.jitter_seconds) if self.jitter_seconds else 0
+        self.next_run = self.cron.next_after(dt) + timedelta(seconds=jitter)
+        return self.next_run
+
+
+class Scheduler:
+    """
+    Dispatches job runs to worker threads
+
+    Restores always dequeue before backups, backups may not take the last
+    reserved_restore_workers slots, and a restore waiting on a destination
+    holds back backups to that destination.
+    """
+
+    def __init__(self, max_workers=4, destination_limits=None, default_destination_limit=None,
+                 reserved_restore_workers=0, catchup_spread_seconds=300, state_path=None):
+        self.max_workers = max_workers
+        self.destination_limits = destination_limits or {}
+        self.default_destination_limit = default_destination_limit or max_workers
+        self.reserved_restore_workers = min(reserved_restore_workers, max_workers - 1)
+        self.catchup_spread_seconds = catchup_spread_seconds
+        self.state_path = state_path or os.getenv('SCHEDULER_STATE_PATH', DEFAULT_STATE_PATH)
+
+        self.jobs = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._running = Counter()
+        self._running_by_destination = Counter()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def add_job(self, job):
+        self.jobs[job.name] = job
+
+    def submit(self, name, action, kind='backup', destination='default'):
+        """Queue a one-off run, e.g. an operator-triggered restore"""
+        with self._condition:
+            self._enqueue(name, action, kind, destination, job=None)
+            self._condition.notify_all()
+
+    def start(self):
+        """Schedule all jobs (catching up missed runs) and start dispatching"""
+        now = datetime.now()
+        state = self._load_state()
+
+        for job in self.jobs.values():
+            last_run = state.get(job.name)
+            if last_run and job.cron.next_after(datetime.fromisoformat(last_run)) < now:
+                # Missed while down: run once, spread out so restarts don't stampede
+                job.next_run = now + timedelta(seconds=random.uniform(0, self.catchup_spread_seconds))
+                logger.info(f"⏰ Catching up missed run of {job.name} at {job.next_run:%H:%M:%S}")
+            else:
+                job.schedule_after(now)
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info(f"🗓️  Scheduler started with {len(self.jobs)} jobs, {self.max_workers} workers")
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def join(self):
+        while self._thread and self._thread.is_alive():
+            self._thread.join(timeout=1)
+
+    def _run(self):
+        """Single loop that fires due jobs and hands queued runs to workers"""
+        with self._condition:
+            while not self._stopped:
+                now = datetime.now()
+                for job in self.jobs.values():
+                    if job.next_run <= now:
+                        # Skip the run if the previous one is still queued or running
+                        if not job.active:
+                            self._enqueue(job.name, job.action, job.kind, job.destination, job)
+                            self._record_run(job.name, now)
+                        else:
+                            logger.warning(f"⚠️  Skipping {job.name}: previous run still active")
+                        job.schedule_after(now)
+
+                while True:
+                    run = self._next_runnable()
+                    if run is None:
+                        break
+                    self._start(run)
+
+                next_due = min((job.next_run for job in self.jobs.values()), default=now + timedelta(minutes=1))
+                self._condition.wait(timeout=max((next_due - datetime.now()).total_seconds(), 0.01))
+
+    def _enqueue(self, name, action, kind, destination, job):
+        if job:
+            job.active = True
+        run = {'name': name, 'action': action, 'kind': kind, 'destination': destination, 'job': job}
+        heapq.heappush(self._queue, (PRIORITY.get(kind, PRIORITY['backup']), next(self._sequence), run))
+        logger.info(f"📥 Queued {kind} {name} ({destination})")
+
+    def _next_runnable(self):
+        """Pop the highest-priority run that fits the concurrency caps (lock held)"""
+        total_running = sum(self._running.values())
+        if total_running >= self.max_workers:
+            return None
+
+        blocked_by_restores = set()
+        for entry in sorted(self._queue):
+            run = entry[2]
+            destination = run['destination']
+            limit = self.destination_limits.get(destination, self.default_destination_limit)
+            destination_full = self._running_by_destination[destination] >= limit
+
+            if run['kind'] == 'restore':
+                if destination_full:
+                    blocked_by_restores.add(destination)
+                    continue
+            else:
+                if destination_full or destination in blocked_by_restores:
+                    continue
+                if total_running >= self.max_workers - self.reserved_restore_workers:
+                    continue
+
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            return run
+        return None
+
+    def _start(self, run):
+        self._running[run['kind']] += 1
+        self._running_by_destination[run['destination']] += 1
+
+        def worker():
+            started = datetime.now()
+            logger.info(f"▶️  Running {run['kind']} {run['name']}")
+            try:
+                run['action']()
+                logger.info(f"✅ {run['name']} finished in {(datetime.now() - started).total_seconds():.1f}s")
+            except Exception as e:
+                logger.error(f"❌ {run['name']} failed: {str(e)}")
+            finally:
+                with self._condition:
+                    self._running[run['kind']] -= 1
+                    self._running_by_destination[run['destination']] -= 1
+                    if run['job']:
+                        run['job'].active = False
+                    self._condition.notify_all()
+
+        threading.Thread(target=worker, name=f"job-{run['name']}", daemon=True).start()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _record_run(self, name, when):
+        """Persist the last fire time of a job, used to detect missed runs"""
+        state = self._load_state()
+        state[name] = when.isoformat()
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+
+def build_action(job_config):
+    """Turn a job entry from the config file into a callable, its destination and its kind"""
+    job_type = job_config['type']
+
+    if job_type in ('local_backup', 'drill'):
+        sys.path.insert(0, str(Path(__file__).parent / "app"))
+        from backup import BackupSystem as LocalBackupSystem
+        if job_type == 'local_backup':
+            return (lambda: LocalBackupSystem().create_backup()), 'local', 'backup'
+        from restore import RestoreSystem
+        from drill import DrillRunner
+        cloud = job_config.get('cloud', False)
+        action = lambda: DrillRunner(LocalBackupSystem(), RestoreSystem()).run(job_config.get('backup'), cloud=cloud)
+        return action, 'azure' if cloud else 'local', 'restore'
+
+    from backup_system import BackupSystem
+    if job_type == 'rehydrated_restores':
+        # Restores queued while their backups were archived
+        return (lambda: BackupSystem().tiering.process_pending()), 'azure', 'restore'
+    path = job_config['path']
+    if job_type == 'cloud_directory':
+        create_zip = job_config.get('create_zip', True)
+        return (lambda: BackupSystem().backup_directory(path, create_zip=create_zip)), 'azure', 'backup'
+    if job_type == 'cloud_file':
+        return (lambda: BackupSystem().backup_file(path)), 'azure', 'backup'
+    raise ValueError(f"Unknown job type: {job_type}")
+
+
+def load_scheduler(config_path):
+    """
+    Build a Scheduler from a JSON config file
+
+    Example:
+        {
+          "max_workers": 4,
+          "reserved_restore_workers": 1,
+          "destination_limits": {"azure": 2, "local": 1},
+          "catchup_spread_seconds": 600,
+          "jobs": [
+            {"name": "local-nightly", "type": "local_backup", "cron": "0 2 * * *", "jitter_seconds": 900},
+            {"name": "docs", "type": "cloud_directory", "path": "/data/docs", "cron": "*/30 * * * *"},
+            {"name": "rehydrated", "type": "rehydrated_restores", "cron": "*/5 * * * *"},
+            {"name": "weekly-drill", "type": "drill", "cron": "0 4 * * 0", "cloud": true}
+          ]
+        }
+
+    reserved_restore_workers defaults to 1 when there are restore jobs
+    and to 0 otherwise.
+    """
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    jobs = []
+    for job_config in config['jobs']:
+        action, destination, kind = build_action(job_config)
+        jobs.append(Job(
+            job_config['name'],
+            job_config['cron'],
+            action,
+            kind=job_config.get('kind', kind),
+            destination=job_config.get('destination', destination),
+            jitter_seconds=job_config.get('jitter_seconds', 0),
+        ))
+
+    has_restores = any(job.kind == 'restore' for job in jobs)
+    scheduler = Scheduler(
+        max_workers=config.get('max_workers', 4),
+        destination_limits=config.get('destination_limits'),
+        default_destination_limit=config.get('default_destination_limit'),
+        reserved_restore_workers=config.get('reserved_restore_workers', 1 if has_restores else 0),
+        catchup_spread_seconds=config.get('catchup_spread_seconds', 300),
+        state_path=config.get('state_path'),
+    )
+    for job in jobs:
+        scheduler.add_job(job)
+    return scheduler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backup scheduler daemon")
+    parser.add_argument('--config', default=os.getenv('SCHEDULER_CONFIG', 'scheduler.json'))
+    parser.add_argument('--list', action='store_true', help="Print the next run of each job and exit")
+    args = parser.parse_args()
+
+    scheduler = load_scheduler(args.config)
+    if args.list:
+        now = datetime.now()
+        for job in scheduler.jobs.values():
+            print(f"{job.name}: {job.cron.expression} -> next {job.cron.next_after(now)} (+ up to {job.jitter_seconds}s jitter)")
+    else:
+        scheduler.start()
+        try:
+            scheduler.join()
+        except KeyboardInterrupt:
+            scheduler.stop()
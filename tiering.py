@@ -0,0 +1,312 @@
+"""
+Storage tier management for aging backups
+Moves backups to Cool and Archive by age and access, and queues restores of
+archived backups until they are rehydrated
+"""
+import os
+import json
+import logging
+import threading
+import time
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from bundles import INDEX_NAME
+from manifest import is_internal_blob
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TIER_ORDER = {'Hot': 0, 'Cool': 1, 'Cold': 2, 'Archive': 3}
+
+# Blob Batch API limit per request
+MAX_BATCH_SIZE = 256
+
+# Documented upper bounds for rehydration from the Archive tier
+REHYDRATE_ESTIMATE = {'Standard': timedelta(hours=15), 'High': timedelta(hours=1)}
+
+DEFAULT_QUEUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'rehydration_queue.json')
+
+
+class RehydrationPendingError(RuntimeError):
+    """The backup is archived; its rehydration has started and the restore is queued
+
+    entry is the queued restore, as listed by TieringEngine.pending_restores().
+    """
+
+    def __init__(self, entry):
+        super().__init__(
+            f"Backup {entry['backup_name']} is archived, restore to {entry['restored_to']} "
+            f"queued until it is rehydrated (estimated by {entry['estimated_ready_by']})"
+        )
+        self.entry = entry
+
+
+def rehydration_entry(backup_name, restore_path, priority, kind='file', **details):
+    """
+    Queue entry for a restore waiting on a rehydration
+
+    kind is the restore to run once the blob is readable: 'file',
+    'directory' (a zip backup) or 'bundled_file' (details carry its
+    backup_prefix and relative_path).
+    """
+    requested = datetime.now(timezone.utc)
+    return dict(
+        details,
+        backup_name=backup_name,
+        restored_to=restore_path,
+        kind=kind,
+        requested_at=requested.isoformat(),
+        rehydrate_priority=priority,
+        estimated_ready_by=(requested + REHYDRATE_ESTIMATE.get(priority, REHYDRATE_ESTIMATE['Standard'])).isoformat(),
+        status='rehydrating'
+    )
+
+
+class RestoreQueue:
+    """Restores waiting on rehydrations, in a JSON file shared by threads and processes"""
+
+    def __init__(self, queue_path=None):
+        self.queue_path = queue_path or os.getenv('REHYDRATION_QUEUE_PATH', DEFAULT_QUEUE_PATH)
+        self._lock = threading.Lock()
+
+    def add(self, entry):
+        """Queue a restore unless the same one is already waiting"""
+        with self._locked():
+            queue = self._load()
+            if not any(q['backup_name'] == entry['backup_name'] and q['restored_to'] == entry['restored_to'] for q in queue):
+                queue.append(entry)
+                self._save(queue)
+
+    def entries(self):
+        with self._locked():
+            return self._load()
+
+    def remove(self, done):
+        """Drop entries by (backup_name, restored_to), keeping any queued meanwhile"""
+        with self._locked():
+            self._save([q for q in self._load() if (q['backup_name'], q['restored_to']) not in done])
+
+    @contextmanager
+    def _locked(self):
+        """Lock the queue against other threads and processes"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.queue_path) or '.', exist_ok=True)
+            with open(f"{self.queue_path}.lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.queue_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def _save(self, queue):
+        os.makedirs(os.path.dirname(self.queue_path) or '.', exist_ok=True)
+        tmp_path = f"{self.queue_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(queue, f, indent=2)
+        os.replace(tmp_path, self.queue_path)
+
+
+class TieringPolicy:
+    """Age and idle-time thresholds (in days) for moving backups to colder tiers"""
+
+    def __init__(self, cool_after_days=30, archive_after_days=90, min_idle_days=7, rehydrate_priority='Standard'):
+        self.cool_after_days = cool_after_days
+        self.archive_after_days = archive_after_days
+        self.min_idle_days = min_idle_days
+        self.rehydrate_priority = rehydrate_priority
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            cool_after_days=int(os.getenv('TIER_COOL_AFTER_DAYS', '30')),
+            archive_after_days=int(os.getenv('TIER_ARCHIVE_AFTER_DAYS', '90')),
+            min_idle_days=int(os.getenv('TIER_MIN_IDLE_DAYS', '7')),
+            rehydrate_priority=os.getenv('REHYDRATE_PRIORITY', 'Standard'),
+        )
+
+    def target_tier(self, age_days, idle_days):
+        """Coldest tier a backup qualifies for, or None to leave it in Hot"""
+        if idle_days < self.min_idle_days:
+            return None
+        if age_days >= self.archive_after_days:
+            return 'Archive'
+        if age_days >= self.cool_after_days:
+            return 'Cool'
+        return None
+
+
+class TieringEngine:
+    """Applies a TieringPolicy to a BackupSystem's container"""
+
+    def __init__(self, backup_system, policy=None, queue_path=None):
+        self.backup_system = backup_system
+        self.container_client = backup_system.container_client
+        self.policy = policy or TieringPolicy.from_env()
+        self.queue = RestoreQueue(queue_path)
+
+    def plan(self, now=None):
+        """
+        Work out which backups should move to a colder tier
+
+        Returns:
+            dict: Target tier -> list of blob names
+        """
+        now = now or datetime.now(timezone.utc)
+        plan = {'Cool': [], 'Archive': []}
+
+        for blob in self.container_client.list_blobs():
+            # Manifests, indexes and legacy sidecars are small and read often, keep them hot
+            if is_internal_blob(blob.name) or blob.name.endswith(INDEX_NAME) or blob.archive_status:
+                continue
+
+            created = blob.creation_time or blob.last_modified
+            last_access = max(filter(None, (blob.last_accessed_on, blob.last_modified)))
+            target = self.policy.target_tier((now - created).days, (now - last_access).days)
+
+            current = blob.blob_tier or 'Hot'
+            if target and TIER_ORDER[target] > TIER_ORDER.get(current, 0):
+                plan[target].append(blob.name)
+
+        return plan
+
+    def apply(self, plan=None):
+        """
+        Change tiers in batches of up to 256 blobs per request
+
+        Returns:
+            dict: Target tier -> number of blobs moved
+        """
+        plan = plan if plan is not None else self.plan()
+        moved = {}
+
+        changed = {}
+        for tier, names in plan.items():
+            moved[tier] = 0
+            for start in range(0, len(names), MAX_BATCH_SIZE):
+                batch = names[start:start + MAX_BATCH_SIZE]
+                responses = self.container_client.set_standard_blob_tier_blobs(
+                    tier, *batch, raise_on_any_failure=False
+                )
+                for name, response in zip(batch, responses):
+                    if 200 <= response.status_code < 300:
+                        moved[tier] += 1
+                        changed[name] = {'tier': tier}
+                    else:
+                        logger.warning(f"⚠️  Failed to move {name} to {tier}: {response.reason}")
+
+            if moved[tier]:
+                logger.info(f"🧊 Moved {moved[tier]} backups to {tier}")
+
+        if changed:
+            self.backup_system.index.update(changed=changed)
+        return moved
+
+    def queue_restore(self, backup_name, restore_path, properties=None, kind='file', **details):
+        """
+        Start rehydrating an archived backup and queue its restore
+
+        Returns:
+            dict: Queued restore information
+        """
+        blob_client = self.container_client.get_blob_client(backup_name)
+        properties = properties or blob_client.get_blob_properties()
+        priority = self.policy.rehydrate_priority
+
+        if not properties.archive_status:
+            blob_client.set_standard_blob_tier('Hot', rehydrate_priority=priority)
+            logger.info(f"🔥 Rehydrating {backup_name} ({priority} priority)")
+
+        entry = rehydration_entry(backup_name, restore_path, priority, kind, **details)
+        self.queue.add(entry)
+
+        logger.info(f"⏳ Restore of archived backup queued: {backup_name} -> {restore_path}")
+        return entry
+
+    def pending_restores(self):
+        return self.queue.entries()
+
+    def process_pending(self):
+        """
+        Run queued restores whose backups have finished rehydrating
+
+        Returns:
+            list: Restore results for the restores that ran
+        """
+        queue = self.queue.entries()
+
+        results = []
+        done = set()
+        for entry in queue:
+            blob_client = self.container_client.get_blob_client(entry['backup_name'])
+            properties = blob_client.get_blob_properties()
+            if properties.archive_status or properties.blob_tier == 'Archive':
+                continue
+            self.backup_system.index.update(changed={entry['backup_name']: {'tier': properties.blob_tier}})
+
+            try:
+                results.append(self._restore(entry))
+            except RehydrationPendingError:
+                # Archived again since the check; the restore queued itself anew
+                continue
+            except Exception as e:
+                logger.error(f"❌ Queued restore of {entry['backup_name']} failed: {str(e)}")
+                results.append(dict(entry, status='failed', error=str(e)))
+            done.add((entry['backup_name'], entry['restored_to']))
+
+        self.queue.remove(done)
+        return results
+
+    def _restore(self, entry):
+        kind = entry.get('kind', 'file')
+        if kind == 'directory':
+            return self.backup_system.restore_directory(entry['backup_name'], entry['restored_to'])
+        if kind == 'bundled_file':
+            return self.backup_system.restore_bundled_file(entry['backup_prefix'], entry['relative_path'], entry['restored_to'])
+        return self.backup_system.restore_file(entry['backup_name'], entry['restored_to'])
+
+    def run(self, interval=300):
+        """Apply the policy and process queued restores every interval seconds"""
+        logger.info(f"🧊 Tiering engine started (every {interval}s)")
+        while True:
+            try:
+                self.apply()
+                self.process_pending()
+            except Exception as e:
+                logger.error(f"❌ Tiering pass failed: {str(e)}")
+            time.sleep(interval)
+
+
+if __name__ == '__main__':
+    from backup_system import BackupSystem
+
+    parser = argparse.ArgumentParser(description="Backup storage tier management")
+    parser.add_argument('command', choices=['plan', 'apply', 'pending', 'process', 'run'])
+    parser.add_argument('--interval', type=int, default=300, help="Seconds between passes for 'run'")
+    args = parser.parse_args()
+
+    engine = BackupSystem().tiering
+    if args.command == 'plan':
+        print(json.dumps(engine.plan(), indent=2))
+    elif args.command == 'apply':
+        print(json.dumps(engine.apply(), indent=2))
+    elif args.command == 'pending':
+        print(json.dumps(engine.pending_restores(), indent=2))
+    elif args.command == 'process':
+        print(json.dumps(engine.process_pending(), indent=2))
+    else:
+        engine.run(args.interval)
@@ -0,0 +1,394 @@
+"""Point-in-time File Version Index
+
+SQLite index of every file version across local and cloud backups, so
+"config.json as of last Tuesday 14:00" is one indexed lookup instead of
+opening archives one at a time. Backups are added as they are created and
+sync() picks up anything missed.
+
+    python version_index.py sync [--cloud]
+    python version_index.py versions config.json
+    python version_index.py at config.json "2024-05-14 14:00"
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import zipfile
+import argparse
+import datetime
+import posixpath
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    backup_name TEXT NOT NULL,
+    backup_time REAL NOT NULL,
+    indexed_at REAL NOT NULL,
+    UNIQUE (source, backup_name)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    backup_id INTEGER NOT NULL,
+    backup_time REAL NOT NULL,
+    source TEXT NOT NULL,
+    archive TEXT,
+    member TEXT,
+    offset INTEGER,
+    size INTEGER,
+    hash TEXT,
+    mtime REAL,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS versions_path ON versions (path, backup_time);
+CREATE INDEX IF NOT EXISTS versions_name ON versions (name);
+CREATE INDEX IF NOT EXISTS versions_backup ON versions (backup_id);
+"""
+
+VERSION_COLUMNS = ("path", "name", "backup_id", "backup_time", "source", "archive", "member",
+                   "offset", "size", "hash", "mtime", "deleted")
+
+RESULT_COLUMNS = ("path", "backup_name", "backup_time", "source", "archive", "member",
+                  "offset", "size", "hash", "mtime", "deleted")
+
+
+class VersionIndex:
+    """Maps each file path to its versions (backup, member, size, hash, mtime)
+
+    Local paths are zip member names (e.g. sample_data/config.json), cloud
+    paths are the original file paths. Lookups accept either a full path or
+    a trailing part of one, such as a bare file name.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def is_indexed(self, source, backup_name):
+        row = self._conn.execute(
+            "SELECT 1 FROM backups WHERE source = ? AND backup_name = ?", (source, backup_name)
+        ).fetchone()
+        return row is not None
+
+    def add_local_backup(self, backup_dir, metadata):
+        """Index a local backup from its .meta contents and zip directories"""
+        backup_dir = Path(backup_dir)
+        backup_name = metadata["backup_name"]
+        backup_time = _local_backup_time(metadata)
+
+        if (backup_dir / backup_name).is_dir():
+            archives = [f"{backup_name}/{shard['archive']}" for shard in metadata["shards"]]
+        else:
+            archives = [backup_name]
+
+        rows = {}
+        for archive in archives:
+            with zipfile.ZipFile(backup_dir / archive, 'r') as zipf:
+                for member in zipf.infolist():
+                    if member.is_dir():
+                        continue
+                    rows[member.filename] = {
+                        "path": member.filename,
+                        "archive": archive,
+                        "member": member.filename,
+                        "size": member.file_size,
+                        "hash": f"crc32:{member.CRC:08x}",
+                        "mtime": time.mktime(member.date_time + (0, 0, -1)),
+                    }
+
+        if metadata.get("backup_type") == "incremental":
+            deleted = metadata.get("deleted", [])
+        else:
+            # A full backup is a snapshot: files it no longer has were deleted
+            deleted = sorted(self._live_paths("local", backup_time) - rows.keys())
+
+        for path in deleted:
+            rows[path] = {"path": path, "deleted": 1}
+
+        self._add_backup("local", backup_name, backup_time, rows.values())
+
+    def add_cloud_run(self, manifest, run, files):
+        """Index a cloud backup run from its manifest"""
+        backup_time = _parse_time(run["timestamp"])
+        rows = []
+        for entry in files:
+            path = entry.get("original_file")
+            if not path:
+                continue
+            if "member" in entry:
+                # Member of a directory zip (or of one shard of a distributed backup)
+                archive, file_hash = entry.get("shard") or run["backup_name"], f"crc32:{entry['crc32']:08x}"
+            else:
+                archive, file_hash = entry.get("bundle") or entry["backup_name"], f"sha256:{entry['file_hash']}"
+            rows.append({
+                "path": path,
+                "archive": archive,
+                "member": entry.get("member"),
+                "offset": entry.get("bundle_offset"),
+                "size": entry.get("file_size_bytes"),
+                "hash": file_hash,
+                "mtime": entry.get("mtime"),
+            })
+        self._add_backup("cloud", manifest, backup_time, rows)
+
+    def remove_backup(self, source, backup_name):
+        with self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM backups WHERE source = ? AND backup_name = ?", (source, backup_name)
+            ).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM versions WHERE backup_id = ?", row)
+                self._conn.execute("DELETE FROM backups WHERE id = ?", row)
+
+    def sync_local(self, backup_dir):
+        """
+        Index local backups that are not indexed yet and drop removed ones
+
+        Returns:
+            int: Number of backups added
+        """
+        backup_dir = Path(backup_dir)
+        on_disk = {}
+        for metadata_file in backup_dir.glob("backup_*.meta"):
+            if metadata_file.with_suffix('').exists():
+                with open(metadata_file, 'r') as f:
+                    metadata = json.load(f)
+                on_disk[metadata["backup_name"]] = metadata
+
+        for (backup_name,) in self._conn.execute("SELECT backup_name FROM backups WHERE source = 'local'").fetchall():
+            if backup_name not in on_disk:
+                self.remove_backup("local", backup_name)
+
+        added = 0
+        # Oldest first, so full backups see the state they replace
+        for metadata in sorted(on_disk.values(), key=_local_backup_time):
+            if self.is_indexed("local", metadata["backup_name"]):
+                continue
+            try:
+                self.add_local_backup(backup_dir, metadata)
+                added += 1
+            except (OSError, zipfile.BadZipFile, KeyError) as e:
+                logging.warning(f"Could not index {metadata['backup_name']}: {str(e)}")
+        return added
+
+    def sync_cloud(self, backup_system):
+        """
+        Index cloud backup runs listed in the container index
+
+        Returns:
+            int: Number of runs added
+        """
+        entries, _ = backup_system.index.load()
+        manifests = {entry["manifest"] for entry in entries or [] if entry.get("manifest")}
+
+        for (manifest,) in self._conn.execute("SELECT backup_name FROM backups WHERE source = 'cloud'").fetchall():
+            if manifest not in manifests:
+                self.remove_backup("cloud", manifest)
+
+        added = 0
+        for manifest in sorted(manifests):
+            if self.is_indexed("cloud", manifest):
+                continue
+            run, files = backup_system.get_manifest(manifest[len("_manifests/"):-len(".json.gz")])
+            self.add_cloud_run(manifest, run, files)
+            added += 1
+        return added
+
+    def resolve(self, path):
+        """Indexed paths matching path exactly, or ending with it"""
+        path = path.replace(os.sep, "/")
+        if self._conn.execute("SELECT 1 FROM versions WHERE path = ? LIMIT 1", (path,)).fetchone():
+            return [path]
+        name = posixpath.basename(path.rstrip("/"))
+        suffix = "/" + path.lstrip("/")
+        candidates = self._conn.execute("SELECT DISTINCT path FROM versions WHERE name = ?", (name,)).fetchall()
+        return sorted(p for (p,) in candidates if ("/" + p.lstrip("/")).endswith(suffix))
+
+    def versions(self, path):
+        """
+        Every recorded version of path, oldest first
+
+        Returns:
+            list: Version dicts (path, backup_name, backup_time, source, archive,
+                  member, offset, size, hash, mtime, deleted)
+        """
+        results = []
+        for resolved in self.resolve(path):
+            results.extend(self._query(
+                "WHERE v.path = ? ORDER BY v.backup_time", (resolved,)
+            ))
+        return sorted(results, key=lambda v: (v["backup_time"], v["path"]))
+
+    def at(self, path, when):
+        """
+        State of path at a point in time: the newest version backed up at
+        or before when, or None if it did not exist (or was deleted)
+
+        Returns:
+            list: One version dict per matching path that existed at when
+        """
+        when = when.timestamp() if isinstance(when, datetime.datetime) else float(when)
+        results = []
+        for resolved in self.resolve(path):
+            latest = self._query(
+                "WHERE v.path = ? AND v.backup_time <= ? ORDER BY v.backup_time DESC LIMIT 1", (resolved, when)
+            )
+            if not latest or latest[0]["deleted"]:
+                continue
+            # A directory deleted later than the version removes it too
+            parents = _parents(resolved)
+            if parents:
+                placeholders = ",".join("?" * len(parents))
+                removed = self._conn.execute(
+                    f"SELECT 1 FROM versions WHERE path IN ({placeholders}) AND deleted = 1 "
+                    "AND source = ? AND backup_time > ? AND backup_time <= ? LIMIT 1",
+                    (*parents, latest[0]["source"], latest[0]["backup_time"], when)
+                ).fetchone()
+                if removed:
+                    continue
+            results.append(latest[0])
+        return results
+
+    def stats(self):
+        backups, versions = self._conn.execute(
+            "SELECT (SELECT COUNT(*) FROM backups), (SELECT COUNT(*) FROM versions)"
+        ).fetchone()
+        paths = self._conn.execute("SELECT COUNT(DISTINCT path) FROM versions").fetchone()[0]
+        return {"backups": backups, "versions": versions, "paths": paths}
+
+    def _add_backup(self, source, backup_name, backup_time, rows):
+        with self._conn:
+            existing = self._conn.execute(
+                "SELECT id FROM backups WHERE source = ? AND backup_name = ?", (source, backup_name)
+            ).fetchone()
+            if existing:
+                self._conn.execute("DELETE FROM versions WHERE backup_id = ?", existing)
+                self._conn.execute("DELETE FROM backups WHERE id = ?", existing)
+            backup_id = self._conn.execute(
+                "INSERT INTO backups (source, backup_name, backup_time, indexed_at) VALUES (?, ?, ?, ?)",
+                (source, backup_name, backup_time, time.time())
+            ).lastrowid
+            self._conn.executemany(
+                f"INSERT INTO versions ({', '.join(VERSION_COLUMNS)}) VALUES ({', '.join('?' * len(VERSION_COLUMNS))})",
+                (
+                    (row["path"], posixpath.basename(row["path"].rstrip("/")), backup_id, backup_time, source,
+                     row.get("archive"), row.get("member"), row.get("offset"), row.get("size"),
+                     row.get("hash"), row.get("mtime"), row.get("deleted", 0))
+                    for row in rows
+                )
+            )
+        logging.info(f"Version index: added {source} backup {backup_name}")
+
+    def _live_paths(self, source, before):
+        """Paths whose newest version from source before a time is not a deletion"""
+        rows = self._conn.execute(
+            "SELECT v.path, v.deleted FROM versions v JOIN ("
+            "  SELECT path, MAX(backup_time) AS latest FROM versions"
+            "  WHERE source = ? AND backup_time < ? GROUP BY path"
+            ") m ON v.path = m.path AND v.backup_time = m.latest WHERE v.source = ?",
+            (source, before, source)
+        )
+        return {path for path, deleted in rows if not deleted}
+
+    def _query(self, where, params):
+        rows = self._conn.execute(
+            "SELECT v.path, b.backup_name, v.backup_time, v.source, v.archive, v.member, "
+            "v.offset, v.size, v.hash, v.mtime, v.deleted "
+            f"FROM versions v JOIN backups b ON b.id = v.backup_id {where}",
+            params
+        ).fetchall()
+        return [dict(zip(RESULT_COLUMNS, row)) for row in rows]
+
+
+def _local_backup_time(metadata):
+    if "started_at" in metadata:
+        return metadata["started_at"]
+    return datetime.datetime.strptime(metadata["timestamp"], "%Y-%m-%d_%H-%M-%S").timestamp()
+
+
+def _parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def _parents(path):
+    parts = path.split("/")[:-1]
+    return ["/".join(parts[:i]) for i in range(1, len(parts) + 1) if "/".join(parts[:i])]
+
+
+def _format_version(version):
+    when = datetime.datetime.fromtimestamp(version["backup_time"]).strftime("%Y-%m-%d %H:%M:%S")
+    if version["deleted"]:
+        return f"{when}  {version['source']:5}  {version['backup_name']}  deleted"
+    location = version["archive"] or version["backup_name"]
+    if version["member"]:
+        location = f"{location}:{version['member']}"
+    return f"{when}  {version['source']:5}  {location}  {version['size']} bytes  {version['hash']}"
+
+
+if __name__ == "__main__":
+    # The local backup configuration lives in app/config.py
+    sys.path.insert(0, str(Path(__file__).resolve().parent / "app"))
+    from config import BACKUP_CONFIG, LOG_CONFIG
+
+    logging.basicConfig(
+        filename=LOG_CONFIG["log_file"],
+        level=LOG_CONFIG["log_level"],
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description="Point-in-time file version index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="Index new backups")
+    sync_parser.add_argument("--cloud", action="store_true", help="Also index Azure backups")
+    versions_parser = subparsers.add_parser("versions", help="List the versions of a path")
+    versions_parser.add_argument("path")
+    at_parser = subparsers.add_parser("at", help="Show a path as it was at a point in time")
+    at_parser.add_argument("path")
+    at_parser.add_argument("time", help="ISO date/time, e.g. '2024-05-14 14:00'")
+    args = parser.parse_args()
+
+    index = VersionIndex(BACKUP_CONFIG["version_index_path"])
+
+    if args.command == "sync":
+        added = index.sync_local(BACKUP_CONFIG["backup_location"])
+        print(f"✅ Indexed {added} local backups")
+        if args.cloud:
+            from backup_system import BackupSystem as CloudBackupSystem
+            added = index.sync_cloud(CloudBackupSystem())
+            print(f"✅ Indexed {added} cloud backup runs")
+        print(json.dumps(index.stats()))
+    elif args.command == "versions":
+        index.sync_local(BACKUP_CONFIG["backup_location"])
+        versions = index.versions(args.path)
+        if not versions:
+            print(f"❌ No versions of {args.path}")
+            sys.exit(1)
+        current_path = None
+        for version in versions:
+            if version["path"] != current_path:
+                current_path = version["path"]
+                print(f"📄 {current_path}")
+            print(f"   {_format_version(version)}")
+    else:
+        index.sync_local(BACKUP_CONFIG["backup_location"])
+        when = datetime.datetime.fromisoformat(args.time)
+        versions = index.at(args.path, when)
+        if not versions:
+            print(f"❌ {args.path} did not exist at {when}")
+            sys.exit(1)
+        for version in versions:
+            print(f"📄 {version['path']}")
+            print(f"   {_format_version(version)}")